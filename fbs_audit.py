@@ -6,750 +6,1366 @@
 # date: 7/9/2020
 # version: 1
 
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
 import sys
-import arcpy
+import tempfile
+import numpy
+
+from fbs_backend import BACKENDS, ArcpyBackend, arcpy
+from fbs_cache import SampleCache
+from fbs_catalog import Catalog
+from fbs_export import EXPORT_FORMATS, export_test_points
+from fbs_geometry import (EdgeIndex, PointIndex, convex_hull, densify, nearest_distinct,
+                          points_along_line, points_in_polygon)
+from fbs_profile import StageProfiler
+from fbs_raster import (BlockCache, MinMaxPyramid, TiledRaster, ingest_pyramid, ingest_raster,
+                        morton_key, sample_rasters, window_min_max, window_min_max_radii)
+from fbs_scenarios import parse_scenarios, scenario_table, write_scenario_table
+from fbs_stages import Stage, StageGraph
+from fbs_storage import IntermediateStore
+from fbs_summary import (COUNT_COLUMNS, REACH_COLUMNS, SUMMARY_FIELDS, failure_reaches,
+                         group_counts, write_report, write_table)
+
+# Radius of the circle around a failed point searched for the DEM MinElev/MaxElev (38 feet across)
+BUFFER_RADIUS_FEET = 19
+
+# Vertex spacing of the densified Profile Baselines used to find the nearest water names
+NEAR_SPACING_FEET = 10
+
+# Test Point spacing along the Flood Lines and their starting RiskClass and Tolerance
+TEST_POINT_SPACING_FEET = 100
+DEFAULT_RISK_CLASS = 'A'
+DEFAULT_TOLERANCE = 1.0
+
+# Width and height of the tiles the Test_Points are split into for parallel processing
+TILE_SIZE_FEET = 10000
+
+# Vertex tolerance for matching the SFHA lines to the flood polygon boundaries
+TOPOLOGY_TOLERANCE_FEET = 0.01
+
+# Bit masks of the flood zones in the topology edge index, other zones get OTHER_ZONE_MASK
+ZONE_MASKS = {'A': 1, 'AE': 2}
+OTHER_ZONE_MASK = 4
+
+# The Pass/Fail, Exception, Risk Class and Tolerance Domains of FBS_Audit.gdb
+DOMAINS = [("PassFail", "PassFail", "TEXT",
+            {"P": "Pass", "F": "Fail", "NA": "NA", "U": "Unknown"}),
+           ("Exception", "Exception", "TEXT",
+            {"PFD": "PFD Exception", "Erosion": "Erosion Exception",
+             "Runup": "Runup Exception", "Combined": "Combined Exception",
+             "OT": "OT Exception", "River_Coast": "River Coast Exception"}),
+           ("RiskClass", "Risk Class", "TEXT",
+            {"A": "A", "B": "B", "C": "C", "D": "D", "E": "E"}),
+           ("Tolerance", "Tolerance", "FLOAT", {"1.0": "1.0", "0.5": "0.5"})]
+
+# Fields of the Test_Points as (name, type, AddField options).  Screened is 1 where the DEM pyramid
+# decided the second pass without reading the window, those points keep a NULL MinElev/MaxElev
+FLOAT_OPTIONS = {'field_precision': 6, 'field_scale': 2}
+TEST_POINT_FIELDS = [("LineID", "LONG", {}),
+                     ("Station", "DOUBLE", {}),
+                     ("LineHash", "TEXT", {'field_length': 40}),
+                     ("WTR_NM_1", "TEXT", {'field_length': 100}),
+                     ("WTR_NM_2", "TEXT", {'field_length': 100}),
+                     ("FldELEV", "FLOAT", FLOAT_OPTIONS),
+                     ("MinElev", "FLOAT", FLOAT_OPTIONS),
+                     ("MaxElev", "FLOAT", FLOAT_OPTIONS),
+                     ("GrELEV", "FLOAT", FLOAT_OPTIONS),
+                     ("ElevDIFF", "FLOAT", FLOAT_OPTIONS),
+                     ("Screened", "SHORT", {}),
+                     ("RiskClass", "TEXT", {'field_length': 2, 'field_domain': "RiskClass"}),
+                     ("Tolerance", "FLOAT", dict(FLOAT_OPTIONS, field_domain="Tolerance")),
+                     ("Status", "TEXT", {'field_length': 2, 'field_domain': "PassFail"}),
+                     ("Validation", "TEXT", {'field_length': 20, 'field_domain': "Exception"}),
+                     ("Comment", "TEXT", {'field_length': 100})]
+
+# Intermediate datasets that can be kept in FBS_Audit.gdb instead of memory
+SFHA_DATASETS = ['SFHA_Lines', 'SFHA_Areas']
+
+# Block caches of the worker process by size in MB.  Every tile the worker audits uses the same
+# cache, so the blocks read for one tile stay cached for the neighbouring tiles
+WORKER_BLOCK_CACHES = {}
+
+
+def audit_tile(tile):
+    """Samples, classifies and second passes the Test_Points of one tile in a worker process
+
+    tile is a (dem, wsel, x_coords, y_coords, tolerance, radius, block_cache_mb, pyramid,
+    cached) tuple.  The windows read from the rasters extend past the tile edges as needed, so
+    the tiles don't need an overlap.  With a block_cache_mb the tiles a worker audits share one
+    block cache, so the second pass and the next tiles reuse the blocks of the sampling.  With a
+    MinMaxPyramid it only reads the windows the pyramid can't decide, leaving the
+    MinElev/MaxElev of the points it decides NULL and their Screened 1.
+    cached is None or the (values, found) arrays of the GrELEV, FldELEV, MinElev and MaxElev
+    sample cache entries, one row each, and only the values not found are read.  Returns the
+    (GrELEV, FldELEV, MinElev, MaxElev, ElevDIFF, Screened, Status) arrays of the tile's points,
+    a boolean array of the points whose window was read and the tile's (block cache hits, block
+    cache misses, points screened, points failed) counts.
+    """
+    in_dem, in_wsel, x_coords, y_coords, tolerance, radius, block_cache_mb, pyramid, cached = tile
+    if block_cache_mb is not None and block_cache_mb not in WORKER_BLOCK_CACHES:
+        WORKER_BLOCK_CACHES[block_cache_mb] = BlockCache(block_cache_mb)
+    block_cache = WORKER_BLOCK_CACHES.get(block_cache_mb)
+    block_counts = (block_cache.hits, block_cache.misses) if block_cache is not None else (0, 0)
+    if cached is None:
+        cached = (numpy.full((4, len(x_coords)), numpy.nan),
+                  numpy.zeros((4, len(x_coords)), dtype=bool))
+    values, found = cached
+
+    # Sample the rasters at the points missing from the cache and classify the points
+    gr_elev = values[0].copy()
+    fld_elev = values[1].copy()
+    sampled = ~(found[0] & found[1])
+    if sampled.any():
+        gr_elev[sampled], fld_elev[sampled] = sample_rasters(
+            [in_dem, in_wsel], x_coords[sampled], y_coords[sampled], block_cache)
+    min_elev = numpy.full(x_coords.shape, numpy.nan)
+    max_elev = numpy.full(x_coords.shape, numpy.nan)
+    elev_diff, status = classify_points(fld_elev, gr_elev, min_elev, max_elev, tolerance,
+                                        numpy.full(x_coords.shape, ''))
+
+    # Second pass on the failed points, from the cache where it has their window
+    failed = status == 'F'
+    window_found = failed & found[2] & found[3]
+    min_elev[window_found] = values[2][window_found]
+    max_elev[window_found] = values[3][window_found]
+    window_read = failed & ~window_found
+    screened_pass = numpy.zeros(x_coords.shape, dtype=bool)
+    screened = numpy.full(x_coords.shape, numpy.nan)
+    if window_read.any():
+        min_elev[window_read], max_elev[window_read], decided, screened_pass[window_read] = \
+            screened_min_max(pyramid, lambda window_x, window_y: window_min_max(
+                in_dem, window_x, window_y, radius, block_cache),
+                x_coords[window_read], y_coords[window_read], radius, fld_elev[window_read],
+                tolerance[window_read])
+        screened[window_read] = numpy.where(decided, 1, numpy.nan)
+        window_read[window_read] = ~decided
+    if failed.any():
+        elev_diff, status = classify_points(fld_elev, gr_elev, min_elev, max_elev, tolerance,
+                                            status, screened_pass)
+
+    # The hits and misses of this tile only
+    if block_cache is not None:
+        block_counts = (block_cache.hits - block_counts[0], block_cache.misses - block_counts[1])
+    return (gr_elev, fld_elev, min_elev, max_elev, elev_diff, screened, status), window_read, \
+        block_counts + (int((screened == 1).sum()), int(failed.sum()))
+
+
+def classify_points(fld_elev, gr_elev, min_elev, max_elev, tolerance, status,
+                    screened_pass=None):
+    """Vectorized Pass/Fail/Unknown/NA classification of the Test_Points
+
+    Gives the same ElevDIFF and Status values as the original row by row UpdateCursor.  The
+    incoming status is the value from the previous run and is only used to decide if the
+    MinElev/MaxElev second pass applies.  screened_pass marks the points the DEM pyramid showed
+    to be within their MinElev/MaxElev range without reading it.  Returns the (ElevDIFF, Status)
+    arrays.
+    """
+    # Cursors return FLOAT fields as Python floats, so do the math in float64 to match them
+    fld_elev = numpy.asarray(fld_elev, dtype=numpy.float64)
+    gr_elev = numpy.asarray(gr_elev, dtype=numpy.float64)
+    min_elev = numpy.asarray(min_elev, dtype=numpy.float64)
+    max_elev = numpy.asarray(max_elev, dtype=numpy.float64)
+    tolerance = numpy.asarray(tolerance, dtype=numpy.float64)
+
+    fld_nodata = fld_elev == -9999
+    gr_nodata = gr_elev == -9999
+    difference = numpy.abs(fld_elev - gr_elev)
+
+    # Default everything to FAIL, then apply the branches from last to first
+    elev_diff = difference.copy()
+    new_status = numpy.full(fld_elev.shape, 'F', dtype='<U2')
+
+    # If ABS(FldELEV - GrELEV) <= Tolerance: PASS
+    passed = difference <= tolerance
+    new_status[passed] = 'P'
+
+    # If FldElev == -9999 and GrElev == -9999: N/A
+    both_nodata = fld_nodata & gr_nodata
+    elev_diff[both_nodata] = 0
+    new_status[both_nodata] = 'NA'
+
+    # If only one of FldElev or GrElev is -9999: Unknown
+    one_nodata = fld_nodata ^ gr_nodata
+    elev_diff[one_nodata] = -9999
+    new_status[one_nodata] = 'U'
+
+    # If MinElev and MaxElev are populated and the previous Status is 'F' and FldELEV is
+    # within the MinElev/MaxElev range: PASS
+    in_range = (~numpy.isnan(min_elev) & ~numpy.isnan(max_elev) &
+                (numpy.asarray(status) == 'F'))
+    in_range[in_range] = ((min_elev[in_range] - tolerance[in_range] <= fld_elev[in_range]) &
+                          (fld_elev[in_range] <= max_elev[in_range] + tolerance[in_range]))
+    if screened_pass is not None:
+        in_range |= numpy.asarray(screened_pass) & (numpy.asarray(status) == 'F')
+    elev_diff[in_range] = -9999
+    new_status[in_range] = 'P'
+
+    return elev_diff, new_status
+
+
+def screened_min_max(pyramid, window_function, x_coords, y_coords, radius, fld_elev, tolerance):
+    """Returns the (MinElev, MaxElev, decided, passed) arrays of the second pass of failed points
+
+    With a MinMaxPyramid the points it decides keep a NULL MinElev/MaxElev, since its bounds
+    aren't the window's, and passed marks the ones that pass.  Only the others are passed to
+    window_function(x_coords, y_coords) for their full resolution min/max.  Without one every
+    point is.
+    """
+    min_elev = numpy.full(len(x_coords), numpy.nan)
+    max_elev = numpy.full(len(x_coords), numpy.nan)
+    if pyramid is None:
+        decided = passed = numpy.zeros(len(x_coords), dtype=bool)
+    else:
+        decided, passed = pyramid.screen(x_coords, y_coords, radius, fld_elev, tolerance)
+    if not decided.all():
+        min_elev[~decided], max_elev[~decided] = window_function(x_coords[~decided],
+                                                                 y_coords[~decided])
+
+    return min_elev, max_elev, decided, passed
 
 
 class FbsAudit:
     """ Performs an Flood Boundary Standard on FEMA Flood Polygons"""
 
-    def __init__(self, in_dem, in_wsel, in_workspace, outfolder):
+    def __init__(self, in_dem, in_wsel, in_workspace, outfolder, backend=None):
         """Receives the DEM, flood lines, flood polygons, water lines and cross sections"""
+        self.backend = backend or ArcpyBackend()  # Geoprocessing backend, arcpy by default
+        self.block_cache = None  # Optional BlockCache of raster blocks
+        self.catalog = Catalog(self.backend)  # Finds and describes the inputs once
         self.cross_sections = ''  # Cross sections
         self.dem = in_dem  # The terrain DEM
+        self.dem_pyramid = None  # MinMaxPyramid of the DEM, built by build_dem_pyramid
         self.fld_lines = ''  # Flood lines
+        self.fingerprints = {}  # Fingerprints of the DEM, WSEL and flood polygons
         self.fld_polys = ''  # Flood polygons
+        self.input_keys = {}  # Fingerprint of every input for the stage checkpoints
         self.outfolder = outfolder  # The output folder for the data
+        self.intermediates = IntermediateStore(
+            self.backend, outfolder + '\\FBS_Audit.gdb',
+            tempfile.gettempdir())  # Where SFHA_Lines and SFHA_Areas are kept
         self.profile_baselines = ''  # Profile Baselines
+        self.raster_cache = None  # Optional folder of TiledRaster caches of the DEM and WSEL
+        self.raster_keys = {}  # Raster fingerprints used as sample cache keys
+        self.reach_hulls = None  # Water name to its reach hulls, built by build_reach_hulls
+        self.sample_cache = None  # Optional SampleCache of raster values
+        self.scenarios = []  # Scenarios swept after the audit, see fbs_scenarios
+        self.screen = False  # Screen the second pass with a min/max pyramid of the DEM
+        self.screen_counts = [0, 0]  # Failed points decided by the pyramid and failed points
+        self.summary_by_line = False  # Also group the compliance summary by flood line
+        self.tiled_rasters = {}  # TiledRasters of the raster cache by raster path
+        self.where_clause = None  # Test_Points still to audit after an incremental update
         self.workspace = in_workspace  # Workspace of the data
         self.wsel = in_wsel  # The WSEL Grid
 
-
-        # Set the Workspace
-        arcpy.env.workspace = self.workspace
-
         # Get the location of the needed feature classes
         if self.workspace[-4:] in ['.gdb', '.mdb']:
             self.database_table_check()
         else:
             self.shapefile_table_check()
 
-    def add_ground_elevations_area(self):
-        """Add ground elevation values from the DEM to Buffers_3D feature class"""
+    def add_elevations_points(self, where_clause=None):
+        """Add ground and WSEL elevation values to Test_Points feature class in a single pass
 
-        # Check to see if any buffers exists, if not return
-        if not arcpy.Exists(self.outfolder + '\\FBS_Audit.gdb\\Buffers_3D'):
-            return
+        A resumed run resamples Test_Points classified against an earlier DEM or WSEL, so their
+        MinElev, MaxElev, ElevDIFF, Screened and Status are cleared for calc_difference and the
+        second pass to start over.
+        """
+        test_points = self.outfolder + '\\FBS_Audit.gdb\\Test_Points'
+
+        # Bilinear sample the DEM and WSEL grid at every point, NoData values are returned as -9999
+        points = self.backend.read_fields(test_points, ['SHAPE@X', 'SHAPE@Y'], where_clause)
+        gr_elev, fld_elev = self.cached_sample_rasters([self.dem, self.wsel],
+                                                       points['SHAPE@X'], points['SHAPE@Y'])
 
-        # Add Surface Information
-        arcpy.AddSurfaceInformation_3d(self.outfolder + '\\FBS_Audit.gdb\\Buffers_3D',
-                                       self.dem, 'Z_MIN;Z_MAX', 'BILINEAR')
-
-        # Update Test_Points based on the Buffers_3D values
-        if arcpy.Exists('test_points_lyr'):
-            arcpy.Delete_management('test_points_lyr')
-        if arcpy.Exists('buffers_3d_lyr'):
-            arcpy.Delete_management('buffers_3d_lyr')
-
-        arcpy.MakeFeatureLayer_management(
-            self.outfolder + '\\FBS_Audit.gdb\\Test_Points', 'test_points_lyr')
-        arcpy.MakeFeatureLayer_management(
-            self.outfolder + '\\FBS_Audit.gdb\\Buffers_3D', 'buffers_3d_lyr')
-
-        arcpy.JoinField_management('test_points_lyr', 'OBJECTID', 'buffers_3d_lyr', 'ORIG_FID',
-                                   'Z_Min;Z_Max')
-
-        # Calculate the MinElev and MaxElev fields
-        arcpy.CalculateField_management(self.outfolder + '\\FBS_Audit.gdb\\Test_Points',
-                                        'MinElev', '!Z_Min!', 'PYTHON')
-
-        arcpy.CalculateField_management(self.outfolder + '\\FBS_Audit.gdb\\Test_Points',
-                                        'MaxElev', '!Z_Max!', 'PYTHON')
-
-        # Recalculate the values
-        self.calc_difference()
-
-    def add_ground_elevations_points(self):
-        """Add ground elevation values from the DEM to Test_Points feature class"""
-        # Add Surface Information
-        arcpy.ddd.AddSurfaceInformation(self.outfolder + '\\FBS_Audit.gdb\\Test_Points',
-                                        self.dem, 'Z', 'BILINEAR')
-
-        # Values stored in GrdELEV field
-        arcpy.CalculateField_management(self.outfolder + '\\FBS_Audit.gdb\\Test_Points',
-                                        'GrELEV', '!Z!', 'PYTHON')
-
-        # Calculate all the NULL GrdElev values to -9999
-        if arcpy.Exists("point_lyr"):
-            arcpy.Delete_management("point_lyr")
-        arcpy.MakeFeatureLayer_management(self.outfolder + '\\FBS_Audit.gdb\\Test_Points',
-                                          "point_lyr", "GrELEV IS NULL")
-        arcpy.CalculateField_management('point_lyr', 'GrELEV', '-9999', 'PYTHON')
-
-        # Drop the Z field
-        arcpy.DeleteField_management(self.outfolder + '\\FBS_Audit.gdb\\Test_Points', 'Z')
-
-    def add_wsel_elevations_points(self):
-        """Add WSEL elevation values to Test_Points feature class"""
-        # Add Surface Information
-        arcpy.ddd.AddSurfaceInformation(self.outfolder + '\\FBS_Audit.gdb\\Test_Points',
-                                        self.wsel, 'Z', 'BILINEAR')
-
-        # Values stored in FldELEV field
-        arcpy.CalculateField_management(self.outfolder + '\\FBS_Audit.gdb\\Test_Points',
-                                        'FldELEV', '!Z!', 'PYTHON')
-
-        # Calculate all the NULL FldELEV values to -9999
-        if arcpy.Exists("point_lyr"):
-            arcpy.Delete_management("point_lyr")
-        arcpy.MakeFeatureLayer_management(self.outfolder + '\\FBS_Audit.gdb\\Test_Points',
-                                          "point_lyr", "FldELEV IS NULL")
-        arcpy.CalculateField_management('point_lyr', 'FldELEV', '-9999', 'PYTHON')
-
-        # Drop the Z field
-        arcpy.DeleteField_management(self.outfolder + '\\FBS_Audit.gdb\\Test_Points', 'Z')
+        # Values stored in GrELEV and FldELEV fields, the classification fields are NULL
+        no_values = numpy.full(len(points), numpy.nan)
+        self.backend.write_fields(test_points, points['OID@'],
+                                  {'GrELEV': gr_elev, 'FldELEV': fld_elev,
+                                   'MinElev': no_values, 'MaxElev': no_values,
+                                   'ElevDIFF': no_values, 'Screened': no_values,
+                                   'Status': numpy.full(len(points), None, dtype=object)})
 
     def assign_water_names(self):
         """Attribute the WTR_NM_1 and WTR_NM_2 field in Test_Points"""
-        # Get a list of unique waternames
-        water_names = sorted(list(
-            set([(row[0]) for row in arcpy.da.SearchCursor(self.cross_sections, 'WTR_NM')])))
-
-        # Iterate through the water names
-        for water_name in water_names:
-            self.printer("\t{}".format(water_name))
-
-            # Create the bounding box around the cross sections
-            self.create_bounding_box(water_name)
-
-            # Select all the Test Points that intersect the bounding box that don't have
-            # WTR_NM_1 populated
-            points_null = arcpy.MakeFeatureLayer_management(
-                self.outfolder + '\\FBS_Audit.gdb\\Test_Points', "points_null",
-                "WTR_NM_1 IS NULL")
+        test_points = self.outfolder + '\\FBS_Audit.gdb\\Test_Points'
 
-            arcpy.SelectLayerByLocation_management(
-                points_null, "INTERSECT", self.outfolder + '\\FBS_Audit.gdb\\bounding_box')
+        # The reach hulls of every water name
+        if self.reach_hulls is None:
+            self.build_reach_hulls()
 
-            arcpy.CalculateField_management(points_null, 'WTR_NM_1',
-                                            "'" + str(water_name) + "'", 'PYTHON')
+        # Index the Test Points once
+        points = self.backend.read_fields(test_points, ['SHAPE@X', 'SHAPE@Y'])
+        point_index = PointIndex(points['SHAPE@X'], points['SHAPE@Y'])
+        wtr_nm_1 = numpy.full(len(points), '', dtype='<U100')
+        wtr_nm_2 = numpy.full(len(points), '', dtype='<U100')
 
-            # Select all the Test Points that intersect the bounding box that have WTR_NM_1
-            # populated and WTR_NM_2 is null and the water name doesn't equal WTR_NM_1
-            points_null_2 = arcpy.MakeFeatureLayer_management(
-                self.outfolder + '\\FBS_Audit.gdb\\Test_Points', "points_null_2",
-                "WTR_NM_1 IS NOT NULL AND WTR_NM_2 IS NULL AND WTR_NM_1 <> '" + water_name + "'")
+        # Iterate through the water names
+        for water_name in sorted(self.reach_hulls):
+            self.printer("\t{}".format(water_name))
+            reach_hulls = self.reach_hulls[water_name]
+            if not reach_hulls:
+                continue
+
+            # Find the Test Points that intersect any of the reach hulls
+            inside = numpy.zeros(len(points), dtype=bool)
+            for hull in reach_hulls:
+                candidates = point_index.query(hull[:, 0].min(), hull[:, 1].min(),
+                                               hull[:, 0].max(), hull[:, 1].max())
+                inside[candidates[points_in_polygon(points['SHAPE@X'][candidates],
+                                                    points['SHAPE@Y'][candidates],
+                                                    [hull])]] = True
+            inside = numpy.nonzero(inside)[0]
+
+            # Points without WTR_NM_1 get the water name, points with a different WTR_NM_1 and
+            # no WTR_NM_2 get it as their second name
+            first = inside[wtr_nm_1[inside] == '']
+            second = inside[(wtr_nm_1[inside] != '') & (wtr_nm_2[inside] == '') &
+                            (wtr_nm_1[inside] != water_name)]
+            wtr_nm_1[first] = water_name
+            wtr_nm_2[second] = water_name
+
+        # Write both names back in one pass, unassigned names stay NULL
+        self.backend.write_fields(
+            test_points, points['OID@'],
+            {'WTR_NM_1': numpy.where(wtr_nm_1 == '', None, wtr_nm_1.astype(object)),
+             'WTR_NM_2': numpy.where(wtr_nm_2 == '', None, wtr_nm_2.astype(object))})
 
-            points_sel_2 = arcpy.SelectLayerByLocation_management(
-                points_null_2, "INTERSECT", self.outfolder + '\\FBS_Audit.gdb\\bounding_box')
+    def assign_water_names_near(self):
+        """Assigns water names to the Test Points based on the nearest Profile Baselines"""
+        test_points = self.outfolder + '\\FBS_Audit.gdb\\Test_Points'
 
-            arcpy.CalculateField_management(points_sel_2,
-                                            'WTR_NM_2', "'" + str(water_name) + "'", 'PYTHON')
+        # Densify the Profile Baselines into one vertex array with a water name per vertex
+        spacing = NEAR_SPACING_FEET * 0.3048 / \
+            self.catalog.meters_per_unit(self.profile_baselines)
+        vertex_list = []
+        name_list = []
+        for oid, parts, wkb, values in self.backend.read_shapes(self.profile_baselines, ['WTR_NM']):
+            if values[0] is None:
+                continue
+            for part in parts:
+                vertices = densify(part, spacing)
+                vertex_list.append(vertices)
+                name_list.extend([values[0]] * len(vertices))
+
+        if not vertex_list:
+            return
 
-            # Delete all the temporary layers and bounding_box
-            arcpy.Delete_management("points_null")
-            arcpy.Delete_management("points_null_2")
+        # Nearest and second nearest distinct water name for every point
+        points = self.backend.read_fields(test_points, ['SHAPE@X', 'SHAPE@Y'])
+        water_names, name_ids = numpy.unique(numpy.array(name_list, dtype=object).astype(str),
+                                             return_inverse=True)
+        first_ids, second_ids = nearest_distinct(
+            numpy.concatenate(vertex_list), name_ids,
+            numpy.column_stack([points['SHAPE@X'], points['SHAPE@Y']]))
+
+        water_names = numpy.append(water_names.astype(object), None)
+        self.backend.write_fields(test_points, points['OID@'],
+                                  {'WTR_NM_1': water_names[first_ids],
+                                   'WTR_NM_2': water_names[second_ids]})
+
+    def audit_points_tiled(self, processes=None, where_clause=None):
+        """Samples, classifies and second passes the Test_Points tile by tile across processes
+
+        Does the work of add_elevations_points, calc_difference and check_failed_points with the
+        tiles spread over a process pool.  The results are merged back in tile order and written
+        to Test_Points in one pass.
+        """
+        test_points = self.outfolder + '\\FBS_Audit.gdb\\Test_Points'
+        points = self.backend.read_fields(test_points, ['SHAPE@X', 'SHAPE@Y', 'Tolerance'],
+                                          where_clause)
+        if len(points) == 0:
+            return
 
-    def assign_water_names_near(self):
-        """Assigns water names to the Test Points based on a Near Table"""
-        # Remove the Near Table if it already exists
-        if arcpy.Exists(self.outfolder + '\\FBS_Audit.gdb\\Near_Table'):
-            arcpy.Delete_management(self.outfolder + '\\FBS_Audit.gdb\\Near_Table')
-
-        # Remove Test_Point layer if it exists
-        if arcpy.Exists('test_point_layer'):
-            arcpy.Delete_management('test_point_layer')
-
-        # Create Test_Point layer
-        test_point_layer = arcpy.MakeFeatureLayer_management(
-            self.outfolder + '\\FBS_Audit.gdb\\Test_Points', 'test_point_layer')
-
-        # Remove S_Profil_Balsn layer if it exists
-        if arcpy.Exists('profil_basln_layer'):
-            arcpy.Delete_management('profil_basln_layer')
-
-        # Create S_Profil_Basln layer
-        profil_basln_layer = arcpy.MakeFeatureLayer_management(
-            self.profile_baselines, 'profil_basln_layer')
-
-        # Generate Near Table
-        arcpy.GenerateNearTable_analysis(test_point_layer, profil_basln_layer,
-                                         self.outfolder + '\\FBS_Audit.gdb\\Near_Table',
-                                         closest='CLOSEST', method='PLANAR')
-
-        # Remove Near_Table layer if it exists
-        if arcpy.Exists('near_table_layer'):
-            arcpy.Delete_management('near_table_layer')
-
-        # Create Near_Table layer
-        near_table_layer = arcpy.MakeTableView_management(
-            self.outfolder + '\\FBS_Audit.gdb\\Near_Table', 'near_table_layer')
-
-        # Run Add Join Near Table to Test Points based on IN_FID
-        arcpy.JoinField_management(
-            test_point_layer, 'OBJECTID', near_table_layer, 'IN_FID', ['IN_FID', 'NEAR_FID'])
-
-        # Join S_Profil_Basln to Test Points based on NEAR_FID
-        if str(self.profile_baselines).endswith(".shp"):
-            id_field = "FID"
+        # Sizes in the linear unit of the DEM's projected coordinate system
+        meters_per_unit = self.catalog.meters_per_unit(self.dem)
+        radius = BUFFER_RADIUS_FEET * 0.3048 / meters_per_unit
+        tile_size = TILE_SIZE_FEET * 0.3048 / meters_per_unit
+
+        # Give every point to the tile it falls in, with the tiles in Morton order so the
+        # neighbouring tiles are handed out together
+        x_coords = points['SHAPE@X'].astype(numpy.float64)
+        y_coords = points['SHAPE@Y'].astype(numpy.float64)
+        tile_cols = numpy.floor((x_coords - x_coords.min()) / tile_size).astype(numpy.int64)
+        tile_rows = numpy.floor((y_coords - y_coords.min()) / tile_size).astype(numpy.int64)
+        tile_keys = morton_key(tile_rows, tile_cols)
+        order = numpy.argsort(tile_keys, kind='stable')
+        tile_starts = numpy.unique(tile_keys[order], return_index=True)[1]
+        tile_members = numpy.split(order, tile_starts[1:])
+        in_dem = self.raster(self.dem)
+        in_wsel = self.raster(self.wsel)
+        block_cache_mb = self.block_cache.max_mb if self.block_cache is not None else None
+
+        # The workers can't share the sample cache connection, so the values it already holds
+        # are looked up here and the tiles only read the rest
+        cached = None
+        if self.sample_cache is not None:
+            entries = self.sample_cache_entries(radius)
+            values = numpy.full((4, len(points)), numpy.nan)
+            found = numpy.zeros((4, len(points)), dtype=bool)
+            for index, (raster_key, method) in enumerate(entries[:2]):
+                values[index], found[index] = self.sample_cache.lookup(raster_key, method,
+                                                                       x_coords, y_coords)
+
+            # Windows are only looked up for the points that fail on their cached samples
+            failed = found[0] & found[1] & (classify_points(
+                values[1], values[0], values[2], values[3], points['Tolerance'],
+                numpy.full(len(points), ''))[1] == 'F')
+            for index, (raster_key, method) in enumerate(entries[2:], 2):
+                values[index][failed], found[index][failed] = self.sample_cache.lookup(
+                    raster_key, method, x_coords[failed], y_coords[failed])
+            cached = (values, found)
+        tiles = [(in_dem, in_wsel, x_coords[members], y_coords[members],
+                  points['Tolerance'][members], radius, block_cache_mb, self.dem_pyramid,
+                  None if cached is None else (cached[0][:, members], cached[1][:, members]))
+                 for members in tile_members]
+
+        # Run the tiles across the process pool.  Inside ArcGIS sys.executable is the
+        # application, so point the workers at the Python interpreter
+        python_exe = os.path.join(sys.exec_prefix, 'python.exe')
+        if os.path.exists(python_exe):
+            multiprocessing.set_executable(python_exe)
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(audit_tile, tiles)
+
+        # Merge the tiles back into point order
+        columns = {'GrELEV': numpy.full(len(points), numpy.nan),
+                   'FldELEV': numpy.full(len(points), numpy.nan),
+                   'MinElev': numpy.full(len(points), numpy.nan),
+                   'MaxElev': numpy.full(len(points), numpy.nan),
+                   'ElevDIFF': numpy.full(len(points), numpy.nan),
+                   'Screened': numpy.full(len(points), numpy.nan),
+                   'Status': numpy.full(len(points), '', dtype='<U2')}
+        window_read = numpy.zeros(len(points), dtype=bool)
+        for members, (result, tile_window_read, counts) in zip(tile_members, results):
+            for field_name, values in zip(columns, result):
+                columns[field_name][members] = values
+            window_read[members] = tile_window_read
+            if self.block_cache is not None:
+                self.block_cache.hits += counts[0]
+                self.block_cache.misses += counts[1]
+            self.screen_counts[0] += counts[2]
+            self.screen_counts[1] += counts[3]
+
+        # Store the values the tiles read in the sample cache
+        if self.sample_cache is not None:
+            sampled = ~(cached[1][0] & cached[1][1])
+            for (raster_key, method), field_name, stored in zip(
+                    entries, ['GrELEV', 'FldELEV', 'MinElev', 'MaxElev'],
+                    [sampled, sampled, window_read, window_read]):
+                self.sample_cache.store(raster_key, method, x_coords[stored], y_coords[stored],
+                                        columns[field_name][stored])
+
+        self.backend.write_fields(test_points, points['OID@'], columns)
+
+    def audit_stages(self, fast_names=False, processes=1, incremental=False,
+                     export_format=None):
+        """Returns the stages of the audit in the order a serial run takes them
+
+        The checks and fingerprints always run first.  Building the reach hulls only needs the
+        cross sections, so it can run while the Test_Points are created and sampled.
+        """
+        gdb = self.outfolder + '\\FBS_Audit.gdb'
+        test_points = gdb + '\\Test_Points'
+        stages = [Stage('spatial_reference_check', "Checking spatial reference",
+                        self.spatial_reference_check, always=True),
+                  Stage('is_empty_table_check', "Checking for empty tables",
+                        self.is_empty_table_check, always=True),
+                  Stage('fingerprint_inputs', "Fingerprinting inputs", self.fingerprint_inputs,
+                        always=True)]
+
+        # An incremental run keeps the previous FBS_Audit.gdb
+        gdb_requires = []
+        if not incremental:
+            stages.append(Stage('create_file_geodatabase', "Creating file geodatabase",
+                                self.create_file_geodatabase, outputs=[gdb], resources=[gdb]))
+            gdb_requires = ['create_file_geodatabase']
+        points_requires = ['create_sfha_flood_lines'] + gdb_requires
+
+        stages += [Stage('create_sfha_flood_polys', "Creating SFHA polyons",
+                         self.create_sfha_flood_polys, gdb_requires, ['polygons']),
+                   Stage('create_sfha_flood_lines', "Creating SFHA lines",
+                         self.create_sfha_flood_lines, ['create_sfha_flood_polys'],
+                         ['lines'])]
+        if incremental:
+            stages.append(Stage('update_test_points', "Updating changed Test Points",
+                                self.refresh_test_points, points_requires,
+                                ['dem', 'wsel', 'polygons', 'lines'], [test_points], [gdb]))
+            points_stage = 'update_test_points'
         else:
-            id_field = "OBJECTID"
+            stages.append(Stage('create_test_points', "Creating Test Points",
+                                self.create_test_points, points_requires, [], [test_points],
+                                [gdb]))
+            points_stage = 'create_test_points'
+
+        # The DEM pyramid that screens the second pass.  It reads the DEM like the sampling
+        # does, so the two never run at once and the raster cache is only ingested once
+        pyramid_requires = []
+        sampling_resources = [gdb]
+        if self.screen:
+            stages.append(Stage('build_dem_pyramid', "Building DEM min/max pyramid",
+                                self.build_dem_pyramid, inputs=['dem'], resources=[self.dem]))
+            pyramid_requires = ['build_dem_pyramid']
+            sampling_resources = [gdb, self.dem]
+
+        # Sampling and classifying the Test_Points
+        if processes > 1:
+            stages.append(Stage('audit_points_tiled', "Auditing Test Points in tiles",
+                                lambda: self.audit_points_tiled(processes, self.where_clause),
+                                [points_stage] + pyramid_requires, ['dem', 'wsel'],
+                                [test_points], sampling_resources))
+            sampling_stage = 'audit_points_tiled'
+            names_requires = ['audit_points_tiled']
+        else:
+            stages += [Stage('add_elevations_points', "Add Ground and WSEL Elevations",
+                             lambda: self.add_elevations_points(self.where_clause),
+                             [points_stage], ['dem', 'wsel'], [test_points], sampling_resources),
+                       Stage('calc_difference', "Calculate differences",
+                             lambda: self.calc_difference(self.where_clause),
+                             ['add_elevations_points'], [], [test_points], [gdb]),
+                       Stage('check_failed_points', "Second Pass", self.check_failed_points,
+                             ['calc_difference'] + pyramid_requires, ['dem'], [test_points],
+                             [gdb])]
+            sampling_stage = 'add_elevations_points'
+            names_requires = ['check_failed_points']
+
+        # The scenarios only need the sampled GrELEV and FldELEV
+        if self.scenarios:
+            stages.append(Stage('sweep_scenarios', "Sweeping tolerance and buffer scenarios",
+                                self.sweep_scenarios, [sampling_stage], ['dem', 'scenarios'],
+                                [test_points, os.path.join(self.outfolder,
+                                                           'FBS_Audit_scenarios.csv')], [gdb]))
+
+        # Water names, from the reach hulls or the nearest profile baselines
+        if fast_names:
+            stages.append(Stage('assign_water_names_near', "Adding Water Names to Test_Points",
+                                self.assign_water_names_near, [points_stage] + names_requires,
+                                ['profile_baselines'], [test_points], [gdb]))
+            last_stage = 'assign_water_names_near'
+        else:
+            stages += [Stage('build_reach_hulls', "Building reach hulls", self.build_reach_hulls,
+                             inputs=['cross_sections']),
+                       Stage('assign_water_names', "Adding Water Names to Test_Points",
+                             self.assign_water_names,
+                             [points_stage, 'build_reach_hulls'] + names_requires, [],
+                             [test_points], [gdb])]
+            last_stage = 'assign_water_names'
+
+        # The compliance summary of the finished Test_Points
+        stages.append(Stage('summarize_compliance', "Summarizing compliance",
+                            self.summarize_compliance, [last_stage], ['summary_fields'],
+                            [os.path.join(self.outfolder, file_name)
+                             for file_name in ['FBS_Audit_summary.csv',
+                                               'FBS_Audit_failure_reaches.csv',
+                                               'FBS_Audit_report.json']], [gdb]))
+
+        if export_format:
+            stages.append(Stage('export_test_points', "Exporting Test_Points",
+                                lambda: self.export_test_points(export_format), [last_stage],
+                                [], [os.path.join(self.outfolder,
+                                                  'FBS_Audit_Test_Points' + export_format)]))
+
+        return stages
+
+    def build_dem_pyramid(self):
+        """Builds the min/max pyramid of the DEM, or maps the one of an earlier run
+
+        The pyramid is kept in the raster cache folder, or the temporary folder without one,
+        named by the DEM's fingerprint.
+        """
+        pyramid_path = os.path.join(self.raster_cache or tempfile.gettempdir(),
+                                    self.raster_key(self.dem) + '.fbsp')
+        if os.path.exists(pyramid_path):
+            self.dem_pyramid = MinMaxPyramid(pyramid_path)
+        else:
+            self.dem_pyramid = ingest_pyramid(self.raster(self.dem), pyramid_path)
+
+    def build_reach_hulls(self):
+        """Builds the reach hulls of every water name of the cross sections"""
+        water_names = sorted(set(
+            self.backend.read_fields(self.cross_sections, ['WTR_NM'])['WTR_NM'].tolist()) - {''})
+        self.reach_hulls = {water_name: self.create_bounding_box(water_name)
+                            for water_name in water_names}
+
+    def cached_sample_rasters(self, in_rasters, x_coords, y_coords):
+        """sample_rasters, checking the sample cache first and only reading the missing points"""
+        if self.sample_cache is None:
+            return sample_rasters([self.raster(in_raster) for in_raster in in_rasters],
+                                  x_coords, y_coords, self.block_cache)
+
+        # Look every raster up in the cache
+        results = []
+        found = []
+        for in_raster in in_rasters:
+            values, raster_found = self.sample_cache.lookup(self.raster_key(in_raster), 'BILINEAR',
+                                                            x_coords, y_coords)
+            results.append(values)
+            found.append(raster_found)
+
+        # Sample the points that any raster is missing from the rasters that are missing them
+        missing = ~numpy.logical_and.reduce(found)
+        missing_rasters = [index for index in range(len(in_rasters)) if not found[index].all()]
+        if missing_rasters:
+            sampled = sample_rasters([self.raster(in_rasters[index])
+                                      for index in missing_rasters],
+                                     x_coords[missing], y_coords[missing], self.block_cache)
+            for index, values in zip(missing_rasters, sampled):
+                results[index][missing] = values
+                self.sample_cache.store(self.raster_key(in_rasters[index]), 'BILINEAR',
+                                        x_coords[missing], y_coords[missing], values)
+
+        return results
+
+    def cached_window_min_max(self, x_coords, y_coords, radius):
+        """window_min_max of the DEM, checking the sample cache first"""
+        if self.sample_cache is None:
+            return window_min_max(self.raster(self.dem), x_coords, y_coords, radius,
+                                  self.block_cache)
+
+        (raster_key, min_method), (raster_key, max_method) = self.sample_cache_entries(radius)[2:]
+        min_elev, min_found = self.sample_cache.lookup(raster_key, min_method, x_coords, y_coords)
+        max_elev, max_found = self.sample_cache.lookup(raster_key, max_method, x_coords, y_coords)
+
+        # Read the windows of the points that are missing
+        missing = ~(min_found & max_found)
+        if missing.any():
+            min_elev[missing], max_elev[missing] = window_min_max(
+                self.raster(self.dem), x_coords[missing], y_coords[missing], radius,
+                self.block_cache)
+            self.sample_cache.store(raster_key, min_method, x_coords[missing], y_coords[missing],
+                                    min_elev[missing])
+            self.sample_cache.store(raster_key, max_method, x_coords[missing], y_coords[missing],
+                                    max_elev[missing])
+
+        return min_elev, max_elev
+
+    def calc_difference(self, where_clause=None):
+        """Calculates the absolute difference of the Flood Elevation and Ground Elevation values"""
+        test_points = self.outfolder + '\\FBS_Audit.gdb\\Test_Points'
 
-        arcpy.JoinField_management(
-            test_point_layer, 'NEAR_FID', profil_basln_layer, id_field, ['WTR_NM'])
+        # Read the needed fields into arrays.  NULL MinElev/MaxElev become NaN and NULL Status
+        # becomes an empty string so they can be masked
+        points = self.backend.read_fields(test_points, ['FldELEV', 'MinElev', 'MaxElev',
+                                                        'GrELEV', 'Tolerance', 'Status'],
+                                          where_clause)
 
-        # Remove the WTR_NM, IN_FID and NEAR_FID fields if they already exists
-        field_list = arcpy.ListFields(test_point_layer)
-        for field in field_list:
-            if str(field.name) in ['WTR_NM_1', 'WTR_NM_2', 'IN_FID', 'NEAR_FID']:
-                arcpy.DeleteField_management(test_point_layer, field.name)
+        # Classify every point at once
+        elev_diff, status = classify_points(points['FldELEV'], points['GrELEV'],
+                                            points['MinElev'], points['MaxElev'],
+                                            points['Tolerance'], points['Status'])
 
-    def calc_difference(self):
-        """Calculates the absolute difference of the Flood Elevation and Ground Elevation values"""
-        # Create a feature layer
-        if arcpy.Exists("test_points_lyr"):
-            arcpy.Delete_management("test_points_lyr")
-        test_points_lyr = arcpy.MakeFeatureLayer_management(
-            self.outfolder + '\\FBS_Audit.gdb\\Test_Points', "test_points_lyr")
-
-        # Make an update cursor and iterate through each row
-        field_list = ['FldELEV', 'MinElev', 'MaxElev', 'GrELEV', 'ElevDIFF', 'RiskClass',
-                      'Tolerance', 'Status']
-        with arcpy.da.UpdateCursor(test_points_lyr, field_list) as update_cursor:
-
-            for update_row in update_cursor:
-                fld_elev = update_row[0]
-                min_elev = update_row[1]
-                max_elev = update_row[2]
-                gr_elev = update_row[3]
-                tolerance = update_row[6]
-                status = update_row[7]
-
-                # If FldElev != -9999 and GrElev == -9999: Unknown
-                if fld_elev != -9999 and gr_elev == -9999:
-                    update_row[4] = -9999
-                    update_row[7] = "U"
-
-                # If FldElev == -9999 and GrElev != -9999: FAIL
-                elif fld_elev == -9999 and gr_elev != -9999:
-                    update_row[4] = -9999
-                    update_row[7] = "U"
-
-                # If FldElev == -9999 and GrElev == -9999: N/A
-                elif fld_elev == -9999 and gr_elev == -9999:
-                    update_row[4] = 0
-                    update_row[7] = "NA"
-
-                # If ABS(FldELEV - GrELEV) > Tolerance: PASS
-                elif abs(fld_elev - gr_elev) <= tolerance:
-                    update_row[4] = abs(fld_elev - gr_elev)
-                    update_row[7] = "P"
-
-                # Else: FAIL
-                else:
-                    update_row[4] = abs(fld_elev - gr_elev)
-                    update_row[7] = "F"
-
-                # Calculate if MinElev and MaxElev are populated and Status is 'F'
-                if str(min_elev) not in ['None', 'Null', 'NULL'] and \
-                   str(max_elev) not in ['None', 'Null', 'NULL'] and \
-                   status == 'F':
-                    if min_elev - tolerance <= fld_elev <= max_elev + tolerance:
-                        update_row[4] = -9999
-                        update_row[7] = 'P'
-
-                # Update the row
-                update_cursor.updateRow(update_row)
+        # Write ElevDIFF and Status back in one pass
+        self.backend.write_fields(test_points, points['OID@'],
+                                  {'ElevDIFF': elev_diff, 'Status': status})
 
     def check_failed_points(self):
-        """For each point that Fails, create a 38 foot horizontal buffer feature class"""
-        # Select all the points that fail
-        if arcpy.Exists("point_lyr"):
-            arcpy.Delete_management("point_lyr")
-        point_lyr = arcpy.MakeFeatureLayer_management(
-            self.outfolder + '\\FBS_Audit.gdb\\Test_Points',
-            "point_lyr", "Status = 'F'")
-
-        # Check if any 'F' points exists, if not return
-        result = arcpy.GetCount_management(point_lyr)
-        if int(result[0]) == 0:
+        """For each point that Fails, get the DEM MinElev and MaxElev within a 38 foot circle
+
+        Points the DEM pyramid decides keep a NULL MinElev/MaxElev and get a Screened of 1.
+        """
+        test_points = self.outfolder + '\\FBS_Audit.gdb\\Test_Points'
+
+        # Select all the points that fail and haven't been second passed or screened, if there
+        # are none return
+        points = self.backend.read_fields(test_points, ['SHAPE@X', 'SHAPE@Y', 'FldELEV',
+                                                        'GrELEV', 'Tolerance', 'Status'],
+                                          "Status = 'F' AND MinElev IS NULL AND Screened IS NULL")
+        if len(points) == 0:
             return
 
-        # Create a buffer for the point at 38 feet
-        if arcpy.Exists(self.outfolder + '\\FBS_Audit.gdb\\Buffers'):
-            arcpy.Delete_management(self.outfolder + '\\FBS_Audit.gdb\\Buffers')
-        arcpy.Buffer_analysis(
-            point_lyr, self.outfolder + '\\FBS_Audit.gdb\\Buffers',
-            "19 Feet", dissolve_option="NONE", method="GEODESIC")
-
-        # Make a Z enabled Buffer feature class.  This is needed for the
-        # 'Add Surface Information' tool
-        if arcpy.Exists(self.outfolder + '\\FBS_Audit.gdb\\Buffers_3D'):
-            arcpy.Delete_management(self.outfolder + '\\FBS_Audit.gdb\\Buffers_3D')
-        arcpy.CreateFeatureclass_management(
-            self.outfolder + '\\FBS_Audit.gdb',
-            'Buffers_3D',
-            geometry_type="POLYGON",
-            template=self.outfolder + '\\FBS_Audit.gdb\\Buffers',
-            has_z='ENABLED',
-            spatial_reference=arcpy.Describe(self.fld_lines).spatialReference.factoryCode)
-
-        # Append the Buffers to Buffers_3D
-        arcpy.Append_management(self.outfolder + '\\FBS_Audit.gdb\\Buffers',
-                                self.outfolder + '\\FBS_Audit.gdb\\Buffers_3D',
-                                "NO_TEST")
-
-        # Delete the Buffers feature class
-        arcpy.Delete_management(self.outfolder + '\\FBS_Audit.gdb\\Buffers')
+        # The buffer radius in the linear unit of the DEM's projected coordinate system
+        meters_per_unit = self.catalog.meters_per_unit(self.dem)
+        radius = BUFFER_RADIUS_FEET * 0.3048 / meters_per_unit
+
+        # Read the DEM cells within the radius of each failed point the pyramid can't decide
+        min_elev, max_elev, decided, passed = screened_min_max(
+            self.dem_pyramid,
+            lambda window_x, window_y: self.cached_window_min_max(window_x, window_y, radius),
+            points['SHAPE@X'], points['SHAPE@Y'], radius, points['FldELEV'], points['Tolerance'])
+        self.screen_counts[0] += int(decided.sum())
+        self.screen_counts[1] += len(points)
+
+        # Recalculate the values of the failed points only, so points that already passed on
+        # their MinElev/MaxElev are left alone
+        elev_diff, status = classify_points(points['FldELEV'], points['GrELEV'], min_elev,
+                                            max_elev, points['Tolerance'], points['Status'],
+                                            passed)
+        self.backend.write_fields(test_points, points['OID@'],
+                                  {'MinElev': min_elev, 'MaxElev': max_elev,
+                                   'ElevDIFF': elev_diff,
+                                   'Screened': numpy.where(decided, 1, numpy.nan),
+                                   'Status': status})
 
     def cleanup(self):
         """Cleanup any remaining items"""
+        # Delete the intermediate datasets
+        self.intermediates.release_all()
+
         # Drop unneeded fields
         field_drop_list = ['ORIG_FID', 'DFIRM_ID', 'VERSION_ID', 'FLD_LN_ID', 'LN_TYP',
-                           'SOURCE_CIT', 'Z_Min', 'Z_Max']
-
-        if arcpy.Exists(self.outfolder + '\\FBS_Audit.gdb\\Test_Points'):
-            field_list = arcpy.ListFields(self.outfolder + '\\FBS_Audit.gdb\\Test_Points')
-            for field in field_list:
-                if field.name in field_drop_list:
-                    arcpy.DeleteField_management(self.outfolder + '\\FBS_Audit.gdb\\Test_Points',
-                                                 field.name)
-
-        # Delete the Buffers_3D feature class
-        if arcpy.Exists(self.outfolder + '\\FBS_Audit.gdb\\Buffers_3D'):
-            arcpy.Delete_management(self.outfolder + '\\FBS_Audit.gdb\\Buffers_3D')
+                           'SOURCE_CIT']
 
-        # Delete any remaining bounding boxes
-        if arcpy.Exists(self.outfolder + '\\FBS_Audit.gdb\\bounding_box'):
-            arcpy.Delete_management(self.outfolder + '\\FBS_Audit.gdb\\bounding_box')
-
-        # Delete the Near Table
-        if arcpy.Exists(self.outfolder + '\\FBS_Audit.gdb\\Near_Table'):
-            arcpy.Delete_management(self.outfolder + '\\FBS_Audit.gdb\\Near_Table')
+        if self.backend.exists(self.outfolder + '\\FBS_Audit.gdb\\Test_Points'):
+            self.backend.delete_fields(self.outfolder + '\\FBS_Audit.gdb\\Test_Points',
+                                       field_drop_list)
 
     def create_bounding_box(self, water_name):
-        """Create a bounding box for the water name"""
-        # Remove a bounding_box feature class if it already exists
-        if arcpy.Exists(self.outfolder + '\\FBS_Audit.gdb\\bounding_box'):
-            arcpy.Delete_management(self.outfolder + '\\FBS_Audit.gdb\\bounding_box')
-
-        # Select the cross sections for the current water_name
-        if arcpy.Exists("xs_sel"):
-            arcpy.Delete_management("xs_sel")
-        xs_sel = arcpy.MakeFeatureLayer_management(self.cross_sections, "xs_sel",
-                                                   "WTR_NM = '" + water_name + "'")
-
-        # Simplify them in memory
-        if arcpy.Exists("in_memory//simple_xs"):
-            arcpy.Delete_management("in_memory//simple_xs")
-        if arcpy.Exists("in_memory//simple_xs_Pnt"):
-            arcpy.Delete_management("in_memory//simple_xs_Pnt")
-        simple_xs = arcpy.SimplifyLine_cartography(
-            xs_sel, "in_memory//simple_xs", "POINT_REMOVE", "100 Feet")
-
-        # Create a temporary shapefile to hold each boundary
-        if arcpy.Exists(self.outfolder + '\\FBS_Audit.gdb\\bounding_box_temp'):
-            arcpy.Delete_management(self.outfolder + '\\FBS_Audit.gdb\\bounding_box_temp')
-
-        bounding_box_temp = arcpy.CreateFeatureclass_management(
-            self.outfolder + '\\FBS_Audit.gdb', 'bounding_box_temp', 'POLYGON',
-            spatial_reference=arcpy.Describe(self.cross_sections).spatialReference.factoryCode)
+        """Create the convex hulls around every two cross sections of the water name
+
+        Together the hulls are the bounding box of the water name.  Returns a list of clockwise
+        (N, 2) hull rings, which is empty if there are no hulls.
+        """
+        # Read the vertices of the cross sections for the current water_name in one pass
+        stn_vertices = {}
+        wtr_nm_delim = self.backend.field_delimiters(self.cross_sections, 'WTR_NM')
+        for oid, parts, wkb, values in self.backend.read_shapes(
+                self.cross_sections, ['STREAM_STN'], wtr_nm_delim + " = '" + water_name + "'"):
+            stn_vertices.setdefault(values[0], []).extend(parts)
 
         # Create a sorted list of the stream stations for the current water name
-        station_list = sorted(list(set([(row[0]) for row in arcpy.da.SearchCursor(xs_sel,
-                                                                                  'STREAM_STN')])))
-
-        # Create a polygon for every two cross sections and store them in the temporary shapefile
-        def create_polygon(in_xs_path, station_1, station_2, out_fc):
-            """Creates a polygon based on two cross sections"""
-            sel_station = str(station_1) + ", " + str(station_2)
-
-            xs_stations = arcpy.MakeFeatureLayer_management(
-                in_xs_path, "xs_stations", "\"STREAM_STN\" IN (" + sel_station + ")")
-
-            if arcpy.Exists("in_memory\\clip_boundary"):
-                arcpy.Delete_management("in_memory\\clip_boundary")
+        station_list = sorted(stn_vertices)
 
-            boundary = arcpy.MinimumBoundingGeometry_management(
-                xs_stations, "in_memory\\clip_boundary", "CONVEX_HULL", "LIST", "WTR_NM")
-
-            arcpy.Append_management(boundary, out_fc, "NO_TEST")
-            arcpy.Delete_management("xs_stations")
-            arcpy.Delete_management("in_memory\\clip_boundary")
-
-        # Iterate through the stream station list sending every two stations to the
-        # create_polygon function
+        # Create a convex hull for every two cross sections
+        hulls = []
         for station in range(0, len(station_list) - 1):
-            create_polygon(simple_xs, station_list[station],
-                           station_list[station + 1], bounding_box_temp)
-
-        # Dissolve the features and remove the temporary shapefile
-        if arcpy.Exists(self.outfolder + '\\FBS_Audit.gdb\\bounding_box'):
-            arcpy.Delete_management(self.outfolder + '\\FBS_Audit.gdb\\bounding_box')
-
-        arcpy.Dissolve_management(
-            bounding_box_temp,
-            self.outfolder + '\\FBS_Audit.gdb\\bounding_box')
+            hull = convex_hull(numpy.concatenate(stn_vertices[station_list[station]] +
+                                                 stn_vertices[station_list[station + 1]]))
+            if len(hull) >= 3:
+                hulls.append(hull)
 
-        # Remove the temporary bounding box
-        arcpy.Delete_management(bounding_box_temp)
+        return hulls
 
     def create_file_geodatabase(self):
         """Create an empty File Geodatabase"""
-        fbs_db = self.outfolder + '\\FBS_Audit.gdb'
-        if arcpy.Exists(fbs_db):
-            arcpy.Delete_management(fbs_db)
-
-        arcpy.CreateFileGDB_management(self.outfolder, 'FBS_Audit.gdb')
-
-        # Create the Pass/Fail Domain
-        p_f_domain = "PassFail"
-        p_f_dict = {"P": "Pass", "F": "Fail", "NA": "NA", "U": "Unknown"}
-        arcpy.CreateDomain_management(self.outfolder + '\\FBS_Audit.gdb', p_f_domain,
-                                      "PassFail", "TEXT", "CODED")
-        for code in p_f_dict:
-            arcpy.AddCodedValueToDomain_management(self.outfolder + '\\FBS_Audit.gdb',
-                                                   p_f_domain, code, p_f_dict[code])
-
-        # Create the Exception Domain
-        exp_domain = "Exception"
-        exp_dict = {"PFD": "PFD Exception", "Erosion": "Erosion Exception",
-                    "Runup": "Runup Exception", "Combined": "Combined Exception",
-                    "OT": "OT Exception", "River_Coast": "River Coast Exception"}
-        arcpy.CreateDomain_management(self.outfolder + '\\FBS_Audit.gdb', exp_domain,
-                                      "Exception", "TEXT", "CODED")
-        for code in exp_dict:
-            arcpy.AddCodedValueToDomain_management(self.outfolder + '\\FBS_Audit.gdb',
-                                                   exp_domain, code, exp_dict[code])
-
-        # Create the Risk Class Domain
-        risk_class = "RiskClass"
-        risk_dict = {"A": "A", "B": "B", "C": "C", "D": "D", "E": "E"}
-        arcpy.CreateDomain_management(self.outfolder + '\\FBS_Audit.gdb', risk_class,
-                                      "Risk Class", "TEXT", "CODED")
-        for code in risk_dict:
-            arcpy.AddCodedValueToDomain_management(self.outfolder + '\\FBS_Audit.gdb',
-                                                   risk_class, code, risk_dict[code])
-
-        # Create the Tolerance Domain
-        tolerance = "Tolerance"
-        tol_dict = {"1.0": "1.0", "0.5": "0.5"}
-        arcpy.CreateDomain_management(self.outfolder + '\\FBS_Audit.gdb', tolerance,
-                                      "Tolerance", "FLOAT", "CODED")
-        for code in tol_dict:
-            arcpy.AddCodedValueToDomain_management(self.outfolder + '\\FBS_Audit.gdb',
-                                                   tolerance, code, tol_dict[code])
+        self.backend.create_file_geodatabase(self.outfolder, 'FBS_Audit.gdb', DOMAINS)
 
     def create_sfha_flood_lines(self):
         """Creates the sfha flood lines"""
-        # Make a feature layer of the flood lines of the SFHA boundaries
-        if arcpy.Exists("fld_line_lyr"):
-            arcpy.Delete_management("fld_line_lyr")
-        ln_typ_delim = arcpy.AddFieldDelimiters(self.fld_lines, 'LN_TYP')
-        fld_line_lyr = arcpy.MakeFeatureLayer_management(
-            self.fld_lines, "fld_line_lyr",
-            ln_typ_delim + " IN ('2034', 'SFHA / Flood Zone Boundary')")
-
-        # Delete any existing flood lines
-        if arcpy.Exists(self.outfolder + '\\FBS_Audit.gdb\\SFHA_Lines'):
-            arcpy.Delete_management(self.outfolder + '\\FBS_Audit.gdb\\SFHA_Lines')
-
-        # Copy them to the File Geodatabase
-        arcpy.CopyFeatures_management(fld_line_lyr,
-                                      self.outfolder + '\\FBS_Audit.gdb\\SFHA_Lines')
+        sfha_lines = self.intermediates.path('SFHA_Lines', self.fld_lines)
+
+        # Copy the flood lines of the SFHA boundaries to the intermediate SFHA_Lines
+        ln_typ_delim = self.backend.field_delimiters(self.fld_lines, 'LN_TYP')
+        self.backend.copy_features(self.fld_lines, sfha_lines,
+                                   ln_typ_delim + " IN ('2034', 'SFHA / Flood Zone Boundary')")
 
         # Reset self.flood_lines to point to the new flood lines
-        self.fld_lines = self.outfolder + '\\FBS_Audit.gdb\\SFHA_Lines'
-
-        # Make a new feature layer to SFHA_lines
-        if arcpy.Exists('sfha_lines'):
-            arcpy.Delete_management('sfha_lines')
-        sfha_lines = arcpy.MakeFeatureLayer_management(
-            self.outfolder + '\\FBS_Audit.gdb\\SFHA_Lines', 'sfha_lines')
-
-        # Remove the flood lines not associated with the polygons
-        if arcpy.Exists("zone_polys"):
-            arcpy.Delete_management("zone_polys")
-        zone_polys = arcpy.MakeFeatureLayer_management(self.fld_polys, "zone_polys")
-        arcpy.SelectLayerByLocation_management(sfha_lines, "SHARE_A_LINE_SEGMENT_WITH", zone_polys,
-                                               invert_spatial_relationship='INVERT')
-        arcpy.DeleteFeatures_management(sfha_lines)
-
-        # Select all the Zone A polygons
-        if arcpy.Exists("a_zone_polys"):
-            arcpy.Delete_management("a_zone_polys")
-        zone_delim = arcpy.AddFieldDelimiters(self.fld_polys, 'FLD_ZONE')
-        a_zone_polys = arcpy.MakeFeatureLayer_management(
-            self.fld_polys, "a_zone_polys", zone_delim + " = 'A'")
-
-        # Select all the Zone AE polygons
-        if arcpy.Exists("ae_zone_polys"):
-            arcpy.Delete_management("ae_zone_polys")
-        zone_delim = arcpy.AddFieldDelimiters(self.fld_polys, 'FLD_ZONE')
-        ae_zone_polys = arcpy.MakeFeatureLayer_management(
-            self.fld_polys, "ae_zone_polys", zone_delim + " = 'AE'")
-
-        # Select from self.flood_lines all lines that share a boundary with the Zone AE polygons
-        ae_lines = arcpy.SelectLayerByLocation_management(
-            sfha_lines, "SHARE_A_LINE_SEGMENT_WITH", ae_zone_polys)
-
-        # From the selected flood lines, select lines that share a boundary with the Zone A polygons
-        common_lines = arcpy.SelectLayerByLocation_management(
-            ae_lines, "SHARE_A_LINE_SEGMENT_WITH", a_zone_polys, selection_type='SUBSET_SELECTION')
-        arcpy.DeleteFeatures_management(common_lines)
+        self.fld_lines = sfha_lines
+
+        # Index the polygon boundary segments with the zones of the polygons on either side
+        tolerance = TOPOLOGY_TOLERANCE_FEET * 0.3048 / self.backend.meters_per_unit(sfha_lines)
+        polygons = []
+        zone_masks = []
+        for oid, parts, wkb, values in self.backend.read_shapes(self.fld_polys, ['FLD_ZONE']):
+            polygons.append(parts)
+            zone_masks.append(ZONE_MASKS.get(values[0], OTHER_ZONE_MASK))
+        edge_index = EdgeIndex(polygons, zone_masks, tolerance)
+
+        # Classify every line by the zones along its segments in one pass
+        line_oids = set(self.backend.read_fields(sfha_lines, [])['OID@'].tolist())
+        shape_oids = []
+        lines = []
+        for oid, parts, wkb, values in self.backend.read_shapes(sfha_lines):
+            shape_oids.append(oid)
+            lines.append(parts)
+        line_masks = edge_index.line_masks(lines)
+        internal = ((line_masks & ZONE_MASKS['AE']) != 0) & ((line_masks & ZONE_MASKS['A']) != 0)
+        boundary_oids = numpy.array(shape_oids, dtype=numpy.int64)[(line_masks != 0) & ~internal]
+
+        # Remove the flood lines not associated with the polygons and the lines between the
+        # Zone AE and Zone A polygons
+        self.backend.delete_rows(sfha_lines, line_oids - set(boundary_oids.tolist()))
 
     def create_sfha_flood_polys(self):
         """Creates the sfha flood polygons"""
+        sfha_areas = self.intermediates.path('SFHA_Areas', self.fld_polys)
+        zone_delim = self.backend.field_delimiters(self.fld_polys, 'FLD_ZONE')
 
-        # Select all the Zone AE polygons
-        if arcpy.Exists("ae_zone_polys"):
-            arcpy.Delete_management("ae_zone_polys")
-        zone_delim = arcpy.AddFieldDelimiters(self.fld_polys, 'FLD_ZONE')
-        ae_zone_polys = arcpy.MakeFeatureLayer_management(
-            self.fld_polys, "ae_zone_polys", zone_delim + " = 'AE'")
-
-        # Remove existing flood polygon feature class in the output database
-        if arcpy.Exists(self.outfolder + '\\FBS_Audit.gdb\\SFHA_Areas'):
-            arcpy.Delete_management(self.outfolder + '\\FBS_Audit.gdb\\SFHA_Areas')
-
-        # Dissolve them to merge the floodways into the AE zones
-        arcpy.Dissolve_management(ae_zone_polys, self.outfolder + '\\FBS_Audit.gdb\\SFHA_Areas',
-                                  "FLD_ZONE", multi_part='SINGLE_PART')
-
-        # Select all the Zone A polygons
-        if arcpy.Exists("a_zone_polys"):
-            arcpy.Delete_management("a_zone_polys")
-        zone_delim = arcpy.AddFieldDelimiters(self.fld_polys, 'FLD_ZONE')
-        a_zone_polys = arcpy.MakeFeatureLayer_management(
-            self.fld_polys, "a_zone_polys", zone_delim + " = 'A'")
+        # Dissolve the Zone AE polygons to merge the floodways into the AE zones
+        self.backend.dissolve(self.fld_polys, sfha_areas, "FLD_ZONE", zone_delim + " = 'AE'")
 
-        # Append these to to SFHA_Area polygons
-        arcpy.Append_management(a_zone_polys, self.outfolder + '\\FBS_Audit.gdb\\SFHA_Areas',
-                                "NO_TEST")
+        # Append the Zone A polygons to the SFHA_Area polygons
+        self.backend.append(self.fld_polys, sfha_areas, zone_delim + " = 'A'")
 
         # Reset self.fld_polys path
-        self.fld_polys = self.outfolder + '\\FBS_Audit.gdb\\SFHA_Areas'
+        self.fld_polys = sfha_areas
 
     def create_test_points(self):
         """Create the Test_Points feature class"""
 
         test_points = self.outfolder + '\\FBS_Audit.gdb\\Test_Points'
 
-        # Create points every 100 ft along the Flood Lines
-        if arcpy.Exists(test_points):
-            arcpy.Delete_management(test_points)
-        arcpy.GeneratePointsAlongLines_management(self.fld_lines, test_points,
-                                                  "DISTANCE", Distance='100 feet')
-
-        # Create a feature layer
-        if arcpy.Exists("test_points_lyr"):
-            arcpy.Delete_management("test_points_lyr")
-        test_points_lyr = arcpy.MakeFeatureLayer_management(test_points, "test_points_lyr")
-
-        # Add the needed fields to Test_Points
-        arcpy.AddField_management(test_points_lyr, "WTR_NM_1", "TEXT", field_length=100)
-        arcpy.AddField_management(test_points_lyr, "WTR_NM_2", "TEXT", field_length=100)
-        arcpy.AddField_management(test_points_lyr, "FldELEV", "FLOAT",
-                                  field_precision=6, field_scale=2)
-        arcpy.AddField_management(test_points_lyr, "MinElev", "FLOAT",
-                                  field_precision=6, field_scale=2)
-        arcpy.AddField_management(test_points_lyr, "MaxElev", "FLOAT",
-                                  field_precision=6, field_scale=2)
-        arcpy.AddField_management(test_points_lyr, "GrELEV", "FLOAT",
-                                  field_precision=6, field_scale=2)
-        arcpy.AddField_management(test_points_lyr, "ElevDIFF", "FLOAT",
-                                  field_precision=6, field_scale=2)
-        arcpy.AddField_management(test_points_lyr, "RiskClass", "TEXT", field_length=2,
-                                  field_domain="RiskClass")
-        arcpy.AddField_management(test_points_lyr, "Tolerance", "FLOAT",
-                                  field_precision=6, field_scale=2, field_domain="Tolerance")
-        arcpy.AddField_management(test_points_lyr, "Status", "TEXT", field_length=2,
-                                  field_domain="PassFail")
-        arcpy.AddField_management(test_points_lyr, "Validation", "TEXT", field_length=20,
-                                  field_domain="Exception")
-        arcpy.AddField_management(test_points_lyr, "Comment", "TEXT", field_length=100)
-
-        # Calculate the RiskClass to A for everything
-        arcpy.CalculateField_management(test_points_lyr, "RiskClass", "\"A\"", "PYTHON_9.3")
-
-        # Calculate the Tolerance
-        arcpy.CalculateField_management(test_points_lyr, "Tolerance", "1", "PYTHON_9.3")
+        # Create an empty point feature class for the Test Points with the needed fields
+        self.backend.create_feature_class(test_points, 'POINT', self.fld_lines,
+                                          TEST_POINT_FIELDS)
+
+        # Stream the points every 100 ft along the Flood Lines in with their attributes filled
+        self.insert_test_points()
 
     def database_table_check(self):
         """Set required tables in a database to run an FBS Audit"""
-        # Check for feature classes in the database
+        # Check for feature classes in the database and any datasets until all four are found
         if self.workspace[-4:] in ['.gdb', '.mdb']:
+            found = self.catalog.find(self.workspace, ['S_Fld_Haz_Ln', 'S_Fld_Haz_Ar',
+                                                       'S_Profil_Basln', 'S_XS'])
+            self.fld_lines = found.get('S_Fld_Haz_Ln', '')
+            self.fld_polys = found.get('S_Fld_Haz_Ar', '')
+            self.profile_baselines = found.get('S_Profil_Basln', '')
+            self.cross_sections = found.get('S_XS', '')
+
+    def dry_run(self, fast_names=False, processes=1, incremental=False, export_format=None):
+        """Checks the inputs and prints the stages an audit with these options would run
+
+        Only the catalog is read, so nothing is fingerprinted or written.
+        """
+        self.spatial_reference_check()
+        self.is_empty_table_check()
+
+        incremental = incremental and self.backend.exists(self.outfolder + '\\FBS_Audit.gdb')
+        self.printer("Inputs found:\n\t" + "\n\t".join(
+            [self.fld_lines, self.fld_polys, self.profile_baselines, self.cross_sections]))
+        self.printer("Stages:\n\t" + "\n\t".join(
+            stage.name for stage in self.audit_stages(fast_names, processes, incremental,
+                                                      export_format)))
+
+    def export_test_points(self, export_format):
+        """Streams the Test_Points to FBS_Audit_Test_Points in the output folder
+
+        export_format is an EXPORT_FORMATS extension, Parquet and Arrow fall back to GeoPackage
+        without pyarrow.
+        """
+        test_points = self.outfolder + '\\FBS_Audit.gdb\\Test_Points'
+        out_path = os.path.join(self.outfolder, 'FBS_Audit_Test_Points' + export_format)
+        out_path = export_test_points(self.backend, test_points, out_path, TEST_POINT_FIELDS,
+                                      DOMAINS)
+        self.printer("\tTest_Points exported to " + out_path)
 
-            feature_class_list = arcpy.ListFeatureClasses()
-
-            for feature_class in feature_class_list:
-                if str(feature_class) == 'S_Fld_Haz_Ln':
-                    self.fld_lines = self.workspace + '\\S_Fld_Haz_Ln'
-                elif str(feature_class) == 'S_Fld_Haz_Ar':
-                    self.fld_polys = self.workspace + '\\S_Fld_Haz_Ar'
-                elif str(feature_class) == 'S_Profil_Basln':
-                    self.profile_baselines = self.workspace + '\\S_Profil_Basln'
-                elif str(feature_class) == 'S_XS':
-                    self.cross_sections = self.workspace + '\\S_XS'
-
-            # Check in any datasets
-            datasets = arcpy.ListDatasets()
-            for dataset in datasets:
-                feature_class_list = arcpy.ListFeatureClasses("*", "All", dataset)
-
-                for feature_class in feature_class_list:
-                    if str(feature_class) == 'S_Fld_Haz_Ln':
-                        self.fld_lines = self.workspace + '\\' + dataset + '\\S_Fld_Haz_Ln'
-                    elif str(feature_class) == 'S_Fld_Haz_Ar':
-                        self.fld_polys = self.workspace + '\\' + dataset + '\\S_Fld_Haz_Ar'
-                    elif str(feature_class) == 'S_Profil_Basln':
-                        self.profile_baselines = self.workspace + '\\' + dataset + \
-                                                 '\\S_Profil_Basln'
-                    elif str(feature_class) == 'S_XS':
-                        self.cross_sections = self.workspace + '\\' + dataset + '\\S_XS'
+    @staticmethod
+    def fingerprint(*values):
+        """Returns a SHA-1 hex digest of the values"""
+        sha1 = hashlib.sha1()
+        for value in values:
+            if not isinstance(value, (bytes, bytearray)):
+                value = str(value).encode('utf-8')
+            sha1.update(value)
+            sha1.update(b'|')
+
+        return sha1.hexdigest()
+
+    def fingerprint_features(self, in_fc, field_names):
+        """Returns a dictionary of feature fingerprint to [XMin, YMin, XMax, YMax] extent
+
+        The fingerprint covers the geometry and the field_names values of each feature.
+        """
+        fingerprints = {}
+        for oid, parts, wkb, values in self.backend.read_shapes(in_fc, field_names):
+            vertices = numpy.concatenate(parts)
+            fingerprints[self.fingerprint(wkb, *values)] = \
+                vertices.min(axis=0).tolist() + vertices.max(axis=0).tolist()
+
+        return fingerprints
+
+    def fingerprint_inputs(self):
+        """Fingerprints the inputs before the audit changes them
+
+        The DEM, WSEL and flood polygons are kept for the next incremental run.  Every input also
+        gets a single key for the stage checkpoints.
+        """
+        self.fingerprints = {'dem': self.fingerprint_raster(self.dem),
+                             'wsel': self.fingerprint_raster(self.wsel),
+                             'polygons': self.fingerprint_features(self.fld_polys, ['FLD_ZONE'])}
+
+        self.input_keys = {
+            'dem': self.fingerprints['dem'],
+            'wsel': self.fingerprints['wsel'],
+            'polygons': self.fingerprint(*sorted(self.fingerprints['polygons'])),
+            'lines': self.fingerprint(*sorted(self.fingerprint_features(self.fld_lines,
+                                                                        ['LN_TYP']))),
+            'cross_sections': self.fingerprint(*sorted(self.fingerprint_features(
+                self.cross_sections, ['WTR_NM', 'STREAM_STN']))),
+            'profile_baselines': self.fingerprint(*sorted(self.fingerprint_features(
+                self.profile_baselines, ['WTR_NM']))),
+            'scenarios': self.fingerprint(*[scenario.name for scenario in self.scenarios]),
+            'summary_fields': self.fingerprint(*self.summary_fields())}
+
+    def fingerprint_raster(self, in_raster):
+        """Returns a fingerprint of a raster's properties and its file size and time stamp"""
+        values = self.catalog.describe_raster(in_raster)
+        if os.path.exists(values[0]):
+            values.extend([os.path.getsize(values[0]), os.path.getmtime(values[0])])
+
+        return self.fingerprint(*values)
+
+    def generate_test_points(self, spacing_feet=TEST_POINT_SPACING_FEET, chunk_size=100000,
+                             line_oids=None):
+        """Yields chunks of Test Points every spacing_feet along the Flood Lines
+
+        Each chunk is a dictionary of X, Y, LineID, LineHash, Station, RiskClass and Tolerance
+        arrays with roughly chunk_size points.  Stations are measured from the start of each line.
+        If line_oids is given only those Flood Lines are used.
+        """
+        spacing = spacing_feet * 0.3048 / self.backend.meters_per_unit(self.fld_lines)
+
+        chunk = []
+        chunk_count = 0
+        for oid, parts, wkb, values in self.backend.read_shapes(self.fld_lines, ['LN_TYP']):
+            if line_oids is not None and oid not in line_oids:
+                continue
+
+            # Interpolate the stations along all the parts of the line at once
+            coords, stations = points_along_line(parts, spacing)
+            chunk.append((oid, self.fingerprint(wkb, values[0]), coords, stations))
+            chunk_count += len(stations)
+
+            if chunk_count >= chunk_size:
+                yield self.test_point_chunk(chunk)
+                chunk = []
+                chunk_count = 0
+
+        if chunk_count:
+            yield self.test_point_chunk(chunk)
+
+    def insert_test_points(self, line_oids=None):
+        """Insert the Test Points of the Flood Lines, or only of line_oids, into Test_Points"""
+        test_points = self.outfolder + '\\FBS_Audit.gdb\\Test_Points'
+        field_list = ['SHAPE@XY', 'LineID', 'LineHash', 'Station', 'RiskClass', 'Tolerance']
+        self.backend.insert_rows(test_points, field_list, self.test_point_rows(line_oids))
 
     def is_empty_table_check(self):
         """Checks if the required tables are empty"""
 
         # Get a count of the features.  If the count is 0, return an error an exit
-        result = arcpy.GetCount_management(self.fld_lines)
-        count = int(result[0])
-        if count == 0:
+        if self.catalog.count(self.fld_lines) == 0:
             self.printer("S_Fld_Haz_Ln is empty.  Cannot proceed.  Exiting...", True)
 
-        result = arcpy.GetCount_management(self.fld_polys)
-        count = int(result[0])
-        if count == 0:
+        if self.catalog.count(self.fld_polys) == 0:
             self.printer("S_Fld_Haz_Ar is empty.  Cannot proceed.  Exiting...", True)
 
-        result = arcpy.GetCount_management(self.profile_baselines)
-        count = int(result[0])
-        if count == 0:
+        if self.catalog.count(self.profile_baselines) == 0:
             self.printer("S_Profil_Basln is empty.  Cannot proceed.  Exiting...", True)
 
-        result = arcpy.GetCount_management(self.cross_sections)
-        count = int(result[0])
-        if count == 0:
+        if self.catalog.count(self.cross_sections) == 0:
             self.printer("S_XS is empty.  Cannot proceed.  Exiting...", True)
 
     @staticmethod
     def printer(message, error=False):
         """Prints for both ArcToolbox and Command Line"""
         print(message)
-        if not error:
-            arcpy.AddMessage(message)
-        else:
-            arcpy.AddError(message)
+        # Only ArcToolbox has arcpy loaded before the audit needs it
+        if arcpy.loaded():
+            if not error:
+                arcpy.AddMessage(message)
+            else:
+                arcpy.AddError(message)
+        if error:
             sys.exit(1)
 
+    def raster(self, in_raster):
+        """Returns in_raster for the samplers, read from the raster cache when there is one
+
+        The first run against a raster ingests it into the cache folder, named by the raster's
+        fingerprint, and every later run against the same raster maps that file.  A cache file
+        of an older format is ingested again.
+        """
+        if self.raster_cache is None:
+            return self.backend.raster(in_raster)
+
+        if in_raster not in self.tiled_rasters:
+            cache_path = os.path.join(self.raster_cache, self.raster_key(in_raster) + '.fbsr')
+            try:
+                self.tiled_rasters[in_raster] = TiledRaster(cache_path)
+            except (IOError, ValueError):
+                self.printer("\tCaching " + in_raster)
+                self.tiled_rasters[in_raster] = ingest_raster(self.backend.raster(in_raster),
+                                                              cache_path)
+
+        return self.tiled_rasters[in_raster]
+
+    def raster_key(self, in_raster):
+        """Returns the sample cache key of a raster, fingerprinting it once"""
+        if in_raster not in self.raster_keys:
+            self.raster_keys[in_raster] = self.fingerprint_raster(in_raster)
+
+        return self.raster_keys[in_raster]
+
+    def refresh_test_points(self):
+        """Updates the Test_Points incrementally, or creates them if they can't be carried forward
+
+        Only the Test Points of changed lines have a NULL Status after an update, so the later
+        stages are limited to them.
+        """
+        if self.update_test_points():
+            self.where_clause = "Status IS NULL"
+        else:
+            self.where_clause = None
+            self.printer("Creating Test Points")
+            self.create_test_points()
+
+    def run_audit(self, profiler, fast_names=False, processes=1, incremental=False,
+                  export_format=None, resume=False, stage_workers=1):
+        """Runs the stages of the audit, recording each one with the StageProfiler
+
+        With processes above 1 the Test_Points are audited in tiles across a process pool.  An
+        incremental run keeps the previous FBS_Audit.gdb and only re-audits the changed lines.
+        With an export_format the finished Test_Points are also streamed to a columnar file.
+        With resume the stages with a current checkpoint are skipped, and stage_workers runs up
+        to that many independent stages at once on threads.  arcpy isn't thread safe, so more than
+        one stage worker needs another backend.
+        """
+        if stage_workers > 1 and isinstance(self.backend, ArcpyBackend):
+            raise ValueError("More than one stage worker needs the ogr backend, arcpy isn't "
+                             "thread safe")
+        incremental = incremental and self.backend.exists(self.outfolder + '\\FBS_Audit.gdb')
+        stages = self.audit_stages(fast_names, processes, incremental, export_format)
+        StageGraph(self.backend, self.outfolder, resume, self.printer).run(
+            stages, profiler, lambda: self.input_keys, stage_workers)
+
+        self.printer("Cleanup")
+        with profiler.stage('cleanup'):
+            self.cleanup()
+        self.write_fingerprints()
+
+    def sample_cache_entries(self, radius):
+        """Returns the (raster key, method) cache entries of GrELEV, FldELEV, MinElev and MaxElev"""
+        dem_key = self.raster_key(self.dem)
+        return [(dem_key, 'BILINEAR'), (self.raster_key(self.wsel), 'BILINEAR'),
+                (dem_key, 'MIN {:.6f}'.format(radius)), (dem_key, 'MAX {:.6f}'.format(radius))]
+
     def shapefile_table_check(self):
         """Set required tables in a folder to run an FBS Audit"""
-        # Check for feature classes in the folder (eg shapefiles)
-        feature_class_list = arcpy.ListFeatureClasses()
-
-        for feature_class in feature_class_list:
-            if str(feature_class) == 'S_Fld_Haz_Ln.shp':
-                self.fld_lines = self.workspace + '\\S_Fld_Haz_Ln.shp'
-            elif str(feature_class) == 'S_Fld_Haz_Ar.shp':
-                self.fld_polys = self.workspace + '\\S_Fld_Haz_Ar.shp'
-            elif str(feature_class) == 'S_Profil_Basln.shp':
-                self.profile_baselines = self.workspace + '\\S_Profil_Basln.shp'
-            elif str(feature_class) == 'S_XS.shp':
-                self.cross_sections = self.workspace + '\\S_XS.shp'
+        # Check for feature classes in the folder (eg shapefiles) until all four are found
+        found = self.catalog.find(self.workspace, ['S_Fld_Haz_Ln.shp', 'S_Fld_Haz_Ar.shp',
+                                                   'S_Profil_Basln.shp', 'S_XS.shp'])
+        self.fld_lines = found.get('S_Fld_Haz_Ln.shp', '')
+        self.fld_polys = found.get('S_Fld_Haz_Ar.shp', '')
+        self.profile_baselines = found.get('S_Profil_Basln.shp', '')
+        self.cross_sections = found.get('S_XS.shp', '')
 
     def spatial_reference_check(self):
         """Check the spatial reference system used"""
         not_matching = []
 
-        dem_spa_ref = str(arcpy.Describe(self.dem).spatialReference.factoryCode)
+        dem_spa_ref = self.catalog.factory_code(self.dem)
 
-        if str(arcpy.Describe(self.wsel).spatialReference.factoryCode) != dem_spa_ref:
+        if self.catalog.factory_code(self.wsel) != dem_spa_ref:
             not_matching.append("WSEL")
 
-        if str(arcpy.Describe(self.fld_lines).spatialReference.factoryCode) != dem_spa_ref:
+        if self.catalog.factory_code(self.fld_lines) != dem_spa_ref:
             not_matching.append("Flood Lines")
 
-        if str(arcpy.Describe(self.fld_polys).spatialReference.factoryCode) != dem_spa_ref:
+        if self.catalog.factory_code(self.fld_polys) != dem_spa_ref:
             not_matching.append("Flood Polygons")
 
-        if str(arcpy.Describe(self.profile_baselines).spatialReference.factoryCode) != dem_spa_ref:
+        if self.catalog.factory_code(self.profile_baselines) != dem_spa_ref:
             not_matching.append("Profile Baselines")
 
-        if str(arcpy.Describe(self.cross_sections).spatialReference.factoryCode) != dem_spa_ref:
+        if self.catalog.factory_code(self.cross_sections) != dem_spa_ref:
             not_matching.append("Cross sections")
 
         if not_matching:
             self.printer("The following element's spatial references do not match the DEMs: " +
                          ", ".join(not_matching) + "\nExiting...", True)
 
+    def status_counts(self):
+        """Returns the number of Test_Points with each Status, NULL Status is counted as ''"""
+        test_points = self.outfolder + '\\FBS_Audit.gdb\\Test_Points'
+        statuses = self.backend.read_fields(test_points, ['Status'])['Status']
+        values, counts = numpy.unique(statuses, return_counts=True)
+
+        return dict(zip(values.tolist(), counts.tolist()))
+
+    def summarize_compliance(self):
+        """Rolls the Test_Points up into pass rates and failure reaches in one columnar pass
+
+        FBS_Audit_summary.csv holds the Status counts and pass rate of every water name, risk
+        class and tolerance, and of every flood line too with summary_by_line.
+        FBS_Audit_failure_reaches.csv holds the runs of failing points along each line and
+        FBS_Audit_report.json the totals, the risk class pass rates and the longest reaches.
+        """
+        test_points = self.outfolder + '\\FBS_Audit.gdb\\Test_Points'
+        points = self.backend.read_fields(test_points, ['LineID', 'Station', 'WTR_NM_1',
+                                                        'RiskClass', 'Tolerance', 'Status'])
+        columns = {field_name: points[field_name] for field_name in points.dtype.names}
+        columns['LineID'] = numpy.nan_to_num(points['LineID'], nan=-1).astype(numpy.int64)
+
+        # Group counts by reach and by risk class, and the failure reaches along the lines
+        group_fields = self.summary_fields()
+        summary_rows = group_counts(columns, group_fields)
+        risk_class_rows = group_counts(columns, ['RiskClass', 'Tolerance'])
+        reaches = failure_reaches(columns['LineID'], columns['Station'], columns['Status'],
+                                  columns['WTR_NM_1'])
+
+        write_table(summary_rows, group_fields + COUNT_COLUMNS,
+                    os.path.join(self.outfolder, 'FBS_Audit_summary.csv'))
+        write_table(reaches, REACH_COLUMNS,
+                    os.path.join(self.outfolder, 'FBS_Audit_failure_reaches.csv'))
+        report = write_report(summary_rows, risk_class_rows, reaches,
+                              os.path.join(self.outfolder, 'FBS_Audit_report.json'))
+
+        # The compact report
+        self.printer("\t{points} points, {NA} NA, {U} unknown, pass rate {pass_rate}".format(
+            **report['totals']))
+        for row in risk_class_rows:
+            self.printer("\tRisk class {RiskClass} at {Tolerance:g} ft: pass rate {pass_rate}, "
+                         "needs {required_pass_rate}".format(**row))
+        self.printer("\t{} failure reaches, {} along the flood lines".format(
+            report['failure_reaches'], report['failure_length']))
+
+    def summary_fields(self):
+        """Returns the fields the compliance summary groups the Test_Points by"""
+        return SUMMARY_FIELDS + (['LineID'] if self.summary_by_line else [])
+
+    def sweep_scenarios(self):
+        """Classifies every Test Point under every scenario from one read of the DEM windows
+
+        The points that fail at the smallest tolerance are the only ones any scenario second
+        passes, so their windows are read once at every radius.  Every scenario's Status goes to
+        its own Test_Points field and the pass rates to FBS_Audit_scenarios.csv.
+        """
+        test_points = self.outfolder + '\\FBS_Audit.gdb\\Test_Points'
+        points = self.backend.read_fields(test_points, ['SHAPE@X', 'SHAPE@Y', 'FldELEV',
+                                                        'GrELEV'])
+        no_window = numpy.full(len(points), numpy.nan)
+        no_status = numpy.full(len(points), '')
+
+        # The points failing the first pass at the smallest tolerance
+        smallest = min(scenario.tolerance for scenario in self.scenarios)
+        elev_diff, status = classify_points(points['FldELEV'], points['GrELEV'], no_window,
+                                            no_window, numpy.full(len(points), smallest),
+                                            no_status)
+        failed = status == 'F'
+
+        # Their MinElev/MaxElev at every radius, in the linear unit of the DEM
+        radii_feet = sorted(set(scenario.radius_feet for scenario in self.scenarios))
+        meters_per_unit = self.catalog.meters_per_unit(self.dem)
+        min_elev = numpy.full((len(radii_feet), len(points)), numpy.nan)
+        max_elev = numpy.full((len(radii_feet), len(points)), numpy.nan)
+        if failed.any():
+            min_elev[:, failed], max_elev[:, failed] = window_min_max_radii(
+                self.raster(self.dem), points['SHAPE@X'][failed], points['SHAPE@Y'][failed],
+                [radius_feet * 0.3048 / meters_per_unit for radius_feet in radii_feet],
+                self.block_cache)
+
+        # Classify the points under every scenario, first and second pass
+        statuses = []
+        for scenario in self.scenarios:
+            tolerance = numpy.full(len(points), scenario.tolerance)
+            elev_diff, status = classify_points(points['FldELEV'], points['GrELEV'], no_window,
+                                                no_window, tolerance, no_status)
+            radius_index = radii_feet.index(scenario.radius_feet)
+            elev_diff, status = classify_points(points['FldELEV'], points['GrELEV'],
+                                                min_elev[radius_index], max_elev[radius_index],
+                                                tolerance, status)
+            statuses.append(status)
+
+        # Write the Status fields and the pass-rate table
+        self.backend.add_fields(test_points, [(scenario.field_name, 'TEXT',
+                                               {'field_length': 2, 'field_domain': "PassFail"})
+                                              for scenario in self.scenarios])
+        self.backend.write_fields(test_points, points['OID@'],
+                                  {scenario.field_name: status
+                                   for scenario, status in zip(self.scenarios, statuses)})
+        rows = scenario_table(self.scenarios, statuses)
+        write_scenario_table(rows, os.path.join(self.outfolder, 'FBS_Audit_scenarios.csv'))
+        for row in rows:
+            self.printer("\t{scenario}: {P} of {points} pass, pass rate {pass_rate}, risk class "
+                         "{risk_class} needs {required_pass_rate}".format(**row))
+
+    @staticmethod
+    def test_point_chunk(lines):
+        """Builds a Test Point chunk from a list of (LineID, LineHash, coordinates, stations)"""
+        coords = numpy.concatenate([line[2] for line in lines])
+        stations = numpy.concatenate([line[3] for line in lines])
+        line_ids = numpy.concatenate([numpy.full(len(line[3]), line[0], dtype=numpy.int64)
+                                      for line in lines])
+        line_hashes = numpy.concatenate([numpy.full(len(line[3]), line[1], dtype='<U40')
+                                         for line in lines])
+
+        return {'X': coords[:, 0], 'Y': coords[:, 1], 'LineID': line_ids,
+                'LineHash': line_hashes, 'Station': stations,
+                'RiskClass': numpy.full(len(stations), DEFAULT_RISK_CLASS, dtype='<U2'),
+                'Tolerance': numpy.full(len(stations), DEFAULT_TOLERANCE)}
+
+    def test_point_rows(self, line_oids=None):
+        """Yields the Test_Points insert rows of the Flood Lines, or only of line_oids"""
+        for chunk in self.generate_test_points(line_oids=line_oids):
+            for insert_row in zip(zip(chunk['X'].tolist(), chunk['Y'].tolist()),
+                                  chunk['LineID'].tolist(), chunk['LineHash'].tolist(),
+                                  chunk['Station'].tolist(), chunk['RiskClass'].tolist(),
+                                  chunk['Tolerance'].tolist()):
+                yield insert_row
+
+    def update_test_points(self):
+        """Carries the previous Test_Points forward and regenerates only the changed lines
+
+        Lines are changed when their geometry or LN_TYP changed or when they are near a flood
+        polygon that changed.  Returns False if there is no previous run to carry forward or the
+        DEM or WSEL changed, in which case the Test_Points need to be created from scratch.
+        """
+        test_points = self.outfolder + '\\FBS_Audit.gdb\\Test_Points'
+        fingerprint_file = os.path.join(self.outfolder, 'FBS_Audit_fingerprints.json')
+        if not os.path.exists(fingerprint_file) or not self.backend.exists(test_points):
+            return False
+
+        with open(fingerprint_file) as json_file:
+            previous = json.load(json_file)
+        if previous['dem'] != self.fingerprints['dem'] or \
+           previous['wsel'] != self.fingerprints['wsel']:
+            return False
+
+        # Extents of the flood polygons that were added, changed or removed
+        changed_extents = numpy.array(
+            [extent for key, extent in self.fingerprints['polygons'].items()
+             if key not in previous['polygons']] +
+            [extent for key, extent in previous['polygons'].items()
+             if key not in self.fingerprints['polygons']]).reshape(-1, 4)
+
+        # Test_Points of an older run get the fields added since
+        self.backend.add_fields(test_points, TEST_POINT_FIELDS)
+
+        # The lines that already have Test Points by LineHash, in LineID order.  Lines with the
+        # same geometry and LN_TYP share a LineHash, so each is told apart by its LineID
+        points = self.backend.read_fields(test_points, ['LineID', 'LineHash'])
+        point_lines = list(zip(points['LineID'].tolist(), points['LineHash'].tolist()))
+        previous_lines = {}
+        for line_id, line_hash in sorted(set(point_lines)):
+            previous_lines.setdefault(line_hash, []).append(line_id)
+
+        # Lines that are new or changed, or that touch a changed polygon, need new Test Points.
+        # Every unchanged line takes over the Test Points of a previous line with its LineHash,
+        # kept by (LineID, LineHash) with its OID in this run's SFHA_Lines
+        keep_oids = {}
+        changed_oids = set()
+        for oid, parts, wkb, values in self.backend.read_shapes(self.fld_lines, ['LN_TYP']):
+            line_hash = self.fingerprint(wkb, values[0])
+            vertices = numpy.concatenate(parts)
+            x_min, y_min = vertices.min(axis=0)
+            x_max, y_max = vertices.max(axis=0)
+            touches = ((changed_extents[:, 0] <= x_max) & (changed_extents[:, 2] >= x_min) &
+                       (changed_extents[:, 1] <= y_max) & (changed_extents[:, 3] >= y_min)).any()
+            if previous_lines.get(line_hash) and not touches:
+                keep_oids[(previous_lines[line_hash].pop(0), line_hash)] = oid
+            else:
+                changed_oids.add(oid)
+
+        # Remove the Test Points of removed and changed lines
+        kept = numpy.array([point_line in keep_oids for point_line in point_lines], dtype=bool)
+        self.backend.delete_rows(test_points, points['OID@'][~kept].tolist())
+
+        # SFHA_Lines is copied again every run, so its OIDs shift when lines upstream are added
+        # or removed.  The kept Test Points take the OID of their line in this run
+        line_ids = numpy.array([keep_oids[point_line]
+                                for point_line, keep in zip(point_lines, kept) if keep],
+                               dtype=numpy.int64)
+        moved = line_ids != points['LineID'][kept]
+        if moved.any():
+            self.backend.write_fields(test_points, points['OID@'][kept][moved],
+                                      {'LineID': line_ids[moved]})
+
+        # Add the Test Points of the changed lines, they are evaluated because Status is NULL
+        self.printer("\t{} changed flood lines".format(len(changed_oids)))
+        if changed_oids:
+            self.insert_test_points(changed_oids)
+
+        return True
+
+    def write_fingerprints(self):
+        """Store the input fingerprints next to FBS_Audit.gdb for the next incremental run"""
+        with open(os.path.join(self.outfolder, 'FBS_Audit_fingerprints.json'), 'w') as json_file:
+            json.dump(self.fingerprints, json_file)
+
 
 if __name__ == "__main__":
     # Get user input
-    dem = sys.argv[1]
-    wsel = sys.argv[2]
-    workspace = sys.argv[3]
-    out = sys.argv[4]
-    fast_names = sys.argv[5]
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('dem', help="The terrain DEM")
+    parser.add_argument('wsel', help="The WSEL grid")
+    parser.add_argument('workspace', help="Workspace of the flood data")
+    parser.add_argument('out', help="The output folder")
+    parser.add_argument('fast_names', help="'true' to assign water names from the nearest "
+                                           "profile baselines")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='arcpy',
+                        help="Geoprocessing backend, 'ogr' runs on GDAL/OGR without ArcGIS")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="Number of processes to audit the Test_Points tiles with")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only re-audit the flood lines that changed since the last run")
+    parser.add_argument('--sample-cache',
+                        help="SQLite file to cache raster samples in between runs")
+    parser.add_argument('--sample-cache-size', type=int, default=10000000,
+                        help="Number of raster samples kept in the sample cache")
+    parser.add_argument('--profile-stages', action='store_true',
+                        help="Write a cProfile dump of every stage to FBS_Audit_profile")
+    parser.add_argument('--memory-budget-mb', type=int, default=512,
+                        help="Memory for the intermediate datasets before they spill to disk")
+    parser.add_argument('--scratch-folder', default=tempfile.gettempdir(),
+                        help="Local folder the intermediate datasets spill to")
+    parser.add_argument('--keep-sfha', action='store_true',
+                        help="Write SFHA_Lines and SFHA_Areas to FBS_Audit.gdb")
+    parser.add_argument('--export-format', choices=sorted(EXPORT_FORMATS),
+                        help="Also stream the Test_Points to FBS_Audit_Test_Points in this "
+                             "columnar format")
+    parser.add_argument('--resume', action='store_true',
+                        help="Skip the stages whose inputs are unchanged since their checkpoint")
+    parser.add_argument('--stage-workers', type=int, default=1,
+                        help="Number of independent stages run at the same time on threads, "
+                             "more than 1 needs the ogr backend since arcpy isn't thread safe")
+    parser.add_argument('--raster-cache',
+                        help="Local folder of tiled, memory-mapped copies of the DEM and WSEL, "
+                             "reused by every run against the same rasters")
+    parser.add_argument('--block-cache-mb', type=int,
+                        help="Memory for an LRU cache of raster blocks shared by the sampling and "
+                             "the second pass")
+    parser.add_argument('--screen', action='store_true',
+                        help="Decide the second pass from a min/max pyramid of the DEM where it "
+                             "can, reading full resolution windows only for the rest")
+    parser.add_argument('--scenarios', type=parse_scenarios,
+                        help="Also classify the Test_Points under these comma separated "
+                             "tolerance:radius_feet:risk_class scenarios, e.g. 0.5:19:B,1.0:50:A")
+    parser.add_argument('--summary-by-line', action='store_true',
+                        help="Also group the compliance summary by flood line")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Only check the inputs and list the stages that would run")
+    args = parser.parse_args()
 
     # Create an instance of the class and run it
-    print("Starting....\n")
-    arcpy.AddMessage("Starting....\n")
-    fbs_audit = FbsAudit(dem, wsel, workspace, out)
-
-    arcpy.AddMessage("Creating file geodatabase")
-    print("Creating file geodatabase")
-    fbs_audit.create_file_geodatabase()
-
-    arcpy.AddMessage("Checking spatial reference")
-    print("Checking spatial reference")
-    fbs_audit.spatial_reference_check()
-
-    arcpy.AddMessage("Checking for empty tables")
-    print("Checking for empty tables")
-    fbs_audit.is_empty_table_check()
-
-    arcpy.AddMessage("Creating SFHA polyons")
-    print("Creating SFHA polyons")
-    fbs_audit.create_sfha_flood_polys()
-
-    arcpy.AddMessage("Creating SFHA lines")
-    print("Creating SFHA lines")
-    fbs_audit.create_sfha_flood_lines()
-
-    arcpy.AddMessage("Creating Test Points")
-    print("Creating Test Points")
-    fbs_audit.create_test_points()
-
-    arcpy.AddMessage("Add Ground Elevations")
-    print("Add Ground Elevations")
-    fbs_audit.add_ground_elevations_points()
-
-    arcpy.AddMessage("Add WSEL Elevations")
-    print("Add WSEL Elevations")
-    fbs_audit.add_wsel_elevations_points()
-
-    arcpy.AddMessage("Calculate differences")
-    print("Calculate differences")
-    fbs_audit.calc_difference()
-
-    arcpy.AddMessage("Second Pass")
-    print("Second Pass")
-    fbs_audit.check_failed_points()
-
-    arcpy.AddMessage("Calculate Max/Min value")
-    print("Calculate Max/Min value")
-    fbs_audit.add_ground_elevations_area()
-
-    arcpy.AddMessage("Adding Water Names to Test_Points")
-    print("Adding Water Names to Test_Points")
-    if fast_names in ['true', 'True', True]:
-        fbs_audit.assign_water_names_near()
-    else:
-        fbs_audit.assign_water_names()
-
-    arcpy.AddMessage("Cleanup")
-    print("Cleanup")
-    fbs_audit.cleanup()
-
-    arcpy.AddMessage("\nAll Done")
-    print("\nAll Done")
+    FbsAudit.printer("Starting....\n")
+    if args.stage_workers > 1 and args.backend == 'arcpy':
+        FbsAudit.printer("--stage-workers above 1 needs the ogr backend, arcpy isn't thread safe"
+                         "\nExiting...", True)
+    fbs_audit = FbsAudit(args.dem, args.wsel, args.workspace, args.out, BACKENDS[args.backend]())
+    fbs_audit.scenarios = args.scenarios or []
+    fbs_audit.screen = args.screen
+    fbs_audit.summary_by_line = args.summary_by_line
+    if args.dry_run:
+        fbs_audit.dry_run(args.fast_names in ['true', 'True', True], args.processes,
+                          args.incremental, args.export_format)
+        sys.exit(0)
+    if args.sample_cache:
+        fbs_audit.sample_cache = SampleCache(args.sample_cache, args.sample_cache_size)
+    fbs_audit.raster_cache = args.raster_cache
+    if args.block_cache_mb:
+        fbs_audit.block_cache = BlockCache(args.block_cache_mb)
+    fbs_audit.intermediates = IntermediateStore(
+        fbs_audit.backend, args.out + '\\FBS_Audit.gdb', args.scratch_folder,
+        args.memory_budget_mb, SFHA_DATASETS if args.keep_sfha else [])
+    profiler = StageProfiler(args.out, args.profile_stages, fbs_audit.backend)
+
+    fbs_audit.run_audit(profiler, args.fast_names in ['true', 'True', True], args.processes,
+                        args.incremental, args.export_format, args.resume,
+                        args.stage_workers)
+    if fbs_audit.sample_cache is not None:
+        fbs_audit.printer("Sample cache: {} hits, {} misses".format(
+            fbs_audit.sample_cache.hits, fbs_audit.sample_cache.misses))
+        fbs_audit.sample_cache.close()
+    if fbs_audit.block_cache is not None:
+        fbs_audit.printer("Block cache: {} hits, {} misses".format(
+            fbs_audit.block_cache.hits, fbs_audit.block_cache.misses))
+    if fbs_audit.screen:
+        fbs_audit.printer("Pyramid screening: {} of {} failed points decided".format(
+            *fbs_audit.screen_counts))
+    profiler.write_report()
+
+    FbsAudit.printer("\nAll Done")
@@ -0,0 +1,706 @@
+""" Geoprocessing backends for the Flood Boundary Standard audit"""
+
+# fbs_backend: The feature, table and raster operations the audit runs on arcpy or GDAL/OGR
+
+import contextlib
+import os
+import shutil
+import numpy
+
+try:
+    from osgeo import gdal, ogr
+    gdal.UseExceptions()
+    ogr.UseExceptions()
+except ImportError:
+    # Only needed by the GDAL/OGR backend
+    gdal = ogr = None
+
+from fbs_catalog import LazyModule
+from fbs_raster import GdalRaster
+
+# Imported when ArcpyBackend first calls it, the GDAL/OGR backend runs without ArcGIS
+arcpy = LazyModule('arcpy')
+
+# Containers that hold several feature classes
+DATABASE_SUFFIXES = ('.gdb', '.mdb', '.gpkg')
+
+# Integer fields can't hold NaN, so read_fields gives their NULLs this value
+INTEGER_NULL = -1
+
+
+def geometry_parts(geometry):
+    """Returns the paths or rings of an OGR geometry as a list of (N, 2) vertex arrays"""
+    if geometry.GetGeometryCount() == 0:
+        points = geometry.GetPoints()
+        return [numpy.array(points)[:, :2]] if points else []
+
+    parts = []
+    for index in range(geometry.GetGeometryCount()):
+        parts.extend(geometry_parts(geometry.GetGeometryRef(index)))
+
+    return parts
+
+
+def shape_parts(shape):
+    """Returns the paths or rings of an arcpy geometry as a list of (N, 2) vertex arrays"""
+    parts = []
+    for part in shape:
+        # A None vertex separates the interior rings of a polygon part
+        ring = []
+        for vertex in part:
+            if vertex is None:
+                if ring:
+                    parts.append(numpy.array(ring))
+                ring = []
+            else:
+                ring.append((vertex.X, vertex.Y))
+        if ring:
+            parts.append(numpy.array(ring))
+
+    return parts
+
+
+class ArcpyBackend:
+    """Geoprocessing with arcpy on ArcGIS, the behaviour of the original audit"""
+
+    @staticmethod
+    def add_fields(in_table, fields):
+        """Adds the fields in_table doesn't have yet
+
+        fields is a list of (name, type, options) with the AddField type and keyword options.
+        """
+        field_names = [field.name for field in arcpy.ListFields(in_table)]
+        for field_name, field_type, options in fields:
+            if field_name not in field_names:
+                arcpy.AddField_management(in_table, field_name, field_type, **options)
+
+    @staticmethod
+    def append(in_fc, target_fc, where_clause=None):
+        """Appends the features of in_fc matching where_clause to target_fc"""
+        in_layer = ArcpyBackend.feature_layer(in_fc, 'fbs_append_lyr', where_clause)
+        arcpy.Append_management(in_layer, target_fc, "NO_TEST")
+
+    @staticmethod
+    def copy_features(in_fc, out_fc, where_clause=None):
+        """Copies the features of in_fc matching where_clause to a new out_fc"""
+        ArcpyBackend.delete(out_fc)
+        in_layer = ArcpyBackend.feature_layer(in_fc, 'fbs_copy_lyr', where_clause)
+        arcpy.CopyFeatures_management(in_layer, out_fc)
+
+    @staticmethod
+    def count(in_table):
+        """Returns the number of rows in in_table"""
+        return int(arcpy.GetCount_management(in_table)[0])
+
+    @staticmethod
+    def create_feature_class(out_fc, geometry_type, spatial_reference_of, fields):
+        """Creates an empty out_fc with the spatial reference of another dataset
+
+        fields is a list of (name, type, options) with the AddField type and keyword options.
+        """
+        ArcpyBackend.delete(out_fc)
+        out_path, out_name = out_fc.rsplit('\\', 1)
+        arcpy.CreateFeatureclass_management(
+            out_path, out_name, geometry_type,
+            spatial_reference=arcpy.Describe(spatial_reference_of).spatialReference)
+        ArcpyBackend.add_fields(out_fc, fields)
+
+    @staticmethod
+    def create_file_geodatabase(out_folder, out_name, domains):
+        """Creates an empty file geodatabase with coded value domains
+
+        domains is a list of (name, description, type, codes) with codes a dictionary of code
+        to description.
+        """
+        out_gdb = out_folder + '\\' + out_name
+        ArcpyBackend.delete(out_gdb)
+        arcpy.CreateFileGDB_management(out_folder, out_name)
+
+        for domain_name, description, field_type, codes in domains:
+            arcpy.CreateDomain_management(out_gdb, domain_name, description, field_type, "CODED")
+            for code in codes:
+                arcpy.AddCodedValueToDomain_management(out_gdb, domain_name, code, codes[code])
+
+    @staticmethod
+    def delete(dataset):
+        """Deletes a dataset if it exists"""
+        if arcpy.Exists(dataset):
+            arcpy.Delete_management(dataset)
+
+    @staticmethod
+    def delete_fields(in_table, field_names):
+        """Deletes the fields of in_table that are in field_names"""
+        for field in arcpy.ListFields(in_table):
+            if field.name in field_names:
+                arcpy.DeleteField_management(in_table, field.name)
+
+    @staticmethod
+    def delete_rows(in_table, oids):
+        """Deletes the rows of in_table with the given OIDs"""
+        oids = set(oids)
+        with arcpy.da.UpdateCursor(in_table, ['OID@']) as update_cursor:
+            for update_row in update_cursor:
+                if update_row[0] in oids:
+                    update_cursor.deleteRow()
+
+    @staticmethod
+    def describe_raster(in_raster):
+        """Returns the path, extent, width, height and cell sizes of a raster"""
+        description = arcpy.Describe(in_raster)
+        return [description.catalogPath, description.extent.JSON, description.width,
+                description.height, description.meanCellWidth, description.meanCellHeight]
+
+    @staticmethod
+    def dissolve(in_fc, out_fc, dissolve_field, where_clause=None):
+        """Dissolves the features of in_fc matching where_clause into single part out_fc"""
+        ArcpyBackend.delete(out_fc)
+        in_layer = ArcpyBackend.feature_layer(in_fc, 'fbs_dissolve_lyr', where_clause)
+        arcpy.Dissolve_management(in_layer, out_fc, dissolve_field, multi_part='SINGLE_PART')
+
+    @staticmethod
+    def exists(dataset):
+        """Returns True if the dataset exists"""
+        return arcpy.Exists(dataset)
+
+    @staticmethod
+    def factory_code(dataset):
+        """Returns the spatial reference factory code of a dataset as a string"""
+        return str(arcpy.Describe(dataset).spatialReference.factoryCode)
+
+    @staticmethod
+    def feature_classes(workspace):
+        """Yields (name, path) of the feature classes in a workspace and its feature datasets
+
+        Each feature dataset is only listed once the ones before it have been consumed.
+        """
+        arcpy.env.workspace = workspace
+        for name in arcpy.ListFeatureClasses() or []:
+            yield str(name), workspace + '\\' + str(name)
+
+        # Check in any datasets
+        if workspace.endswith(DATABASE_SUFFIXES):
+            for dataset in arcpy.ListDatasets("*", "Feature") or []:
+                for name in arcpy.ListFeatureClasses("*", "All", dataset) or []:
+                    yield str(name), workspace + '\\' + dataset + '\\' + str(name)
+
+    @staticmethod
+    def feature_layer(in_fc, layer_name, where_clause=None):
+        """Makes a new feature layer of in_fc, replacing any layer with the same name"""
+        if arcpy.Exists(layer_name):
+            arcpy.Delete_management(layer_name)
+        return arcpy.MakeFeatureLayer_management(in_fc, layer_name, where_clause)
+
+    @staticmethod
+    def field_delimiters(in_table, field_name):
+        """Returns field_name delimited for a where clause on in_table"""
+        return arcpy.AddFieldDelimiters(in_table, field_name)
+
+    @staticmethod
+    def insert_rows(in_table, field_names, rows):
+        """Inserts rows into in_table, 'SHAPE@XY' takes an (x, y) tuple"""
+        with arcpy.da.InsertCursor(in_table, field_names) as insert_cursor:
+            for insert_row in rows:
+                insert_cursor.insertRow(insert_row)
+
+    @staticmethod
+    def list_datasets(workspace):
+        """Returns the names of the feature classes and tables in a workspace"""
+        if not arcpy.Exists(workspace):
+            return []
+        with arcpy.EnvManager(workspace=workspace):
+            return (arcpy.ListFeatureClasses() or []) + (arcpy.ListTables() or [])
+
+    @staticmethod
+    def memory_workspace():
+        """Returns the workspace that keeps datasets in memory"""
+        return 'in_memory'
+
+    @staticmethod
+    def meters_per_unit(dataset):
+        """Returns the meters per linear unit of a dataset's spatial reference"""
+        return arcpy.Describe(dataset).spatialReference.metersPerUnit
+
+    @staticmethod
+    def raster(in_raster):
+        """Returns in_raster as the samplers in fbs_raster read it"""
+        return in_raster
+
+    @staticmethod
+    def read_fields(in_table, field_names, where_clause=None):
+        """Reads the OID and field_names of in_table into a NumPy structured array"""
+        # Integer NULLs are read as INTEGER_NULL, other numeric NULLs as NaN and text NULLs as an
+        # empty string
+        null_values = {}
+        for field in arcpy.ListFields(in_table):
+            if field.name in field_names:
+                if field.type in ['String']:
+                    null_values[field.name] = ''
+                elif field.type in ['Integer', 'SmallInteger', 'BigInteger', 'OID']:
+                    null_values[field.name] = INTEGER_NULL
+                else:
+                    null_values[field.name] = numpy.nan
+
+        return arcpy.da.FeatureClassToNumPyArray(in_table, ['OID@'] + list(field_names),
+                                                 where_clause, null_value=null_values)
+
+    @staticmethod
+    def read_shapes(in_fc, field_names=(), where_clause=None):
+        """Yields (OID, parts, WKB, values) for the features of in_fc with a geometry
+
+        parts is a list of (N, 2) vertex arrays, one per path or ring, and values is a tuple of
+        the field_names values.
+        """
+        with arcpy.da.SearchCursor(in_fc, ['OID@', 'SHAPE@', 'SHAPE@WKB'] + list(field_names),
+                                   where_clause) as search_cursor:
+            for search_row in search_cursor:
+                if search_row[1] is None:
+                    continue
+                yield search_row[0], shape_parts(search_row[1]), search_row[2], search_row[3:]
+
+    @staticmethod
+    def write_fields(in_table, oids, columns):
+        """Writes a dictionary of field name to value arrays back to in_table, matched by OID"""
+        field_names = list(columns)
+
+        # NaN values are written as NULL
+        values = []
+        for field_name in field_names:
+            column = numpy.asarray(columns[field_name])
+            if column.dtype.kind == 'f':
+                column = numpy.where(numpy.isnan(column), None, column.astype(object))
+            values.append(column.tolist())
+        row_index = dict(zip(numpy.asarray(oids).tolist(), range(len(oids))))
+
+        # Single cursor pass, rows without a matching OID are left alone
+        with arcpy.da.UpdateCursor(in_table, ['OID@'] + field_names) as update_cursor:
+            for update_row in update_cursor:
+                index = row_index.get(update_row[0])
+                if index is None:
+                    continue
+                update_cursor.updateRow([update_row[0]] + [value[index] for value in values])
+
+
+class OgrBackend:
+    """Geoprocessing with GDAL/OGR and NumPy, for running the audit on Linux
+
+    Paths are the same '\\' separated paths the audit builds for arcpy.  A path inside a .gdb,
+    .mdb or .gpkg names a layer of that database and FBS_Audit.gdb is written with the
+    OpenFileGDB driver (GDAL 3.6 or later).
+    """
+
+    # AddField types to OGR field types and subtypes
+    FIELD_TYPES = {'DOUBLE': ('OFTReal', 'OFSTNone'), 'FLOAT': ('OFTReal', 'OFSTFloat32'),
+                   'LONG': ('OFTInteger', 'OFSTNone'), 'SHORT': ('OFTInteger', 'OFSTInt16'),
+                   'TEXT': ('OFTString', 'OFSTNone')}
+
+    # CreateFeatureclass geometry types to OGR geometry types
+    GEOMETRY_TYPES = {'POINT': 'wkbPoint', 'POLYLINE': 'wkbMultiLineString',
+                      'POLYGON': 'wkbMultiPolygon'}
+
+    # Data source path of the in-memory workspace
+    MEMORY_WORKSPACE = 'memory'
+
+    def __init__(self):
+        """Starts without any open rasters or in-memory datasets"""
+        self.memory_source = None  # The in-memory data source, created when first used
+        self.rasters = {}  # GdalRasters by path, shared by every audit run on this backend
+
+    def add_fields(self, in_table, fields):
+        """Adds the fields in_table doesn't have yet
+
+        fields is a list of (name, type, options) with the AddField type and keyword options.
+        """
+        in_source, in_layer = self.open_layer(in_table, update=True)
+        self.create_fields(in_layer, fields)
+
+    def append(self, in_fc, target_fc, where_clause=None):
+        """Appends the features of in_fc matching where_clause to target_fc"""
+        in_source, in_layer = self.open_layer(in_fc)
+        target_source, target_layer = self.open_layer(target_fc, update=True)
+        in_layer.SetAttributeFilter(where_clause)
+        target_definition = target_layer.GetLayerDefn()
+
+        # Fields are matched by name like Append with NO_TEST
+        with self.transaction(target_source):
+            for in_feature in in_layer:
+                out_feature = ogr.Feature(target_definition)
+                out_feature.SetFrom(in_feature)
+                if in_feature.GetGeometryRef() is not None:
+                    out_feature.SetGeometry(ogr.ForceToMultiPolygon(
+                        in_feature.GetGeometryRef().GetLinearGeometry()))
+                target_layer.CreateFeature(out_feature)
+
+    def copy_features(self, in_fc, out_fc, where_clause=None):
+        """Copies the features of in_fc matching where_clause to a new out_fc"""
+        self.delete(out_fc)
+        in_source, in_layer = self.open_layer(in_fc)
+        in_layer.SetAttributeFilter(where_clause)
+        out_source = self.open_source(self.split_path(out_fc)[0], update=True)
+        out_source.CopyLayer(in_layer, self.split_path(out_fc)[1])
+
+    def count(self, in_table):
+        """Returns the number of rows in in_table"""
+        in_source, in_layer = self.open_layer(in_table)
+        return in_layer.GetFeatureCount()
+
+    def create_feature_class(self, out_fc, geometry_type, spatial_reference_of, fields):
+        """Creates an empty out_fc with the spatial reference of another dataset
+
+        fields is a list of (name, type, options) with the AddField type and keyword options.
+        """
+        spatial_reference = self.spatial_reference(spatial_reference_of)
+        self.delete(out_fc)
+        source_path, layer_name = self.split_path(out_fc)
+        out_source = self.open_source(source_path, update=True)
+        out_layer = out_source.CreateLayer(layer_name, spatial_reference,
+                                           getattr(ogr, self.GEOMETRY_TYPES[geometry_type]))
+        self.create_fields(out_layer, fields)
+
+    def create_fields(self, in_layer, fields):
+        """Creates the fields of an open layer that it doesn't have yet"""
+        for field_name, field_type, options in fields:
+            if in_layer.GetLayerDefn().GetFieldIndex(field_name) >= 0:
+                continue
+            ogr_type, ogr_subtype = self.FIELD_TYPES[field_type]
+            field_definition = ogr.FieldDefn(field_name, getattr(ogr, ogr_type))
+            field_definition.SetSubType(getattr(ogr, ogr_subtype))
+            if 'field_length' in options:
+                field_definition.SetWidth(options['field_length'])
+            if 'field_domain' in options:
+                field_definition.SetDomainName(options['field_domain'])
+            in_layer.CreateField(field_definition)
+
+    def create_file_geodatabase(self, out_folder, out_name, domains):
+        """Creates an empty file geodatabase with coded value domains
+
+        domains is a list of (name, description, type, codes) with codes a dictionary of code
+        to description.
+        """
+        out_gdb = self.normalize_path(out_folder + '\\' + out_name)
+        self.delete(out_gdb)
+        out_source = gdal.GetDriverByName('OpenFileGDB').Create(out_gdb, 0, 0, 0, gdal.GDT_Unknown)
+
+        for domain_name, description, field_type, codes in domains:
+            ogr_type, ogr_subtype = self.FIELD_TYPES[field_type]
+            out_source.AddFieldDomain(ogr.CreateCodedFieldDomain(
+                domain_name, description, getattr(ogr, ogr_type), getattr(ogr, ogr_subtype),
+                codes))
+
+    def delete(self, dataset):
+        """Deletes a dataset if it exists"""
+        if not self.exists(dataset):
+            return
+
+        source_path, layer_name = self.split_path(dataset)
+        if layer_name is None:
+            # The whole in-memory workspace, a database or a shapefile
+            if source_path == self.MEMORY_WORKSPACE:
+                self.memory_source = None
+            elif os.path.isdir(source_path):
+                shutil.rmtree(source_path)
+            else:
+                ogr.GetDriverByName('ESRI Shapefile').DeleteDataSource(source_path)
+            return
+
+        out_source = self.open_source(source_path, update=True)
+        for index in range(out_source.GetLayerCount()):
+            if out_source.GetLayerByIndex(index).GetName() == layer_name:
+                out_source.DeleteLayer(index)
+                return
+
+    def delete_fields(self, in_table, field_names):
+        """Deletes the fields of in_table that are in field_names"""
+        in_source, in_layer = self.open_layer(in_table, update=True)
+        for field_name in field_names:
+            field_index = in_layer.GetLayerDefn().GetFieldIndex(field_name)
+            if field_index >= 0:
+                in_layer.DeleteField(field_index)
+
+    def delete_rows(self, in_table, oids):
+        """Deletes the rows of in_table with the given OIDs"""
+        in_source, in_layer = self.open_layer(in_table, update=True)
+        with self.transaction(in_source):
+            for oid in oids:
+                in_layer.DeleteFeature(int(oid))
+
+    def describe_raster(self, in_raster):
+        """Returns the path, extent, width, height and cell sizes of a raster"""
+        raster = self.raster(in_raster)
+        return [raster.path, [raster.extent.XMin, raster.extent.YMin, raster.extent.XMax,
+                              raster.extent.YMax], raster.width, raster.height,
+                raster.meanCellWidth, raster.meanCellHeight]
+
+    def dissolve(self, in_fc, out_fc, dissolve_field, where_clause=None):
+        """Dissolves the features of in_fc matching where_clause into single part out_fc"""
+        self.delete(out_fc)
+        in_source, in_layer = self.open_layer(in_fc)
+        in_layer.SetAttributeFilter(where_clause)
+        field_definition = in_layer.GetLayerDefn().GetFieldDefn(
+            in_layer.GetLayerDefn().GetFieldIndex(dissolve_field))
+
+        # Collect the geometries of every dissolve value
+        groups = {}
+        for in_feature in in_layer:
+            geometry = in_feature.GetGeometryRef()
+            if geometry is None:
+                continue
+            group = groups.setdefault(in_feature.GetField(dissolve_field),
+                                      ogr.Geometry(ogr.wkbMultiPolygon))
+            geometry = ogr.ForceToMultiPolygon(geometry.GetLinearGeometry())
+            for index in range(geometry.GetGeometryCount()):
+                group.AddGeometry(geometry.GetGeometryRef(index))
+
+        # Write each dissolved polygon as its own feature
+        source_path, layer_name = self.split_path(out_fc)
+        out_source = self.open_source(source_path, update=True)
+        out_layer = out_source.CreateLayer(layer_name, in_layer.GetSpatialRef(),
+                                           ogr.wkbMultiPolygon)
+        out_layer.CreateField(ogr.FieldDefn(dissolve_field, field_definition.GetType()))
+        with self.transaction(out_source):
+            for value, group in groups.items():
+                dissolved = ogr.ForceToMultiPolygon(group.UnionCascaded())
+                for index in range(dissolved.GetGeometryCount()):
+                    out_feature = ogr.Feature(out_layer.GetLayerDefn())
+                    out_feature.SetField(dissolve_field, value)
+                    out_feature.SetGeometry(ogr.ForceToMultiPolygon(
+                        dissolved.GetGeometryRef(index)))
+                    out_layer.CreateFeature(out_feature)
+
+    def exists(self, dataset):
+        """Returns True if the dataset exists"""
+        source_path, layer_name = self.split_path(dataset)
+        if source_path == self.MEMORY_WORKSPACE:
+            if self.memory_source is None or layer_name is None:
+                return self.memory_source is not None
+        elif layer_name is None:
+            return os.path.exists(source_path)
+        elif not os.path.exists(source_path):
+            return False
+        in_source = self.open_source(source_path)
+        return in_source.GetLayerByName(layer_name) is not None
+
+    def factory_code(self, dataset):
+        """Returns the spatial reference factory code of a dataset as a string"""
+        return str(self.spatial_reference(dataset).GetAuthorityCode(None))
+
+    def feature_classes(self, workspace):
+        """Yields (name, path) of the feature classes in a workspace"""
+        workspace_path = self.normalize_path(workspace)
+        if not workspace.endswith(DATABASE_SUFFIXES):
+            for name in sorted(os.listdir(workspace_path)):
+                if name.lower().endswith('.shp'):
+                    yield name, workspace + '\\' + name
+            return
+
+        # Feature datasets are flattened by OGR, so the layers are addressed by name
+        in_source = self.open_source(workspace_path)
+        for index in range(in_source.GetLayerCount()):
+            in_layer = in_source.GetLayerByIndex(index)
+            if in_layer.GetGeomType() != ogr.wkbNone:
+                yield in_layer.GetName(), workspace + '\\' + in_layer.GetName()
+
+    @staticmethod
+    def field_delimiters(in_table, field_name):
+        """Returns field_name delimited for a where clause on in_table"""
+        return '"{}"'.format(field_name)
+
+    def insert_rows(self, in_table, field_names, rows):
+        """Inserts rows into in_table, 'SHAPE@XY' takes an (x, y) tuple"""
+        in_source, in_layer = self.open_layer(in_table, update=True)
+        layer_definition = in_layer.GetLayerDefn()
+        with self.transaction(in_source):
+            for insert_row in rows:
+                feature = ogr.Feature(layer_definition)
+                for field_name, value in zip(field_names, insert_row):
+                    if field_name == 'SHAPE@XY':
+                        point = ogr.Geometry(ogr.wkbPoint)
+                        point.AddPoint_2D(*value)
+                        feature.SetGeometry(point)
+                    elif value is None:
+                        feature.SetFieldNull(field_name)
+                    else:
+                        feature.SetField(field_name, value)
+                in_layer.CreateFeature(feature)
+
+    def list_datasets(self, workspace):
+        """Returns the names of the feature classes and tables in a workspace"""
+        workspace_path = self.normalize_path(workspace)
+        if workspace_path == self.MEMORY_WORKSPACE:
+            if self.memory_source is None:
+                return []
+        elif not os.path.exists(workspace_path):
+            return []
+        in_source = self.open_source(workspace_path)
+        return [in_source.GetLayerByIndex(index).GetName()
+                for index in range(in_source.GetLayerCount())]
+
+    def memory_workspace(self):
+        """Returns the workspace that keeps datasets in memory"""
+        return self.MEMORY_WORKSPACE
+
+    def meters_per_unit(self, dataset):
+        """Returns the meters per linear unit of a dataset's spatial reference"""
+        return self.spatial_reference(dataset).GetLinearUnits()
+
+    @staticmethod
+    def normalize_path(path):
+        """Returns a '\\' separated audit path with the separators of this platform"""
+        return os.path.normpath(path.replace('\\', '/'))
+
+    def open_layer(self, in_table, update=False):
+        """Returns the (data source, layer) of a feature class or table path
+
+        The data source is returned too because the layer is only valid while it is open.
+        """
+        source_path, layer_name = self.split_path(in_table)
+        in_source = self.open_source(source_path, update)
+        if layer_name is None:
+            return in_source, in_source.GetLayerByIndex(0)
+        return in_source, in_source.GetLayerByName(layer_name)
+
+    def open_source(self, source_path, update=False):
+        """Opens an OGR data source, the in-memory workspace stays open for the backend's life"""
+        if source_path == self.MEMORY_WORKSPACE:
+            if self.memory_source is None:
+                self.memory_source = gdal.GetDriverByName('Memory').Create(
+                    self.MEMORY_WORKSPACE, 0, 0, 0, gdal.GDT_Unknown)
+            return self.memory_source
+
+        flags = gdal.OF_VECTOR | (gdal.OF_UPDATE if update else gdal.OF_READONLY)
+        return gdal.OpenEx(source_path, flags)
+
+    def raster(self, in_raster):
+        """Returns in_raster as the samplers in fbs_raster read it, opening each path once"""
+        if in_raster not in self.rasters:
+            self.rasters[in_raster] = GdalRaster(self.normalize_path(in_raster))
+        return self.rasters[in_raster]
+
+    def read_fields(self, in_table, field_names, where_clause=None):
+        """Reads the OID and field_names of in_table into a NumPy structured array
+
+        Integer fields are read as int64 with NULLs as INTEGER_NULL, other numeric fields as
+        float64 with NULLs as NaN and text NULLs as an empty string.  'SHAPE@X' and 'SHAPE@Y'
+        are the point coordinates, or the centroid of other geometries.
+        """
+        in_source, in_layer = self.open_layer(in_table)
+        in_layer.SetAttributeFilter(where_clause)
+        layer_definition = in_layer.GetLayerDefn()
+
+        # Column types and NULL values from the field definitions
+        dtypes = [('OID@', numpy.int64)]
+        null_values = {}
+        for field_name in field_names:
+            if field_name in ['SHAPE@X', 'SHAPE@Y']:
+                dtypes.append((field_name, numpy.float64))
+                continue
+            field_definition = layer_definition.GetFieldDefn(
+                layer_definition.GetFieldIndex(field_name))
+            if field_definition.GetType() == ogr.OFTString:
+                dtypes.append((field_name, '<U{}'.format(field_definition.GetWidth() or 254)))
+                null_values[field_name] = ''
+            elif field_definition.GetType() in [ogr.OFTInteger, ogr.OFTInteger64]:
+                dtypes.append((field_name, numpy.int64))
+                null_values[field_name] = INTEGER_NULL
+            else:
+                dtypes.append((field_name, numpy.float64))
+                null_values[field_name] = numpy.nan
+
+        rows = []
+        for feature in in_layer:
+            geometry = feature.GetGeometryRef()
+            if geometry is not None and ogr.GT_Flatten(geometry.GetGeometryType()) != ogr.wkbPoint:
+                geometry = geometry.Centroid()
+            row = [feature.GetFID()]
+            for field_name in field_names:
+                if field_name == 'SHAPE@X':
+                    row.append(numpy.nan if geometry is None else geometry.GetX())
+                elif field_name == 'SHAPE@Y':
+                    row.append(numpy.nan if geometry is None else geometry.GetY())
+                elif feature.IsFieldSetAndNotNull(field_name):
+                    row.append(feature.GetField(field_name))
+                else:
+                    row.append(null_values[field_name])
+            rows.append(tuple(row))
+
+        return numpy.array(rows, dtype=dtypes)
+
+    def read_shapes(self, in_fc, field_names=(), where_clause=None):
+        """Yields (OID, parts, WKB, values) for the features of in_fc with a geometry
+
+        parts is a list of (N, 2) vertex arrays, one per path or ring, and values is a tuple of
+        the field_names values.
+        """
+        in_source, in_layer = self.open_layer(in_fc)
+        in_layer.SetAttributeFilter(where_clause)
+        for feature in in_layer:
+            geometry = feature.GetGeometryRef()
+            if geometry is None:
+                continue
+            yield (feature.GetFID(), geometry_parts(geometry.GetLinearGeometry()),
+                   bytes(geometry.ExportToIsoWkb()),
+                   tuple(feature.GetField(field_name) for field_name in field_names))
+
+    def spatial_reference(self, dataset):
+        """Returns the OGR spatial reference of a feature class or raster"""
+        source_path, layer_name = self.split_path(dataset)
+        if layer_name is not None or source_path.lower().endswith('.shp'):
+            in_source, in_layer = self.open_layer(dataset)
+            return in_layer.GetSpatialRef().Clone()
+        in_source = gdal.Open(source_path)
+        return in_source.GetSpatialRef().Clone()
+
+    def split_path(self, dataset):
+        """Splits a dataset path into its data source path and layer name
+
+        The layer name is None for a whole database, a shapefile or a raster.
+        """
+        path = self.normalize_path(dataset)
+        parts = path.split(os.sep)
+        if parts[0] == self.MEMORY_WORKSPACE:
+            return self.MEMORY_WORKSPACE, parts[-1] if len(parts) > 1 else None
+        for index, part in enumerate(parts[:-1]):
+            if part.lower().endswith(DATABASE_SUFFIXES):
+                return os.sep.join(parts[:index + 1]), parts[-1]
+
+        return path, None
+
+    @staticmethod
+    @contextlib.contextmanager
+    def transaction(in_source):
+        """Context manager that batches the edits in one transaction if the source supports it"""
+        active = in_source.TestCapability(ogr.ODsCTransactions)
+        if active:
+            in_source.StartTransaction()
+        try:
+            yield
+        except Exception:
+            if active:
+                in_source.RollbackTransaction()
+            raise
+        if active:
+            in_source.CommitTransaction()
+        in_source.FlushCache()
+
+    def write_fields(self, in_table, oids, columns):
+        """Writes a dictionary of field name to value arrays back to in_table, matched by OID"""
+        in_source, in_layer = self.open_layer(in_table, update=True)
+        field_names = list(columns)
+        values = [numpy.asarray(columns[field_name]).tolist() for field_name in field_names]
+
+        # NaN and None values are written as NULL
+        with self.transaction(in_source):
+            for index, oid in enumerate(numpy.asarray(oids).tolist()):
+                feature = in_layer.GetFeature(oid)
+                if feature is None:
+                    continue
+                for field_name, column in zip(field_names, values):
+                    value = column[index]
+                    if value is None or (isinstance(value, float) and numpy.isnan(value)):
+                        feature.SetFieldNull(field_name)
+                    else:
+                        feature.SetField(field_name, value)
+                in_layer.SetFeature(feature)
+
+
+# Backends by the name given on the command line
+BACKENDS = {'arcpy': ArcpyBackend, 'ogr': OgrBackend}
@@ -0,0 +1,254 @@
+""" Runs Flood Boundary Standard audits for a manifest of submittals"""
+
+# fbs_batch: Audits many submittal workspaces in one run and rolls up the results
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from fbs_audit import SFHA_DATASETS, FbsAudit
+from fbs_backend import BACKENDS
+from fbs_cache import SampleCache
+from fbs_export import EXPORT_FORMATS
+from fbs_profile import StageProfiler
+from fbs_raster import BlockCache
+from fbs_scenarios import STATUS_CODES, parse_scenarios, pass_rate
+from fbs_storage import IntermediateStore
+
+# Columns every manifest row needs
+MANIFEST_COLUMNS = ['workspace', 'dem', 'wsel', 'out']
+
+# Backends of the worker process by name.  Every job the worker runs uses the same backend, so
+# the rasters it opens stay open for the next job that shares them
+WORKER_BACKENDS = {}
+
+
+def audit_group(group):
+    """Runs the jobs that share a DEM one after another in one process
+
+    group is a (backend name, jobs, options) tuple.  Running them together lets the jobs share
+    the open DEM and its warm caches.  Returns the job summaries.
+    """
+    backend_name, jobs, options = group
+    if backend_name not in WORKER_BACKENDS:
+        WORKER_BACKENDS[backend_name] = BACKENDS[backend_name]()
+    backend = WORKER_BACKENDS[backend_name]
+
+    sample_cache = None
+    if options['sample_cache']:
+        sample_cache = SampleCache(options['sample_cache'], options['sample_cache_size'])
+
+    # The jobs of a group share a DEM, so they share its cached blocks too
+    block_cache = None
+    if options['block_cache_mb']:
+        block_cache = BlockCache(options['block_cache_mb'])
+
+    summaries = [audit_job(job, backend, sample_cache, block_cache, options) for job in jobs]
+
+    if sample_cache is not None:
+        sample_cache.close()
+    return summaries
+
+
+def audit_job(job, backend, sample_cache, block_cache, options):
+    """Runs the audit of one job and returns its summary
+
+    A job that fails is recorded with its error instead of stopping the batch.
+    """
+    FbsAudit.printer("Job {}: {}".format(job['job'], job['workspace']))
+    summary = dict(job)
+    counts = {}
+    start = time.perf_counter()
+    try:
+        fbs_audit = FbsAudit(job['dem'], job['wsel'], job['workspace'], job['out'], backend)
+        fbs_audit.block_cache = block_cache
+        fbs_audit.sample_cache = sample_cache
+        fbs_audit.scenarios = options['scenarios'] or []
+        fbs_audit.summary_by_line = options['summary_by_line']
+        fbs_audit.screen = options['screen']
+        fbs_audit.raster_cache = options['raster_cache']
+        fbs_audit.intermediates = IntermediateStore(
+            backend, job['out'] + '\\FBS_Audit.gdb', options['scratch_folder'],
+            options['memory_budget_mb'], SFHA_DATASETS if options['keep_sfha'] else [])
+        profiler = StageProfiler(job['out'], options['profile_stages'], backend)
+        fbs_audit.run_audit(profiler, job['fast_names'], 1, options['incremental'],
+                            options['export_format'], options['resume'],
+                            options['stage_workers'])
+        profiler.write_report()
+        counts = fbs_audit.status_counts()
+        summary['result'] = 'done'
+    except SystemExit:
+        # FbsAudit.printer exits after printing why an input check failed
+        summary['result'] = 'error'
+        summary['error'] = 'An input check failed, see the messages of the job'
+    except Exception as error:
+        summary['result'] = 'error'
+        summary['error'] = '{}: {}'.format(type(error).__name__, error)
+
+    summary['wall_seconds'] = round(time.perf_counter() - start, 3)
+    summary['points'] = sum(counts.values())
+    for code in STATUS_CODES:
+        summary[code] = counts.get(code, 0)
+
+    return summary
+
+
+def group_jobs(jobs):
+    """Groups the jobs by DEM, largest groups first so they start before the short ones"""
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job['dem'], []).append(job)
+
+    return sorted(groups.values(), key=len, reverse=True)
+
+
+def read_manifest(manifest):
+    """Reads the jobs from a CSV manifest with workspace, dem, wsel and out columns
+
+    An optional fast_names column set to 'true' assigns the water names of that job from the
+    nearest profile baselines.
+    """
+    with open(manifest, newline='') as csv_file:
+        rows = list(csv.DictReader(csv_file))
+
+    missing = [column for column in MANIFEST_COLUMNS if rows and column not in rows[0]]
+    if not rows or missing:
+        FbsAudit.printer("The manifest needs the columns " + ", ".join(MANIFEST_COLUMNS) +
+                         "\nExiting...", True)
+
+    # Every job needs its own output folder
+    outfolders = [row['out'] for row in rows]
+    duplicates = sorted(set(out for out in outfolders if outfolders.count(out) > 1))
+    if duplicates:
+        FbsAudit.printer("These output folders are used by more than one job: " +
+                         ", ".join(duplicates) + "\nExiting...", True)
+
+    return [{'job': index + 1, 'workspace': row['workspace'], 'dem': row['dem'],
+             'wsel': row['wsel'], 'out': row['out'],
+             'fast_names': (row.get('fast_names') or '').lower() == 'true'}
+            for index, row in enumerate(rows)]
+
+
+def roll_up(summaries):
+    """Returns the totals over all the job summaries"""
+    totals = {'jobs': len(summaries),
+              'done': sum(summary['result'] == 'done' for summary in summaries),
+              'errors': sum(summary['result'] == 'error' for summary in summaries),
+              'points': sum(summary['points'] for summary in summaries),
+              'wall_seconds': round(sum(summary['wall_seconds'] for summary in summaries), 3)}
+    for code in STATUS_CODES:
+        totals[code] = sum(summary[code] for summary in summaries)
+    totals['pass_rate'] = pass_rate(totals['P'], totals['F'])
+
+    return totals
+
+
+def run_batch(jobs, backend_name, processes, options):
+    """Runs the jobs across a pool of worker processes and returns their summaries in job order"""
+    groups = [(backend_name, group, options) for group in group_jobs(jobs)]
+
+    if processes > 1 and len(groups) > 1:
+        # Inside ArcGIS sys.executable is the application, so point the workers at the Python
+        # interpreter
+        python_exe = os.path.join(sys.exec_prefix, 'python.exe')
+        if os.path.exists(python_exe):
+            multiprocessing.set_executable(python_exe)
+        with multiprocessing.Pool(min(processes, len(groups))) as pool:
+            results = list(pool.imap_unordered(audit_group, groups))
+    else:
+        results = [audit_group(group) for group in groups]
+
+    return sorted([summary for result in results for summary in result],
+                  key=lambda summary: summary['job'])
+
+
+if __name__ == "__main__":
+    # Get user input
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('manifest', help="CSV file with workspace, dem, wsel and out columns and "
+                                         "an optional fast_names column")
+    parser.add_argument('--summary', help="JSON file for the roll-up summary, by default "
+                                          "FBS_Audit_batch.json next to the manifest")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='arcpy',
+                        help="Geoprocessing backend, 'ogr' runs on GDAL/OGR without ArcGIS")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="Number of worker processes, jobs sharing a DEM run in the same one")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only re-audit the flood lines that changed since each job's last run")
+    parser.add_argument('--sample-cache',
+                        help="SQLite file to cache raster samples in, shared by every job")
+    parser.add_argument('--sample-cache-size', type=int, default=10000000,
+                        help="Number of raster samples kept in the sample cache")
+    parser.add_argument('--profile-stages', action='store_true',
+                        help="Write a cProfile dump of every stage of every job")
+    parser.add_argument('--memory-budget-mb', type=int, default=512,
+                        help="Memory per worker for the intermediate datasets before they spill")
+    parser.add_argument('--scratch-folder', default=tempfile.gettempdir(),
+                        help="Local folder the intermediate datasets spill to")
+    parser.add_argument('--keep-sfha', action='store_true',
+                        help="Write SFHA_Lines and SFHA_Areas to each job's FBS_Audit.gdb")
+    parser.add_argument('--export-format', choices=sorted(EXPORT_FORMATS),
+                        help="Also stream each job's Test_Points to a columnar file")
+    parser.add_argument('--raster-cache',
+                        help="Local folder of tiled, memory-mapped copies of the DEMs and WSELs, "
+                             "shared by every job")
+    parser.add_argument('--block-cache-mb', type=int,
+                        help="Memory per worker for an LRU cache of raster blocks shared by the "
+                             "jobs of a DEM")
+    parser.add_argument('--resume', action='store_true',
+                        help="Skip the stages of each job whose inputs are unchanged since their "
+                             "checkpoint")
+    parser.add_argument('--screen', action='store_true',
+                        help="Decide each job's second pass from a min/max pyramid of its DEM "
+                             "where it can")
+    parser.add_argument('--scenarios', type=parse_scenarios,
+                        help="Also classify each job's Test_Points under these comma separated "
+                             "tolerance:radius_feet:risk_class scenarios")
+    parser.add_argument('--summary-by-line', action='store_true',
+                        help="Also group each job's compliance summary by flood line")
+    parser.add_argument('--stage-workers', type=int, default=1,
+                        help="Number of independent stages of a job run at the same time on "
+                             "threads, more than 1 needs the ogr backend since arcpy isn't "
+                             "thread safe")
+    args = parser.parse_args()
+
+    FbsAudit.printer("Starting....\n")
+    if args.stage_workers > 1 and args.backend == 'arcpy':
+        FbsAudit.printer("--stage-workers above 1 needs the ogr backend, arcpy isn't thread safe"
+                         "\nExiting...", True)
+    batch_jobs = read_manifest(args.manifest)
+    batch_options = {'block_cache_mb': args.block_cache_mb,
+                     'export_format': args.export_format, 'incremental': args.incremental,
+                     'keep_sfha': args.keep_sfha,
+                     'memory_budget_mb': args.memory_budget_mb,
+                     'profile_stages': args.profile_stages, 'raster_cache': args.raster_cache,
+                     'resume': args.resume,
+                     'sample_cache': args.sample_cache,
+                     'sample_cache_size': args.sample_cache_size, 'scenarios': args.scenarios,
+                     'scratch_folder': args.scratch_folder, 'screen': args.screen,
+                     'stage_workers': args.stage_workers,
+                     'summary_by_line': args.summary_by_line}
+    job_summaries = run_batch(batch_jobs, args.backend, args.processes, batch_options)
+
+    # Write and print the roll-up
+    summary_file = args.summary or os.path.join(os.path.dirname(os.path.abspath(args.manifest)),
+                                                'FBS_Audit_batch.json')
+    batch_totals = roll_up(job_summaries)
+    with open(summary_file, 'w') as json_file:
+        json.dump({'totals': batch_totals, 'jobs': job_summaries}, json_file, indent=2)
+
+    FbsAudit.printer("{:>4} {:<40} {:>9} {:>9} {:>7} {:>7} {:>7} {:>7}".format(
+        'job', 'workspace', 'result', 'points', 'P', 'F', 'NA', 'U'))
+    for job_summary in job_summaries:
+        FbsAudit.printer("{job:>4} {workspace:<40.40} {result:>9} {points:>9} {P:>7} {F:>7} "
+                         "{NA:>7} {U:>7}".format(**job_summary))
+    FbsAudit.printer("{} of {} jobs done, {} points, pass rate {}".format(
+        batch_totals['done'], batch_totals['jobs'], batch_totals['points'],
+        batch_totals['pass_rate']))
+
+    FbsAudit.printer("\nAll Done")
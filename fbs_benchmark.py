@@ -0,0 +1,314 @@
+""" Synthetic FIRM data and stage benchmarks for the Flood Boundary Standard audit"""
+
+# fbs_benchmark: Generates synthetic flood studies and times the audit stages on them
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+import numpy
+
+try:
+    from osgeo import gdal, ogr, osr
+    gdal.UseExceptions()
+    ogr.UseExceptions()
+except ImportError:
+    # Only needed to write the studies, generate_study runs without GDAL
+    gdal = ogr = osr = None
+
+from fbs_audit import TEST_POINT_SPACING_FEET, FbsAudit
+from fbs_backend import OgrBackend
+from fbs_profile import StageProfiler
+from fbs_raster import Extent
+
+# Layout of one synthetic river, all in feet.  Each river sits in its own REACH_LENGTH by
+# REACH_WIDTH tile and produces about 1000 Test Points along its two banks
+REACH_LENGTH = 50000.0
+REACH_WIDTH = 1200.0
+MEANDER_AMPLITUDE = 150.0
+MEANDER_WAVELENGTH = 5000.0
+FLOODPLAIN_WIDTH = 250.0
+XS_SPACING = 1000.0
+CELL_SIZE = 10.0
+
+# Valley slope along the river, side slope across the floodplain and the NoData value
+VALLEY_SLOPE = 0.002
+SIDE_SLOPE = 0.02
+NO_DATA = -3.4028234663852886e+38
+
+# The studies are in NAD83 / North Carolina (ftUS) and their rasters are written in blocks of
+# WRITE_ROWS rows
+STUDY_EPSG = 2264
+WRITE_ROWS = 256
+
+# Feature classes of a study with their OGR geometry type and fields
+STUDY_LAYERS = [('S_Fld_Haz_Ln', 'wkbLineString', [('LN_TYP', 'OFTString')]),
+                ('S_Fld_Haz_Ar', 'wkbPolygon', [('FLD_ZONE', 'OFTString')]),
+                ('S_XS', 'wkbLineString', [('WTR_NM', 'OFTString'), ('STREAM_STN', 'OFTReal')]),
+                ('S_Profil_Basln', 'wkbLineString', [('WTR_NM', 'OFTString')])]
+
+# Every DEM_VOID_SPACING along each river the DEM has a DEM_VOID_LENGTH void and every
+# WSEL_GAP_SPACING the WSEL grid has a WSEL_GAP_LENGTH gap.  Points in one of them are Unknown,
+# points where they overlap are NA
+DEM_VOID_SPACING = 9000.0
+DEM_VOID_LENGTH = 100.0
+WSEL_GAP_SPACING = 12000.0
+WSEL_GAP_LENGTH = 150.0
+
+
+def centerline(u_coords):
+    """Offset of the river centerline from the bottom of its tile at distance u along the tile"""
+    return REACH_WIDTH / 2 + MEANDER_AMPLITUDE * numpy.sin(2 * numpy.pi * u_coords /
+                                                           MEANDER_WAVELENGTH)
+
+
+def half_width(u_coords):
+    """Half width of the floodplain at distance u along the tile"""
+    return FLOODPLAIN_WIDTH + 50.0 * numpy.sin(2 * numpy.pi * u_coords / 7000.0)
+
+
+def wsel_error(u_coords):
+    """Mapping error of the synthetic WSEL
+
+    About a third of the points fail on their GrELEV and about 4% still fail on the DEM
+    MinElev/MaxElev around them, close to what submitted studies show.
+    """
+    return 1.8 * numpy.sin(2 * numpy.pi * u_coords / 3100.0) * \
+        numpy.sin(2 * numpy.pi * u_coords / 1700.0)
+
+
+class SyntheticRaster:
+    """Procedural DEM or WSEL grid over the river tiles, generated one window at a time
+
+    The grid is written to disk a block of rows at a time, so studies with millions of points
+    don't need the whole grid in memory.
+    """
+
+    def __init__(self, kind, tile_cols, tile_rows, seed=0):
+        """Receives 'DEM' or 'WSEL' and the number of river tiles across and down"""
+        self.height = int(numpy.ceil(tile_rows * REACH_WIDTH / CELL_SIZE))  # Number of rows
+        self.kind = kind  # 'DEM' or 'WSEL'
+        self.meanCellHeight = CELL_SIZE  # Cell height
+        self.meanCellWidth = CELL_SIZE  # Cell width
+        self.noDataValue = NO_DATA  # The NoData value
+        self.tile_cols = tile_cols  # Number of river tiles across
+        self.width = int(numpy.ceil(tile_cols * REACH_LENGTH / CELL_SIZE))  # Number of columns
+        self.extent = Extent(0.0, 0.0, self.width * CELL_SIZE,
+                             self.height * CELL_SIZE)  # The raster extent
+
+        # Ground roughness, tiled across the grid
+        self.roughness = numpy.random.default_rng(seed).uniform(-0.75, 0.75, (257, 263))
+
+    def read_window(self, row_start, col_start, n_rows, n_cols):
+        """Generates a window as a float64 array with NoData as NaN"""
+        rows = numpy.arange(row_start, row_start + n_rows)
+        cols = numpy.arange(col_start, col_start + n_cols)
+
+        # Cell centers in tile coordinates
+        x_coords = (cols + 0.5) * CELL_SIZE
+        y_coords = self.extent.YMax - (rows + 0.5) * CELL_SIZE
+        tile_col = (x_coords // REACH_LENGTH).astype(numpy.int64)
+        tile_row = (y_coords // REACH_WIDTH).astype(numpy.int64)
+        u_coords = x_coords - tile_col * REACH_LENGTH
+        v_coords = y_coords - tile_row * REACH_WIDTH
+
+        # Every river has its own base elevation
+        base = 100.0 + 7.0 * ((tile_row[:, None] * self.tile_cols + tile_col[None, :]) % 500)
+        offset = numpy.abs(v_coords[:, None] - centerline(u_coords)[None, :])
+        width = half_width(u_coords)[None, :]
+
+        if self.kind == 'DEM':
+            cells = base + VALLEY_SLOPE * u_coords[None, :] + SIDE_SLOPE * offset + \
+                self.roughness[rows[:, None] % 257, cols[None, :] % 263]
+            void = u_coords % DEM_VOID_SPACING < DEM_VOID_LENGTH
+            cells[:, void] = numpy.nan
+        else:
+            cells = base + VALLEY_SLOPE * u_coords[None, :] + SIDE_SLOPE * width + \
+                wsel_error(u_coords)[None, :]
+            gap = u_coords % WSEL_GAP_SPACING < WSEL_GAP_LENGTH
+            cells = numpy.where((offset <= width + 3 * CELL_SIZE) & ~gap[None, :], cells, numpy.nan)
+
+        return cells
+
+
+def generate_study(n_points, seed=0):
+    """Generates a synthetic flood study with about n_points Test Points
+
+    Returns a dictionary with the DEM and WSEL rasters and the S_Fld_Haz_Ln, S_Fld_Haz_Ar, S_XS
+    and S_Profil_Basln features as lists of dictionaries with NumPy vertex arrays.
+    """
+    n_rivers = max(1, int(numpy.ceil(n_points * TEST_POINT_SPACING_FEET / (2 * REACH_LENGTH))))
+    tile_cols = max(1, int(numpy.ceil(numpy.sqrt(n_rivers * REACH_WIDTH / REACH_LENGTH))))
+    tile_rows = int(numpy.ceil(n_rivers / float(tile_cols)))
+    study = {'DEM': SyntheticRaster('DEM', tile_cols, tile_rows, seed),
+             'WSEL': SyntheticRaster('WSEL', tile_cols, tile_rows, seed),
+             'S_Fld_Haz_Ln': [], 'S_Fld_Haz_Ar': [], 'S_XS': [], 'S_Profil_Basln': []}
+    y_max = study['DEM'].extent.YMax
+
+    u_coords = numpy.arange(0, REACH_LENGTH + 1, 50.0)
+    xs_u_coords = numpy.arange(XS_SPACING / 2, REACH_LENGTH, XS_SPACING)
+    for river in range(n_rivers):
+        water_name = 'Stream {}'.format(river + 1)
+        tile_row, tile_col = divmod(river, tile_cols)
+        x_origin = tile_col * REACH_LENGTH
+        y_origin = y_max - (tile_rows - tile_row) * REACH_WIDTH
+        center = y_origin + centerline(u_coords)
+        width = half_width(u_coords)
+
+        # The two banks are the SFHA boundaries of the floodplain polygon
+        left_bank = numpy.column_stack([x_origin + u_coords, center + width])
+        right_bank = numpy.column_stack([x_origin + u_coords, center - width])
+        study['S_Fld_Haz_Ln'].append({'LN_TYP': '2034', 'vertices': left_bank})
+        study['S_Fld_Haz_Ln'].append({'LN_TYP': '2034', 'vertices': right_bank})
+        study['S_Fld_Haz_Ar'].append({'FLD_ZONE': 'AE' if river % 2 == 0 else 'A',
+                                      'vertices': numpy.vstack([left_bank, right_bank[::-1]])})
+        study['S_Profil_Basln'].append({'WTR_NM': water_name,
+                                        'vertices': numpy.column_stack([x_origin + u_coords,
+                                                                        center])})
+
+        # Cross sections span the floodplain plus 200 ft on each side
+        xs_center = y_origin + centerline(xs_u_coords)
+        xs_width = half_width(xs_u_coords) + 200.0
+        for station, u_coord, y_center, y_width in zip(range(len(xs_u_coords)), xs_u_coords,
+                                                       xs_center, xs_width):
+            study['S_XS'].append({'WTR_NM': water_name, 'STREAM_STN': float(station),
+                                  'vertices': numpy.array([[x_origin + u_coord, y_center - y_width],
+                                                           [x_origin + u_coord,
+                                                            y_center + y_width]])})
+
+    return study
+
+
+def run_benchmark(n_points, folder, seed=0, fast_names=False, processes=1):
+    """Writes a study with about n_points Test Points to folder and times the audit on it
+
+    The audit runs every stage of FbsAudit.run_audit through the GDAL/OGR backend and the
+    StageProfiler records them.  Returns a list of result dictionaries, one per stage.  Writing
+    the study is reported but is not part of any stage.
+    """
+    start = time.perf_counter()
+    study = generate_study(n_points, seed)
+    dem, wsel, workspace = write_study(study, folder)
+    write_seconds = time.perf_counter() - start
+
+    outfolder = os.path.join(folder, 'audit')
+    os.makedirs(outfolder)
+    backend = OgrBackend()
+    audit = FbsAudit(dem, wsel, workspace, outfolder, backend)
+    profiler = StageProfiler(outfolder, backend=backend)
+    audit.run_audit(profiler, fast_names, processes)
+    profiler.write_report()
+
+    counts = audit.status_counts()
+    points = sum(counts.values())
+    print("{} points, study written in {:.1f} s: {}".format(points, write_seconds, counts))
+    return [{'points': points, 'stage': stage['stage'], 'seconds': stage['wall_seconds'],
+             'cpu_seconds': stage['cpu_seconds'], 'peak_rss_mb': stage['peak_rss_mb'],
+             'points_per_second': round(points / max(stage['wall_seconds'], 0.001))}
+            for stage in profiler.stages]
+
+
+def write_raster(raster, out_raster, spatial_reference):
+    """Writes a SyntheticRaster to a tiled GeoTIFF, WRITE_ROWS rows at a time"""
+    dataset = gdal.GetDriverByName('GTiff').Create(
+        out_raster, raster.width, raster.height, 1, gdal.GDT_Float32,
+        ['TILED=YES', 'COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER'])
+    dataset.SetGeoTransform((raster.extent.XMin, CELL_SIZE, 0.0, raster.extent.YMax, 0.0,
+                             -CELL_SIZE))
+    dataset.SetProjection(spatial_reference.ExportToWkt())
+    band = dataset.GetRasterBand(1)
+    band.SetNoDataValue(NO_DATA)
+
+    for row_start in range(0, raster.height, WRITE_ROWS):
+        cells = raster.read_window(row_start, 0, min(WRITE_ROWS, raster.height - row_start),
+                                   raster.width)
+        band.WriteArray(numpy.where(numpy.isnan(cells), NO_DATA, cells).astype(numpy.float32),
+                        0, row_start)
+    dataset.FlushCache()
+
+
+def write_study(study, folder):
+    """Writes a study to folder as DEM.tif, WSEL.tif and a study.gdb of its feature classes
+
+    Returns the (DEM, WSEL, workspace) paths to audit.
+    """
+    spatial_reference = osr.SpatialReference()
+    spatial_reference.ImportFromEPSG(STUDY_EPSG)
+    for kind in ['DEM', 'WSEL']:
+        write_raster(study[kind], os.path.join(folder, kind + '.tif'), spatial_reference)
+
+    workspace = os.path.join(folder, 'study.gdb')
+    out_source = gdal.GetDriverByName('OpenFileGDB').Create(workspace, 0, 0, 0, gdal.GDT_Unknown)
+    for layer_name, geometry_type, fields in STUDY_LAYERS:
+        out_layer = out_source.CreateLayer(layer_name, spatial_reference,
+                                           getattr(ogr, geometry_type))
+        for field_name, field_type in fields:
+            out_layer.CreateField(ogr.FieldDefn(field_name, getattr(ogr, field_type)))
+        layer_definition = out_layer.GetLayerDefn()
+
+        out_layer.StartTransaction()
+        for feature in study[layer_name]:
+            out_feature = ogr.Feature(layer_definition)
+            for field_name, field_type in fields:
+                out_feature.SetField(field_name, feature[field_name])
+
+            # Polygon rings are closed, the study keeps them open
+            vertices = feature['vertices']
+            if geometry_type == 'wkbPolygon':
+                vertices = numpy.vstack([vertices, vertices[:1]])
+                path = ogr.Geometry(ogr.wkbLinearRing)
+            else:
+                path = ogr.Geometry(ogr.wkbLineString)
+            for x_coord, y_coord in vertices.tolist():
+                path.AddPoint_2D(x_coord, y_coord)
+            if geometry_type == 'wkbPolygon':
+                polygon = ogr.Geometry(ogr.wkbPolygon)
+                polygon.AddGeometry(path)
+                path = polygon
+            out_feature.SetGeometry(path)
+            out_layer.CreateFeature(out_feature)
+        out_layer.CommitTransaction()
+
+    # Close the geodatabase so the audit can open it
+    out_source = None
+
+    return (os.path.join(folder, 'DEM.tif'), os.path.join(folder, 'WSEL.tif'), workspace)
+
+
+if __name__ == "__main__":
+    # Get user input
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help="Approximate numbers of Test Points to benchmark")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic terrain")
+    parser.add_argument('--fast-names', action='store_true',
+                        help="Assign water names from the nearest Profile Baselines")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="Number of processes to audit the Test_Points tiles with")
+    parser.add_argument('--folder',
+                        help="Folder the studies and audits are kept in, a temporary folder "
+                             "that is removed afterwards by default")
+    parser.add_argument('--output', help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    folder = args.folder or tempfile.mkdtemp()
+    all_results = []
+    try:
+        for points in args.points:
+            study_folder = os.path.join(folder, 'study_{}'.format(points))
+            os.makedirs(study_folder)
+            all_results.extend(run_benchmark(points, study_folder, args.seed, args.fast_names,
+                                             args.processes))
+    finally:
+        if not args.folder:
+            shutil.rmtree(folder)
+
+    print("{:>10} {:<26} {:>10} {:>14}".format('points', 'stage', 'seconds', 'points/sec'))
+    for result in all_results:
+        print("{points:>10} {stage:<26} {seconds:>10.3f} {points_per_second:>14}".format(**result))
+
+    if args.output:
+        with open(args.output, 'w') as json_file:
+            json.dump(all_results, json_file, indent=2)
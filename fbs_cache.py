@@ -0,0 +1,111 @@
+""" Persistent raster sample cache for the Flood Boundary Standard audit"""
+
+# fbs_cache: Stores raster values sampled at the Test_Points between runs
+
+import sqlite3
+import threading
+import numpy
+
+# Coordinates are snapped to this many raster units before they are used as a key
+SNAP_SIZE = 0.001
+
+
+class SampleCache:
+    """On-disk cache of raster samples keyed by raster fingerprint, snapped coordinate and method
+
+    Entries are evicted least recently used first once the cache holds more than max_entries.
+    The connection can be used from any thread, one call at a time, so stages running on the
+    stage graph's threads share the cache opened by the caller.
+    """
+
+    def __init__(self, path, max_entries=10000000):
+        """Opens or creates the SQLite cache file at path"""
+        # Batch workers can share one cache file, so wait for their writes instead of failing
+        self.connection = sqlite3.connect(path, timeout=60,
+                                          check_same_thread=False)  # The SQLite cache database
+        self.hits = 0  # Number of values found in the cache
+        self.lock = threading.Lock()  # Lets one thread at a time use the connection
+        self.max_entries = max_entries  # Number of entries kept before evicting
+        self.misses = 0  # Number of values not found in the cache
+
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS samples (raster TEXT, method TEXT, x INTEGER, y INTEGER, "
+            "value REAL, used INTEGER, PRIMARY KEY (raster, method, x, y))")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS samples_used ON samples (used)")
+        self.connection.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS lookup (id INTEGER PRIMARY KEY, x INTEGER, y INTEGER)")
+
+        # The use counter continues from the most recent entry
+        self.tick = self.connection.execute(
+            "SELECT COALESCE(MAX(used), 0) FROM samples").fetchone()[0]
+
+    def close(self):
+        """Commits and closes the cache"""
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+    def lookup(self, raster, method, x_coords, y_coords):
+        """Returns the cached values and a boolean array of which points were found
+
+        Values that were stored as NaN come back as NaN with their found flag set.
+        """
+        x_keys, y_keys = self.snap(x_coords, y_coords)
+        values = numpy.full(x_keys.shape, numpy.nan)
+        found = numpy.zeros(x_keys.shape, dtype=bool)
+
+        with self.lock:
+            self.tick += 1
+
+            # Join the points against the cache in one query.  CROSS JOIN keeps the points as the
+            # outer loop, so every point is one search of the primary key
+            self.connection.execute("DELETE FROM lookup")
+            self.connection.executemany("INSERT INTO lookup VALUES (?, ?, ?)",
+                                        zip(range(len(x_keys)), x_keys.tolist(), y_keys.tolist()))
+            rows = self.connection.execute(
+                "SELECT lookup.id, samples.value, samples.rowid FROM lookup CROSS JOIN samples ON "
+                "samples.raster = ? AND samples.method = ? AND samples.x = lookup.x AND "
+                "samples.y = lookup.y", (raster, method)).fetchall()
+            for row_id, value, _ in rows:
+                found[row_id] = True
+                values[row_id] = numpy.nan if value is None else value
+
+            # Mark the found entries as recently used by their rowid, then commit so other
+            # processes sharing the cache file aren't kept waiting on this write
+            self.connection.executemany("UPDATE samples SET used = ? WHERE rowid = ?",
+                                        [(self.tick, rowid) for _, _, rowid in rows])
+            self.connection.commit()
+            self.hits += int(found.sum())
+            self.misses += int((~found).sum())
+
+        return values, found
+
+    @staticmethod
+    def snap(x_coords, y_coords):
+        """Returns the integer cache keys of the coordinates"""
+        x_keys = numpy.round(numpy.asarray(x_coords, dtype=numpy.float64) / SNAP_SIZE)
+        y_keys = numpy.round(numpy.asarray(y_coords, dtype=numpy.float64) / SNAP_SIZE)
+        return x_keys.astype(numpy.int64), y_keys.astype(numpy.int64)
+
+    def store(self, raster, method, x_coords, y_coords, values):
+        """Stores the values sampled at the points, evicting the least recently used entries"""
+        x_keys, y_keys = self.snap(x_coords, y_coords)
+        values = numpy.asarray(values, dtype=numpy.float64)
+
+        with self.lock:
+            self.tick += 1
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?, ?, ?)",
+                zip([raster] * len(x_keys), [method] * len(x_keys), x_keys.tolist(),
+                    y_keys.tolist(),
+                    numpy.where(numpy.isnan(values), None, values.astype(object)).tolist(),
+                    [self.tick] * len(x_keys)))
+
+            # Evict the least recently used entries over the size limit
+            count = self.connection.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+            if count > self.max_entries:
+                self.connection.execute(
+                    "DELETE FROM samples WHERE rowid IN "
+                    "(SELECT rowid FROM samples ORDER BY used LIMIT ?)",
+                    (count - self.max_entries,))
+            self.connection.commit()
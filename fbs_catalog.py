@@ -0,0 +1,88 @@
+""" Workspace catalog for the Flood Boundary Standard audit"""
+
+# fbs_catalog: Finds the audit inputs, caches what is asked about them and defers the arcpy import
+
+import importlib
+import importlib.util
+import sys
+
+
+class Catalog:
+    """Finds the input feature classes of a workspace and caches the backend's answers about them
+
+    The spatial reference, linear unit and row count of an input are asked for by several
+    checks and stages.  Each one is read from the backend once.  Only inputs that don't change
+    during the audit should be asked about.
+    """
+
+    def __init__(self, backend):
+        """Receives the backend that lists and describes the datasets"""
+        self.backend = backend  # Geoprocessing backend of the audit
+        self.results = {}  # (backend method name, dataset) to the method's result
+
+    def cached(self, method_name, dataset):
+        """Returns the result of a backend method for a dataset, calling it only the first time"""
+        key = (method_name, dataset)
+        if key not in self.results:
+            self.results[key] = getattr(self.backend, method_name)(dataset)
+
+        return self.results[key]
+
+    def count(self, dataset):
+        """Returns the number of rows in dataset"""
+        return self.cached('count', dataset)
+
+    def describe_raster(self, in_raster):
+        """Returns a copy of the path, extent, width, height and cell sizes of a raster"""
+        return list(self.cached('describe_raster', in_raster))
+
+    def factory_code(self, dataset):
+        """Returns the spatial reference factory code of dataset as a string"""
+        return self.cached('factory_code', dataset)
+
+    def find(self, workspace, names):
+        """Returns a dictionary of name to path of the feature classes in names
+
+        The workspace is listed only until every name is found, so the feature datasets after
+        the last one needed are never opened.
+        """
+        found = {}
+        for name, path in self.backend.feature_classes(workspace):
+            if name in names and name not in found:
+                found[name] = path
+                if len(found) == len(names):
+                    break
+
+        return found
+
+    def meters_per_unit(self, dataset):
+        """Returns the meters per linear unit of dataset's spatial reference"""
+        return self.cached('meters_per_unit', dataset)
+
+
+class LazyModule:
+    """A module that is imported the first time one of its attributes is used
+
+    Importing arcpy takes tens of seconds, so the audit only pays for it once a stage calls it.
+    """
+
+    def __init__(self, name):
+        """Receives the name of the module"""
+        self.module = None  # The module once imported
+        self.name = name  # Name of the module
+
+    def __getattr__(self, attribute):
+        """Imports the module on first use and returns its attribute"""
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+
+        return getattr(self.module, attribute)
+
+    def available(self):
+        """Returns True if the module can be imported, without importing it"""
+        return self.module is not None or self.name in sys.modules or \
+            importlib.util.find_spec(self.name) is not None
+
+    def loaded(self):
+        """Returns True if the module is already imported, by the audit or by ArcGIS"""
+        return self.module is not None or self.name in sys.modules
@@ -0,0 +1,180 @@
+""" Columnar export of the Flood Boundary Standard audit Test Points"""
+
+# fbs_export: Streams the Test_Points to GeoParquet, Arrow IPC or GeoPackage for analysis tools
+
+import json
+import os
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    # Without pyarrow the Test_Points are exported to GeoPackage
+    pyarrow = None
+
+try:
+    from osgeo import gdal, ogr, osr
+    gdal.UseExceptions()
+    ogr.UseExceptions()
+    osr.UseExceptions()
+except ImportError:
+    # Only needed for GeoPackage and the PROJJSON of the GeoParquet CRS
+    gdal = ogr = osr = None
+
+from fbs_backend import OgrBackend
+
+# Export formats by file extension
+EXPORT_FORMATS = {'.parquet': 'parquet', '.arrow': 'arrow', '.gpkg': 'gpkg'}
+
+# Test_Points rows per Parquet row group, Arrow record batch or GeoPackage transaction.  Only
+# one of them is held in memory at a time
+ROW_GROUP_SIZE = 65536
+
+# AddField types to Arrow type names
+ARROW_TYPES = {'DOUBLE': 'float64', 'FLOAT': 'float32', 'LONG': 'int32', 'SHORT': 'int16',
+               'TEXT': 'string'}
+
+
+def arrow_schema(fields, domains, crs):
+    """Returns the Arrow schema of the Test_Points with their domains and GeoParquet metadata
+
+    fields is the list of (name, type, options) the Test_Points were created with.  Every field
+    with a coded value domain carries the domain name, and the schema carries the codes and
+    descriptions of every domain.
+    """
+    arrow_fields = []
+    for field_name, field_type, options in fields:
+        metadata = {'domain': options['field_domain']} if 'field_domain' in options else None
+        arrow_fields.append(pyarrow.field(field_name, getattr(pyarrow, ARROW_TYPES[field_type])(),
+                                          metadata=metadata))
+
+    # The WKB points, tagged for GeoArrow readers of the Arrow IPC file
+    arrow_fields.append(pyarrow.field('geometry', pyarrow.binary(), metadata={
+        'ARROW:extension:name': 'geoarrow.wkb',
+        'ARROW:extension:metadata': json.dumps({'crs': crs})}))
+
+    geo = {'version': '1.0.0', 'primary_column': 'geometry',
+           'columns': {'geometry': {'encoding': 'WKB', 'geometry_types': ['Point'], 'crs': crs}}}
+
+    return pyarrow.schema(arrow_fields, metadata={'geo': json.dumps(geo),
+                                                  'fbs_domains': json.dumps(domain_metadata(
+                                                      domains))})
+
+
+def domain_metadata(domains):
+    """Returns a dictionary of domain name to its description, field type and codes
+
+    domains is the list of (name, description, type, codes) passed to create_file_geodatabase.
+    """
+    return {domain_name: {'description': description, 'field_type': field_type,
+                          'codes': codes}
+            for domain_name, description, field_type, codes in domains}
+
+
+def export_test_points(backend, test_points, out_path, fields, domains,
+                       row_group_size=ROW_GROUP_SIZE):
+    """Streams the Test_Points to a GeoParquet, Arrow IPC or GeoPackage file
+
+    The format comes from the extension of out_path.  Without pyarrow the Parquet and Arrow
+    exports fall back to a GeoPackage next to out_path.  Returns the path written.
+    """
+    export_format = EXPORT_FORMATS[os.path.splitext(out_path)[1].lower()]
+    if export_format != 'gpkg' and pyarrow is None:
+        export_format = 'gpkg'
+        out_path = os.path.splitext(out_path)[0] + '.gpkg'
+    if export_format == 'gpkg' and ogr is None:
+        raise ImportError("Exporting the Test_Points needs pyarrow or GDAL")
+
+    if os.path.exists(out_path):
+        os.remove(out_path)
+
+    if export_format == 'gpkg':
+        write_geopackage(backend, test_points, out_path, fields, domains, row_group_size)
+    else:
+        schema = arrow_schema(fields, domains, projjson(backend.factory_code(test_points)))
+        batches = record_batches(backend, test_points, schema, fields, row_group_size)
+        if export_format == 'parquet':
+            with pyarrow.parquet.ParquetWriter(out_path, schema) as parquet_writer:
+                for batch in batches:
+                    parquet_writer.write_batch(batch)
+        else:
+            with pyarrow.OSFile(out_path, 'wb') as sink, \
+                    pyarrow.ipc.new_file(sink, schema) as ipc_writer:
+                for batch in batches:
+                    ipc_writer.write_batch(batch)
+
+    return out_path
+
+
+def projjson(factory_code):
+    """Returns the PROJJSON of an EPSG factory code, None when it is unknown or GDAL is missing"""
+    if osr is None or not factory_code.isdigit() or int(factory_code) == 0:
+        return None
+
+    spatial_reference = osr.SpatialReference()
+    spatial_reference.ImportFromEPSG(int(factory_code))
+    return json.loads(spatial_reference.ExportToPROJJSON())
+
+
+def read_row_groups(backend, test_points, field_names, row_group_size):
+    """Yields lists of up to row_group_size (WKB, values) rows of the Test_Points"""
+    rows = []
+    for oid, parts, wkb, values in backend.read_shapes(test_points, field_names):
+        rows.append((bytes(wkb), values))
+        if len(rows) == row_group_size:
+            yield rows
+            rows = []
+    if rows:
+        yield rows
+
+
+def record_batches(backend, test_points, schema, fields, row_group_size):
+    """Yields the Test_Points as Arrow record batches of up to row_group_size rows"""
+    field_names = [field[0] for field in fields]
+    for rows in read_row_groups(backend, test_points, field_names, row_group_size):
+        columns = [pyarrow.array([row[1][index] for row in rows], type=schema.field(index).type)
+                   for index in range(len(field_names))]
+        columns.append(pyarrow.array([row[0] for row in rows], type=pyarrow.binary()))
+        yield pyarrow.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def write_geopackage(backend, test_points, out_path, fields, domains, row_group_size):
+    """Writes the Test_Points to a GeoPackage with their coded value domains"""
+    out_source = gdal.GetDriverByName('GPKG').Create(out_path, 0, 0, 0, gdal.GDT_Unknown)
+    for domain_name, description, field_type, codes in domains:
+        ogr_type, ogr_subtype = OgrBackend.FIELD_TYPES[field_type]
+        out_source.AddFieldDomain(ogr.CreateCodedFieldDomain(
+            domain_name, description, getattr(ogr, ogr_type), getattr(ogr, ogr_subtype), codes))
+
+    # A point layer in the spatial reference of the Test_Points with the same fields
+    factory_code = backend.factory_code(test_points)
+    spatial_reference = None
+    if factory_code.isdigit() and int(factory_code) > 0:
+        spatial_reference = osr.SpatialReference()
+        spatial_reference.ImportFromEPSG(int(factory_code))
+    out_layer = out_source.CreateLayer('Test_Points', spatial_reference, ogr.wkbPoint)
+    for field_name, field_type, options in fields:
+        ogr_type, ogr_subtype = OgrBackend.FIELD_TYPES[field_type]
+        field_definition = ogr.FieldDefn(field_name, getattr(ogr, ogr_type))
+        field_definition.SetSubType(getattr(ogr, ogr_subtype))
+        if 'field_length' in options:
+            field_definition.SetWidth(options['field_length'])
+        if 'field_domain' in options:
+            field_definition.SetDomainName(options['field_domain'])
+        out_layer.CreateField(field_definition)
+
+    # One transaction per row group
+    field_names = [field[0] for field in fields]
+    layer_definition = out_layer.GetLayerDefn()
+    for rows in read_row_groups(backend, test_points, field_names, row_group_size):
+        with OgrBackend.transaction(out_source):
+            for wkb, values in rows:
+                feature = ogr.Feature(layer_definition)
+                feature.SetGeometry(ogr.CreateGeometryFromWkb(wkb))
+                for field_name, value in zip(field_names, values):
+                    if value is None:
+                        feature.SetFieldNull(field_name)
+                    else:
+                        feature.SetField(field_name, value)
+                out_layer.CreateFeature(feature)
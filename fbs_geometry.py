@@ -0,0 +1,298 @@
+""" Geometry helpers for the Flood Boundary Standard audit"""
+
+# fbs_geometry: Vectorized geometry operations on NumPy coordinate arrays
+
+import numpy
+from scipy.spatial import cKDTree
+
+# Points queried with one distance bound when nearest_distinct searches the KD-tree of an id
+BOUND_CHUNK = 1024
+
+# Key of a segment, its quantized start and end vertices with the smaller vertex first
+SEGMENT_KEY = numpy.dtype([('x_1', numpy.int64), ('y_1', numpy.int64), ('x_2', numpy.int64),
+                           ('y_2', numpy.int64)])
+
+
+class EdgeIndex:
+    """Topology index of polygon boundary segments and the zones of the polygons they bound
+
+    Segments are keyed by their endpoints quantized to the tolerance, in either direction, so a
+    line segment matches a polygon segment with the same vertices.  Every key holds the bitwise
+    OR of the zone masks of the polygons on either side.  The keys are sorted once and looked
+    up with a binary search, so classifying the lines is a single vectorized pass.
+    """
+
+    def __init__(self, polygons, zone_masks, tolerance):
+        """Receives the polygons as lists of (N, 2) rings, a zone bit mask per polygon and the
+        vertex tolerance"""
+        keys = [segment_keys(rings, tolerance) for rings in polygons]
+        masks = numpy.concatenate([numpy.full(len(polygon_keys), zone_mask, dtype=numpy.int64)
+                                   for polygon_keys, zone_mask in zip(keys, zone_masks)] +
+                                  [numpy.zeros(0, dtype=numpy.int64)])
+        keys = numpy.concatenate(keys + [numpy.zeros(0, dtype=SEGMENT_KEY)])
+
+        # Merge the masks of the segments shared by two polygons
+        self.keys, inverse = numpy.unique(keys, return_inverse=True)  # Sorted segment keys
+        self.masks = numpy.zeros(len(self.keys), dtype=numpy.int64)  # Zone mask of every key
+        numpy.bitwise_or.at(self.masks, inverse.ravel(), masks)
+        self.tolerance = tolerance  # Vertex tolerance of the keys
+
+    def line_masks(self, lines):
+        """Returns the OR of the zone masks of the segments of every line
+
+        lines is a list of lines as lists of (N, 2) parts.  Lines with no segment on a polygon
+        boundary get 0.
+        """
+        keys = [segment_keys(parts, self.tolerance) for parts in lines]
+        line_ids = numpy.repeat(numpy.arange(len(lines)), [len(line_keys) for line_keys in keys])
+        keys = numpy.concatenate(keys + [numpy.zeros(0, dtype=SEGMENT_KEY)])
+        result = numpy.zeros(len(lines), dtype=numpy.int64)
+        if len(self.keys) == 0 or len(keys) == 0:
+            return result
+
+        # Look every line segment up in the sorted polygon segments
+        positions = numpy.minimum(numpy.searchsorted(self.keys, keys), len(self.keys) - 1)
+        segment_masks = numpy.where(self.keys[positions] == keys, self.masks[positions], 0)
+        numpy.bitwise_or.at(result, line_ids, segment_masks)
+
+        return result
+
+
+class PointIndex:
+    """Spatial index over a set of x/y points for fast extent queries
+
+    The points are sorted by X once, so each query is a binary search on X followed by a
+    vectorized filter on Y.
+    """
+
+    def __init__(self, x_coords, y_coords):
+        """Receives the x and y coordinate arrays of the points"""
+        self.x_coords = numpy.asarray(x_coords, dtype=numpy.float64)
+        self.y_coords = numpy.asarray(y_coords, dtype=numpy.float64)
+        self.order = numpy.argsort(self.x_coords, kind='stable')  # Point indices sorted by X
+        self.sorted_x = self.x_coords[self.order]  # The sorted X coordinates
+
+    def query(self, x_min, y_min, x_max, y_max):
+        """Returns the indices of the points inside the extent, in ascending order"""
+        start = numpy.searchsorted(self.sorted_x, x_min, side='left')
+        end = numpy.searchsorted(self.sorted_x, x_max, side='right')
+        candidates = self.order[start:end]
+        y_candidates = self.y_coords[candidates]
+
+        return numpy.sort(candidates[(y_candidates >= y_min) & (y_candidates <= y_max)])
+
+
+def convex_hull(points):
+    """Returns the convex hull of an (N, 2) array of points as a clockwise (M, 2) ring
+
+    Points inside the quadrilateral of the extreme points are discarded with vectorized
+    orientation tests before a monotone chain builds the hull from the remaining points.
+    """
+    points = numpy.unique(numpy.asarray(points, dtype=numpy.float64), axis=0)
+    if len(points) < 3:
+        return points
+
+    # Drop the points strictly inside the quadrilateral of the extreme points
+    extremes = points[[numpy.argmin(points[:, 0]), numpy.argmin(points[:, 1]),
+                       numpy.argmax(points[:, 0]), numpy.argmax(points[:, 1])]]
+    inside = numpy.ones(len(points), dtype=bool)
+    for start, end in zip(extremes, numpy.roll(extremes, -1, axis=0)):
+        inside &= orientation(start, end, points) > 0
+    points = points[~inside]
+
+    # Andrew's monotone chain on the lexicographically sorted points
+    def half_hull(sorted_points):
+        """Returns one half of the counter-clockwise hull"""
+        hull = []
+        for point in sorted_points:
+            while len(hull) >= 2 and orientation(hull[-2], hull[-1], point) <= 0:
+                hull.pop()
+            hull.append(point)
+        return hull[:-1]
+
+    hull = half_hull(points) + half_hull(points[::-1])
+
+    return numpy.array(hull[::-1])
+
+
+def densify(vertices, spacing):
+    """Adds vertices along an (N, 2) line so that no segment is longer than spacing"""
+    vertices = numpy.asarray(vertices, dtype=numpy.float64)
+    segments = numpy.diff(vertices, axis=0)
+    lengths = numpy.hypot(segments[:, 0], segments[:, 1])
+
+    # Split every segment into equal pieces, keeping the original vertices
+    pieces = numpy.maximum(numpy.ceil(lengths / spacing), 1).astype(numpy.int64)
+    segment_index = numpy.repeat(numpy.arange(len(segments)), pieces)
+    piece_index = numpy.arange(pieces.sum()) - numpy.repeat(numpy.cumsum(pieces) - pieces, pieces)
+    fractions = piece_index / pieces[segment_index]
+    densified = vertices[segment_index] + segments[segment_index] * fractions[:, None]
+
+    return numpy.vstack([densified, vertices[-1:]])
+
+
+def nearest_distinct(vertices, vertex_ids, points, k=8):
+    """Finds the nearest and second nearest distinct vertex_ids for each point with KD-trees
+
+    vertices is an (N, 2) array with one id per vertex and points is an (M, 2) array.  The
+    nearest id comes from one KD-tree of every vertex.  Any vertex of another id bounds the
+    distance to the second id, so the k nearest vertices of ever coarser copies of the vertices
+    give every point a bound, however many vertices of the nearest id crowd around it.  A
+    KD-tree per id is then searched only within the bound so far, which makes the second id
+    exact.  With a single id the second ids are -1.  Returns two (M,) id arrays.
+    """
+    vertices = numpy.asarray(vertices, dtype=numpy.float64)
+    vertex_ids = numpy.asarray(vertex_ids)
+    points = numpy.asarray(points, dtype=numpy.float64)
+    first_ids = numpy.full(len(points), -1, dtype=numpy.int64)
+    second_ids = numpy.full(len(points), -1, dtype=numpy.int64)
+    second_distances = numpy.full(len(points), numpy.inf)
+    if len(vertices) == 0 or len(points) == 0:
+        return first_ids, second_ids
+
+    # The rank of every vertex among the vertices of its id, for the coarser copies
+    order = numpy.argsort(vertex_ids, kind='stable')
+    ids, starts, counts = numpy.unique(vertex_ids[order], return_index=True, return_counts=True)
+    ranks = numpy.empty(len(vertices), dtype=numpy.int64)
+    ranks[order] = numpy.arange(len(vertices)) - numpy.repeat(starts, counts)
+
+    # The nearest id
+    first_ids[:] = vertex_ids[cKDTree(vertices, balanced_tree=False).query(points)[1]]
+    if len(ids) == 1:
+        return first_ids, second_ids
+
+    # Bound the second id with the nearest other id among the k nearest vertices of every k-th,
+    # k*k-th... vertex of each id, the coarser copies only for the points without one yet
+    remaining = numpy.arange(len(points))
+    step = k
+    while remaining.size:
+        coarse = numpy.nonzero(ranks % step == 0)[0]
+        query_k = min(k, len(coarse))
+        distances, neighbours = cKDTree(vertices[coarse], balanced_tree=False).query(
+            points[remaining], k=query_k)
+        distances = distances.reshape(len(remaining), query_k)
+        neighbour_ids = vertex_ids[coarse[neighbours.reshape(len(remaining), query_k)]]
+
+        different = neighbour_ids != first_ids[remaining, None]
+        found = different.any(axis=1)
+        other = different.argmax(axis=1)[found]
+        second_ids[remaining[found]] = neighbour_ids[found, other]
+        second_distances[remaining[found]] = distances[found, other]
+        remaining = remaining[~found]
+        step *= k
+
+    # Every id's own vertices can only tighten the bound of the points it isn't nearest to
+    for vertex_id, id_vertices in zip(ids, numpy.split(vertices[order], starts[1:])):
+        tree = cKDTree(id_vertices, balanced_tree=False)
+
+        # Only the points whose bound reaches the id's extent can get closer, and the query takes
+        # one bound, so they go in chunks of similar bounds
+        x_min, y_min = id_vertices.min(axis=0)
+        x_max, y_max = id_vertices.max(axis=0)
+        extent_distances = numpy.hypot(
+            numpy.maximum(numpy.maximum(x_min - points[:, 0], points[:, 0] - x_max), 0),
+            numpy.maximum(numpy.maximum(y_min - points[:, 1], points[:, 1] - y_max), 0))
+        candidates = numpy.nonzero((first_ids != vertex_id) &
+                                   (extent_distances < second_distances))[0]
+        candidates = candidates[numpy.argsort(second_distances[candidates], kind='stable')]
+        for chunk in numpy.split(candidates, numpy.arange(BOUND_CHUNK, len(candidates),
+                                                          BOUND_CHUNK)):
+            if len(chunk) == 0:
+                continue
+            id_distances = tree.query(points[chunk],
+                                      distance_upper_bound=second_distances[chunk[-1]])[0]
+            closer = id_distances < second_distances[chunk]
+            second_distances[chunk[closer]] = id_distances[closer]
+            second_ids[chunk[closer]] = vertex_id
+
+    return first_ids, second_ids
+
+
+def orientation(start, end, points):
+    """Cross product of start->end with start->points, positive when points are to the left"""
+    points = numpy.asarray(points)
+    return ((end[0] - start[0]) * (points[..., 1] - start[1]) -
+            (end[1] - start[1]) * (points[..., 0] - start[0]))
+
+
+def points_along_line(parts, spacing):
+    """Interpolates points every spacing along a line made of a list of (N, 2) part arrays
+
+    Stations start at 0 at the beginning of the first part and run continuously across the
+    parts, without counting the gaps between them.  Returns the (M, 2) coordinates and the
+    (M,) stations.
+    """
+    # Segments of every part, skipping the jumps between parts
+    starts = numpy.concatenate([part[:-1] for part in parts if len(part) > 1] or
+                               [numpy.empty((0, 2))])
+    ends = numpy.concatenate([part[1:] for part in parts if len(part) > 1] or
+                             [numpy.empty((0, 2))])
+    lengths = numpy.hypot(ends[:, 0] - starts[:, 0], ends[:, 1] - starts[:, 1])
+    if lengths.sum() == 0:
+        return numpy.empty((0, 2)), numpy.empty(0)
+
+    # Find the segment each station falls on and how far along it the station is
+    segment_ends = numpy.cumsum(lengths)
+    stations = numpy.arange(0, segment_ends[-1] + spacing * 1e-9, spacing)
+    segments = numpy.minimum(numpy.searchsorted(segment_ends, stations, side='right'),
+                             len(lengths) - 1)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        fractions = (stations - (segment_ends[segments] - lengths[segments])) / lengths[segments]
+    fractions = numpy.clip(numpy.nan_to_num(fractions), 0, 1)
+    coords = starts[segments] + (ends[segments] - starts[segments]) * fractions[:, None]
+
+    return coords, stations
+
+
+def points_in_polygon(x_coords, y_coords, rings):
+    """Even-odd point in polygon test of the x/y points against a list of (N, 2) ring arrays
+
+    Interior rings toggle the points back outside, so holes are handled without knowing which
+    rings are exterior.  Returns a boolean array.
+    """
+    x_coords = numpy.asarray(x_coords, dtype=numpy.float64)
+    y_coords = numpy.asarray(y_coords, dtype=numpy.float64)
+    inside = numpy.zeros(x_coords.shape, dtype=bool)
+
+    for ring in rings:
+        x_start = ring[:, 0]
+        y_start = ring[:, 1]
+        x_end = numpy.roll(x_start, -1)
+        y_end = numpy.roll(y_start, -1)
+
+        # Cast a ray to the right of each point and count the edges it crosses
+        for x_1, y_1, x_2, y_2 in zip(x_start, y_start, x_end, y_end):
+            if y_1 == y_2:
+                continue
+            straddles = (y_1 > y_coords) != (y_2 > y_coords)
+            x_cross = x_1 + (y_coords - y_1) * (x_2 - x_1) / (y_2 - y_1)
+            inside ^= straddles & (x_coords < x_cross)
+
+    return inside
+
+
+def segment_keys(parts, tolerance):
+    """Returns the SEGMENT_KEY of every segment of a list of (N, 2) parts
+
+    Vertices are quantized to the tolerance and each segment's vertices are ordered so the key
+    is the same in either direction.  Segments that collapse to a point are dropped.
+    """
+    keys = [numpy.zeros(0, dtype=SEGMENT_KEY)]
+    for part in parts:
+        vertices = numpy.round(numpy.asarray(part, dtype=numpy.float64) / tolerance)
+        vertices = vertices.astype(numpy.int64)
+        start = vertices[:-1]
+        end = vertices[1:]
+
+        # Put the smaller vertex first
+        swap = (start[:, 0] > end[:, 0]) | ((start[:, 0] == end[:, 0]) & (start[:, 1] > end[:, 1]))
+        first = numpy.where(swap[:, None], end, start)
+        second = numpy.where(swap[:, None], start, end)
+        keep = (first != second).any(axis=1)
+
+        part_keys = numpy.zeros(int(keep.sum()), dtype=SEGMENT_KEY)
+        part_keys['x_1'], part_keys['y_1'] = first[keep, 0], first[keep, 1]
+        part_keys['x_2'], part_keys['y_2'] = second[keep, 0], second[keep, 1]
+        keys.append(part_keys)
+
+    return numpy.concatenate(keys)
@@ -0,0 +1,112 @@
+""" Per-stage profiling for the Flood Boundary Standard audit"""
+
+# fbs_profile: Records the time, memory, rows and datasets of each audit stage
+
+import contextlib
+import cProfile
+import json
+import os
+import sys
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from fbs_backend import ArcpyBackend
+
+
+def peak_rss_mb():
+    """Returns the peak resident memory of the process in MB, or None if it can't be read"""
+    if resource is not None:
+        # ru_maxrss is in bytes on macOS and in KB on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1048576.0 if sys.platform == 'darwin' else peak / 1024.0
+    if psutil is not None:
+        # Windows has no resource module, psutil reports its peak working set there
+        peak_wset = getattr(psutil.Process().memory_info(), 'peak_wset', None)
+        return peak_wset / 1048576.0 if peak_wset is not None else None
+    return None
+
+
+class StageProfiler:
+    """Records wall time, CPU time, peak RSS, Test_Points rows and datasets for each stage
+
+    The report is written as JSON next to FBS_Audit.gdb.  With profile_stages set a cProfile dump
+    is also written for each stage.
+    """
+
+    def __init__(self, outfolder, profile_stages=False, backend=None):
+        """Receives the output folder of the audit and the backend that counts and lists datasets"""
+        self.backend = backend or ArcpyBackend()  # Geoprocessing backend of the audit
+        self.gdb = outfolder + '\\FBS_Audit.gdb'  # The audit file geodatabase
+        self.outfolder = outfolder  # The output folder for the report
+        self.profile_stages = profile_stages  # Write a cProfile dump per stage
+        self.stages = []  # The recorded stages
+
+    def datasets(self):
+        """Returns the set of feature classes and tables in FBS_Audit.gdb and in memory"""
+        names = set()
+        for workspace in [self.gdb, self.backend.memory_workspace()]:
+            for name in self.backend.list_datasets(workspace):
+                names.add(workspace + '\\' + name)
+
+        return names
+
+    def row_count(self):
+        """Returns the number of Test_Points, or 0 if they don't exist yet"""
+        if not self.backend.exists(self.gdb + '\\Test_Points'):
+            return 0
+        return self.backend.count(self.gdb + '\\Test_Points')
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Context manager that records one stage"""
+        datasets_before = self.datasets()
+        rows_in = self.row_count()
+        profiler = cProfile.Profile() if self.profile_stages else None
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            wall_time = time.perf_counter() - wall_start
+            cpu_time = time.process_time() - cpu_start
+            datasets_after = self.datasets()
+
+            self.stages.append({'stage': name,
+                                'wall_seconds': round(wall_time, 3),
+                                'cpu_seconds': round(cpu_time, 3),
+                                'peak_rss_mb': peak_rss_mb(),
+                                'rows_in': rows_in,
+                                'rows_out': self.row_count(),
+                                'datasets_created': sorted(datasets_after - datasets_before),
+                                'datasets_deleted': sorted(datasets_before - datasets_after)})
+
+            # Dump the stage's profile for pstats/snakeviz
+            if profiler is not None:
+                profile_folder = os.path.join(self.outfolder, 'FBS_Audit_profile')
+                if not os.path.exists(profile_folder):
+                    os.makedirs(profile_folder)
+                profiler.dump_stats(os.path.join(profile_folder, name + '.prof'))
+
+    def write_report(self):
+        """Write the stages to FBS_Audit_profile.json in the output folder"""
+        report = {'total_wall_seconds': round(sum(stage['wall_seconds']
+                                                  for stage in self.stages), 3),
+                  'total_cpu_seconds': round(sum(stage['cpu_seconds']
+                                                 for stage in self.stages), 3),
+                  'stages': self.stages}
+        with open(os.path.join(self.outfolder, 'FBS_Audit_profile.json'), 'w') as json_file:
+            json.dump(report, json_file, indent=2)
@@ -0,0 +1,778 @@
+""" Raster sampling for the Flood Boundary Standard audit"""
+
+# fbs_raster: Reads DEM and WSEL values at the Test_Points with NumPy
+
+import collections
+import json
+import os
+import warnings
+import numpy
+
+try:
+    from osgeo import gdal
+except ImportError:
+    # Only needed by GdalRaster
+    gdal = None
+
+from fbs_catalog import LazyModule
+
+# Imported when an arcpy Raster is first read, NumPyRaster inputs and the benchmark never need it
+arcpy = LazyModule('arcpy')
+
+# Size in cells of the raster windows read by the samplers
+BLOCK_SIZE = 1024
+
+# arcpy Rasters opened by path, kept open so audits sharing a DEM in one process reuse the handle
+RASTER_HANDLES = {}
+
+# Cells per side of a raster cache tile, and the border every tile repeats from its neighbours
+# so a sampler window of a block plus its border fits inside one tile
+TILE_SIZE = BLOCK_SIZE
+TILE_HALO = 32
+
+# Bytes of the JSON index at the start of a raster cache file, and its format marker
+CACHE_HEADER_SIZE = 4096
+CACHE_MAGIC = 'FBS raster cache 2'
+
+# Cells per side of the finest min/max pyramid cell, every coarser level doubles it, and the
+# format marker of a pyramid file
+PYRAMID_BASE = 4
+PYRAMID_MAGIC = 'FBS min/max pyramid 1'
+
+
+def bilinear_weights(shape, col_pos, row_pos):
+    """Returns the four neighbour cell indices and bilinear weights for fractional positions
+
+    Positions are measured in cells from the center of the upper left cell of an array with the
+    given shape.  The result is ((rows, cols), weights) with one row of each per neighbour.
+    """
+    n_rows, n_cols = shape
+
+    # Clamp positions to the cell centers so points on the outer half cell use the edge values
+    col_pos = numpy.clip(col_pos, 0, n_cols - 1)
+    row_pos = numpy.clip(row_pos, 0, n_rows - 1)
+    col_0 = numpy.minimum(numpy.floor(col_pos).astype(numpy.int64), max(n_cols - 2, 0))
+    row_0 = numpy.minimum(numpy.floor(row_pos).astype(numpy.int64), max(n_rows - 2, 0))
+    col_1 = numpy.minimum(col_0 + 1, n_cols - 1)
+    row_1 = numpy.minimum(row_0 + 1, n_rows - 1)
+    col_weight = col_pos - col_0
+    row_weight = row_pos - row_0
+
+    rows = numpy.stack([row_0, row_0, row_1, row_1])
+    cols = numpy.stack([col_0, col_1, col_0, col_1])
+    weights = numpy.stack([(1 - row_weight) * (1 - col_weight), (1 - row_weight) * col_weight,
+                           row_weight * (1 - col_weight), row_weight * col_weight])
+
+    return (rows, cols), weights
+
+
+class BlockCache:
+    """Least recently used cache of BLOCK_SIZE raster blocks with hit and miss counters
+
+    Windows are put together from the aligned blocks they cover, so the sampling and the second
+    pass share the blocks they both read.  Memory-mapped and in-memory rasters are read directly
+    because their windows are already views.
+    """
+
+    def __init__(self, max_mb=256):
+        """Receives the most memory the cached blocks may use"""
+        self.blocks = collections.OrderedDict()  # (raster path or id, block row, block column)
+        # to (raster, cells), least recently used first.  The raster is kept so its id isn't reused
+        self.hits = 0  # Blocks found in the cache
+        self.max_bytes = max_mb * 1048576  # Most bytes of cells kept
+        self.max_mb = max_mb  # Most memory of the cached blocks in MB
+        self.misses = 0  # Blocks read from the raster
+        self.used_bytes = 0  # Bytes of cells kept
+
+    def block(self, raster, block_row, block_col):
+        """Returns the cells of one block, reading it from the raster if it isn't cached"""
+        # A raster sent to a worker process arrives as a new object with every tile, so rasters
+        # read from a file are told apart by their path
+        key = (getattr(raster, 'path', None) or id(raster), block_row, block_col)
+        if key in self.blocks:
+            self.hits += 1
+            self.blocks.move_to_end(key)
+            return self.blocks[key][1]
+
+        self.misses += 1
+        row_start = block_row * BLOCK_SIZE
+        col_start = block_col * BLOCK_SIZE
+        cells = read_raster_window(raster, row_start, col_start,
+                                   min(BLOCK_SIZE, raster.height - row_start),
+                                   min(BLOCK_SIZE, raster.width - col_start))
+
+        # Evict the least recently used blocks to make room
+        self.blocks[key] = (raster, cells)
+        self.used_bytes += cells.nbytes
+        while self.used_bytes > self.max_bytes and len(self.blocks) > 1:
+            evicted = self.blocks.popitem(last=False)[1][1]
+            self.used_bytes -= evicted.nbytes
+
+        return cells
+
+    def read_window(self, raster, row_start, col_start, n_rows, n_cols):
+        """Reads a window of a raster as a float64 array with NoData as NaN through the cache"""
+        if isinstance(raster, (NumPyRaster, TiledRaster)):
+            return read_raster_window(raster, row_start, col_start, n_rows, n_cols)
+
+        cells = numpy.empty((n_rows, n_cols))
+        for block_row in range(row_start // BLOCK_SIZE,
+                               (row_start + n_rows - 1) // BLOCK_SIZE + 1):
+            block_top = block_row * BLOCK_SIZE
+            rows = slice(max(row_start, block_top), min(row_start + n_rows,
+                                                        block_top + BLOCK_SIZE))
+            for block_col in range(col_start // BLOCK_SIZE,
+                                   (col_start + n_cols - 1) // BLOCK_SIZE + 1):
+                block_left = block_col * BLOCK_SIZE
+                cols = slice(max(col_start, block_left), min(col_start + n_cols,
+                                                             block_left + BLOCK_SIZE))
+                cells[rows.start - row_start:rows.stop - row_start,
+                      cols.start - col_start:cols.stop - col_start] = \
+                    self.block(raster, block_row, block_col)[
+                        rows.start - block_top:rows.stop - block_top,
+                        cols.start - block_left:cols.stop - block_left]
+
+        return cells
+
+
+class Extent:
+    """Stand-in for the arcpy Extent of a NumPyRaster"""
+
+    def __init__(self, x_min, y_min, x_max, y_max):
+        """Receives the corners of the extent"""
+        self.XMax = x_max  # Right edge
+        self.XMin = x_min  # Left edge
+        self.YMax = y_max  # Top edge
+        self.YMin = y_min  # Bottom edge
+
+
+class GdalRaster:
+    """A raster read with GDAL that the samplers read like an arcpy Raster
+
+    The dataset is opened again in every process that reads it, so a GdalRaster can be sent to
+    the worker processes of the tiled audit.
+    """
+
+    def __init__(self, path):
+        """Receives the path of a single band raster"""
+        dataset = gdal.Open(path)
+        geo_transform = dataset.GetGeoTransform()
+        self.dataset = None  # The open GDAL dataset of this process
+        self.height = dataset.RasterYSize  # Number of rows
+        self.meanCellHeight = -geo_transform[5]  # Cell height
+        self.meanCellWidth = geo_transform[1]  # Cell width
+        self.noDataValue = dataset.GetRasterBand(1).GetNoDataValue()  # The NoData value, or None
+        self.path = path  # Path of the raster
+        self.width = dataset.RasterXSize  # Number of columns
+        self.extent = Extent(geo_transform[0], geo_transform[3] - self.height * self.meanCellHeight,
+                             geo_transform[0] + self.width * self.meanCellWidth,
+                             geo_transform[3])  # The raster extent
+
+    def __getstate__(self):
+        """Leaves the open dataset behind when the raster is sent to another process"""
+        state = self.__dict__.copy()
+        state['dataset'] = None
+        return state
+
+    def read_window(self, row_start, col_start, n_rows, n_cols):
+        """Reads a window as a float64 array with NoData as NaN"""
+        if self.dataset is None:
+            self.dataset = gdal.Open(self.path)
+        raw_cells = self.dataset.GetRasterBand(1).ReadAsArray(col_start, row_start, n_cols, n_rows)
+        return nodata_to_nan(raw_cells, self.noDataValue)
+
+
+class MinMaxPyramid:
+    """Minimum and maximum DEM cells over ever coarser squares of cells, for screening windows
+
+    Level 0 holds the min/max of every PYRAMID_BASE square of cells and each level after it the
+    min/max of 2x2 cells of the level before, down to a single cell.  The file starts with a
+    CACHE_HEADER_SIZE byte JSON index followed by every level as a (2, rows, columns) float64
+    array of the minimums then the maximums, read through numpy.memmap.
+    """
+
+    def __init__(self, path):
+        """Receives the path of a pyramid file written by ingest_pyramid"""
+        with open(path, 'rb') as pyramid_file:
+            header = json.loads(pyramid_file.read(CACHE_HEADER_SIZE).rstrip(b'\0').decode('utf-8'))
+        if header.get('magic') != PYRAMID_MAGIC:
+            raise ValueError(path + " is not a min/max pyramid")
+
+        self.base = header['base']  # Cells per side of a level 0 pyramid cell
+        self.extent = Extent(*header['extent'])  # The raster extent
+        self.height = header['height']  # Number of raster rows
+        self.level_shapes = header['levels']  # (rows, columns, byte offset) of every level
+        self.levels = None  # Memory maps of the levels, opened in every process that reads them
+        self.meanCellHeight = header['cell_height']  # Raster cell height
+        self.meanCellWidth = header['cell_width']  # Raster cell width
+        self.path = path  # Path of the pyramid file
+        self.width = header['width']  # Number of raster columns
+
+    def __getstate__(self):
+        """Leaves the memory maps behind when the pyramid is sent to another process"""
+        state = self.__dict__.copy()
+        state['levels'] = None
+        return state
+
+    def open_levels(self):
+        """Maps every level of the pyramid file as a (2, rows, columns) array"""
+        self.levels = [numpy.memmap(self.path, dtype=numpy.float64, mode='r', offset=offset,
+                                    shape=(2, rows, cols))
+                       for rows, cols, offset in self.level_shapes]
+
+    def screen(self, x_coords, y_coords, radius, fld_elev, tolerance):
+        """Decides the second pass of the points whose DEM window the pyramid already settles
+
+        The pyramid cells covering a point's window give bounds outside the window's min/max, and
+        the level 0 cells wholly inside the circle bounds within it.  A point whose FldELEV is
+        beyond the outer bounds by more than its tolerance fails and one within the inner bounds
+        passes, exactly as with the full resolution window.  The bounds aren't the window's
+        MinElev/MaxElev, so only the (decided, passes) boolean arrays are returned.
+        """
+        if self.levels is None:
+            self.open_levels()
+        x_coords = numpy.asarray(x_coords, dtype=numpy.float64)
+        y_coords = numpy.asarray(y_coords, dtype=numpy.float64)
+        fld_elev = numpy.asarray(fld_elev, dtype=numpy.float64)
+        tolerance = numpy.asarray(tolerance, dtype=numpy.float64)
+        decided = numpy.zeros(x_coords.shape, dtype=bool)
+        passed = numpy.zeros(x_coords.shape, dtype=bool)
+
+        # The cell each point falls in, points outside the raster are left to window_min_max
+        point_cols = numpy.floor((x_coords - self.extent.XMin) / self.meanCellWidth)
+        point_rows = numpy.floor((self.extent.YMax - y_coords) / self.meanCellHeight)
+        inside = ((point_cols >= 0) & (point_cols < self.width) &
+                  (point_rows >= 0) & (point_rows < self.height))
+        if not inside.any():
+            return decided, passed
+        point_cols = point_cols[inside].astype(numpy.int64)
+        point_rows = point_rows[inside].astype(numpy.int64)
+
+        # Outer bounds from the first level whose cells are at least half the window, so the
+        # window covers at most three of them a side
+        col_reach = int(numpy.ceil(radius / self.meanCellWidth))
+        row_reach = int(numpy.ceil(radius / self.meanCellHeight))
+        span = 2 * max(row_reach, col_reach) + 1
+        level = min(max(int(numpy.ceil(numpy.log2(span / 2.0 / self.base))), 0),
+                    len(self.levels) - 1)
+        factor = self.base * 2 ** level
+        first_rows = numpy.maximum(point_rows - row_reach, 0) // factor
+        last_rows = numpy.minimum(point_rows + row_reach, self.height - 1) // factor
+        first_cols = numpy.maximum(point_cols - col_reach, 0) // factor
+        last_cols = numpy.minimum(point_cols + col_reach, self.width - 1) // factor
+        outer = self.levels[level]
+        with warnings.catch_warnings():
+            # Windows of NoData only have NaN bounds and are never decided
+            warnings.simplefilter('ignore', RuntimeWarning)
+            covering = [(numpy.minimum(first_rows + row_step, last_rows),
+                         numpy.minimum(first_cols + col_step, last_cols))
+                        for row_step in range(3) for col_step in range(3)]
+            outer_min = numpy.nanmin([outer[0][rows, cols] for rows, cols in covering], axis=0)
+            outer_max = numpy.nanmax([outer[1][rows, cols] for rows, cols in covering], axis=0)
+
+        # Inner bounds from the level 0 cells whose every cell center is within the radius.  The
+        # farthest centers of a level 0 cell are at its corners
+        first_rows = numpy.maximum(point_rows - row_reach, 0) // self.base
+        last_rows = numpy.minimum(point_rows + row_reach, self.height - 1) // self.base
+        first_cols = numpy.maximum(point_cols - col_reach, 0) // self.base
+        last_cols = numpy.minimum(point_cols + col_reach, self.width - 1) // self.base
+        inner = self.levels[0]
+        inner_min = numpy.full(len(point_rows), numpy.nan)
+        inner_max = numpy.full(len(point_rows), numpy.nan)
+        for row_step in range(2 * row_reach // self.base + 2):
+            rows = numpy.minimum(first_rows + row_step, last_rows)
+            center_y = self.extent.YMax - (numpy.stack(
+                [rows * self.base, numpy.minimum((rows + 1) * self.base, self.height) - 1]) +
+                0.5) * self.meanCellHeight
+            reach_y = numpy.abs(center_y - y_coords[inside]).max(axis=0)
+            for col_step in range(2 * col_reach // self.base + 2):
+                cols = numpy.minimum(first_cols + col_step, last_cols)
+                center_x = self.extent.XMin + (numpy.stack(
+                    [cols * self.base, numpy.minimum((cols + 1) * self.base, self.width) - 1]) +
+                    0.5) * self.meanCellWidth
+                within = numpy.hypot(numpy.abs(center_x - x_coords[inside]).max(axis=0),
+                                     reach_y) <= radius
+                inner_min = numpy.fmin(inner_min, numpy.where(within, inner[0][rows, cols],
+                                                              numpy.nan))
+                inner_max = numpy.fmax(inner_max, numpy.where(within, inner[1][rows, cols],
+                                                              numpy.nan))
+
+        with numpy.errstate(invalid='ignore'):
+            # The same comparisons as classify_points, so the bounds decide as the window would
+            fld = fld_elev[inside]
+            tol = tolerance[inside]
+            fails = (fld < outer_min - tol) | (fld > outer_max + tol)
+            passes = (inner_min - tol <= fld) & (fld <= inner_max + tol)
+
+        decided[inside] = fails | passes
+        passed[inside] = passes
+
+        return decided, passed
+
+
+class NumPyRaster:
+    """A raster held in a 2D NumPy array that the samplers read like an arcpy Raster"""
+
+    def __init__(self, cells, x_min, y_max, cell_size, no_data=None):
+        """Receives the cells with row 0 at the top, the upper left corner and the cell size"""
+        self.cells = cells  # The cell values
+        self.height, self.width = cells.shape  # Number of rows and columns
+        self.meanCellHeight = cell_size  # Cell height
+        self.meanCellWidth = cell_size  # Cell width
+        self.noDataValue = no_data  # The NoData value, or None
+        self.extent = Extent(x_min, y_max - self.height * cell_size,
+                             x_min + self.width * cell_size, y_max)  # The raster extent
+
+    def read_window(self, row_start, col_start, n_rows, n_cols):
+        """Reads a window as a float64 array with NoData as NaN"""
+        return nodata_to_nan(self.cells[row_start:row_start + n_rows,
+                                        col_start:col_start + n_cols], self.noDataValue)
+
+
+class TiledRaster:
+    """A raster cache file of fixed-size tiles that the samplers read like an arcpy Raster
+
+    The file starts with a CACHE_HEADER_SIZE byte JSON index followed by the tiles in row-major
+    order.  Every tile holds TILE_SIZE cells a side plus a TILE_HALO border copied from its
+    neighbours, with NoData as NaN.  The tiles are read through numpy.memmap, so a window that
+    fits inside one tile of a float64 cache is a view of the page cache and is never copied.
+    """
+
+    def __init__(self, path):
+        """Receives the path of a raster cache file written by ingest_raster"""
+        with open(path, 'rb') as cache_file:
+            header = json.loads(cache_file.read(CACHE_HEADER_SIZE).rstrip(b'\0').decode('utf-8'))
+        if header.get('magic') != CACHE_MAGIC:
+            raise ValueError(path + " is not a raster cache")
+
+        self.dtype = header['dtype']  # Data type of the cached cells
+        self.extent = Extent(*header['extent'])  # The raster extent
+        self.halo = header['halo']  # Border cells every tile repeats from its neighbours
+        self.height = header['height']  # Number of rows
+        self.meanCellHeight = header['cell_height']  # Cell height
+        self.meanCellWidth = header['cell_width']  # Cell width
+        self.noDataValue = None  # NoData is already NaN in the cache
+        self.path = path  # Path of the cache file
+        self.tile_size = header['tile_size']  # Cells per side of a tile without its border
+        self.tiles = None  # Memory map of the tiles, opened in every process that reads them
+        self.width = header['width']  # Number of columns
+
+    def __getstate__(self):
+        """Leaves the memory map behind when the raster is sent to another process"""
+        state = self.__dict__.copy()
+        state['tiles'] = None
+        return state
+
+    def open_tiles(self):
+        """Maps the tiles of the cache file as a (tile row, tile column, row, column) array"""
+        side = self.tile_size + 2 * self.halo
+        self.tiles = numpy.memmap(self.path, dtype=self.dtype, mode='r', offset=CACHE_HEADER_SIZE,
+                                  shape=(-(-self.height // self.tile_size),
+                                         -(-self.width // self.tile_size), side, side))
+
+    def read_window(self, row_start, col_start, n_rows, n_cols):
+        """Reads a window as a float64 array with NoData as NaN
+
+        The window is a view of the cache when it fits inside one tile and the cache holds float64.
+        """
+        if self.tiles is None:
+            self.open_tiles()
+
+        # The tile whose border reaches back to the start of the window
+        tile_row = min((row_start + self.halo) // self.tile_size, self.tiles.shape[0] - 1)
+        tile_col = min((col_start + self.halo) // self.tile_size, self.tiles.shape[1] - 1)
+        top = row_start - tile_row * self.tile_size + self.halo
+        left = col_start - tile_col * self.tile_size + self.halo
+        if top >= 0 and left >= 0 and top + n_rows <= self.tiles.shape[2] and \
+                left + n_cols <= self.tiles.shape[3]:
+            return self.tiles[tile_row, tile_col, top:top + n_rows,
+                              left:left + n_cols].astype(numpy.float64, copy=False)
+
+        # Otherwise copy the window together from the tiles it covers
+        cells = numpy.full((n_rows, n_cols), numpy.nan)
+        row_end = min(row_start + n_rows, self.height)
+        col_end = min(col_start + n_cols, self.width)
+        for tile_row in range(row_start // self.tile_size, (row_end - 1) // self.tile_size + 1):
+            tile_top = tile_row * self.tile_size
+            rows = slice(max(row_start, tile_top), min(row_end, tile_top + self.tile_size))
+            for tile_col in range(col_start // self.tile_size,
+                                  (col_end - 1) // self.tile_size + 1):
+                tile_left = tile_col * self.tile_size
+                cols = slice(max(col_start, tile_left), min(col_end, tile_left + self.tile_size))
+                cells[rows.start - row_start:rows.stop - row_start,
+                      cols.start - col_start:cols.stop - col_start] = \
+                    self.tiles[tile_row, tile_col,
+                               rows.start - tile_top + self.halo:rows.stop - tile_top + self.halo,
+                               cols.start - tile_left + self.halo:cols.stop - tile_left + self.halo]
+
+        return cells
+
+
+def bilinear_apply(cells, indices, weights):
+    """Interpolates cells with the indices and weights from bilinear_weights
+
+    cells holds NaN for NoData.  Like AddSurfaceInformation BILINEAR a position is NoData when
+    any neighbour it takes weight from is, neighbours with no weight are ignored.
+    """
+    values = cells[indices]
+    weighted = weights > 0
+
+    result = (numpy.where(weighted, values, 0) * weights).sum(axis=0)
+    result[(numpy.isnan(values) & weighted).any(axis=0)] = numpy.nan
+
+    return result
+
+
+def block_groups(block_keys, inside):
+    """Yields (block key, point indices) for the points inside, one block at a time in key order
+
+    The points are sorted by block key once, so every block is a slice of the sorted indices
+    and its results scatter back to the original point order through them.
+    """
+    indices = numpy.nonzero(inside)[0]
+    indices = indices[numpy.argsort(block_keys[indices], kind='stable')]
+    keys, starts = numpy.unique(block_keys[indices], return_index=True)
+    for block_key, members in zip(keys, numpy.split(indices, starts[1:])):
+        yield block_key, members
+
+
+def grid_key(raster):
+    """Returns a key that is equal for rasters sharing the same cell grid"""
+    return (raster.extent.XMin, raster.extent.YMax, raster.meanCellWidth,
+            raster.meanCellHeight, raster.width, raster.height)
+
+
+def ingest_pyramid(in_raster, pyramid_path, base=PYRAMID_BASE):
+    """Writes the min/max pyramid of in_raster to a file and returns the MinMaxPyramid
+
+    Level 0 is built one BLOCK_SIZE window at a time and every level after it one strip of the
+    level before at a time.  Like ingest_raster the file is moved into place when complete.
+    """
+    raster = open_raster(in_raster)
+
+    # The shape of every level down to a single cell, and where it starts in the file
+    level_shapes = []
+    rows, cols = -(-raster.height // base), -(-raster.width // base)
+    offset = CACHE_HEADER_SIZE
+    while True:
+        level_shapes.append([rows, cols, offset])
+        offset += 2 * rows * cols * 8
+        if rows == 1 and cols == 1:
+            break
+        rows, cols = -(-rows // 2), -(-cols // 2)
+
+    header = json.dumps({'magic': PYRAMID_MAGIC, 'base': base,
+                         'extent': [raster.extent.XMin, raster.extent.YMin, raster.extent.XMax,
+                                    raster.extent.YMax],
+                         'width': raster.width, 'height': raster.height,
+                         'cell_width': raster.meanCellWidth,
+                         'cell_height': raster.meanCellHeight,
+                         'levels': level_shapes}).encode('utf-8')
+
+    pyramid_folder = os.path.dirname(os.path.abspath(pyramid_path))
+    if not os.path.exists(pyramid_folder):
+        os.makedirs(pyramid_folder)
+    temp_path = '{}.{}.tmp'.format(pyramid_path, os.getpid())
+    with open(temp_path, 'wb') as pyramid_file:
+        pyramid_file.write(header.ljust(CACHE_HEADER_SIZE, b'\0'))
+        pyramid_file.truncate(offset)
+    levels = [numpy.memmap(temp_path, dtype=numpy.float64, mode='r+', offset=level_offset,
+                           shape=(2, level_rows, level_cols))
+              for level_rows, level_cols, level_offset in level_shapes]
+
+    # Level 0 from the raster, BLOCK_SIZE is a multiple of the base so the windows line up
+    step = BLOCK_SIZE // base * base
+    for row_start in range(0, raster.height, step):
+        for col_start in range(0, raster.width, step):
+            cells = read_raster_window(raster, row_start, col_start,
+                                       min(step, raster.height - row_start),
+                                       min(step, raster.width - col_start))
+            block_min, block_max = min_max_reduce(cells, cells, base)
+            levels[0][:, row_start // base:row_start // base + block_min.shape[0],
+                      col_start // base:col_start // base + block_min.shape[1]] = \
+                [block_min, block_max]
+
+    # Every other level from the one before
+    for source, target in zip(levels, levels[1:]):
+        for row_start in range(0, source.shape[1], 2 * BLOCK_SIZE):
+            strip = source[:, row_start:row_start + 2 * BLOCK_SIZE]
+            strip_min, strip_max = min_max_reduce(strip[0], strip[1], 2)
+            target[:, row_start // 2:row_start // 2 + strip_min.shape[0]] = [strip_min, strip_max]
+
+    for level in levels:
+        level.flush()
+    del levels
+    os.replace(temp_path, pyramid_path)
+
+    return MinMaxPyramid(pyramid_path)
+
+
+def ingest_raster(in_raster, cache_path, dtype='float64', tile_size=TILE_SIZE,
+                  halo=TILE_HALO):
+    """Writes in_raster to a TiledRaster cache file and returns the TiledRaster
+
+    The raster is read one tile and its border at a time, so ingesting needs memory for a single
+    tile.  The cells are kept as float64 like the samplers read them, a float32 cache is half
+    the size but rounds the cells to about 7 significant digits.  The file is written under a
+    temporary name and moved into place when complete, so readers never see a partial cache.
+    """
+    raster = open_raster(in_raster)
+    side = tile_size + 2 * halo
+    n_tile_rows = -(-raster.height // tile_size)
+    n_tile_cols = -(-raster.width // tile_size)
+
+    # The JSON index, padded to CACHE_HEADER_SIZE
+    header = json.dumps({'magic': CACHE_MAGIC, 'dtype': numpy.dtype(dtype).name,
+                         'extent': [raster.extent.XMin, raster.extent.YMin, raster.extent.XMax,
+                                    raster.extent.YMax],
+                         'width': raster.width, 'height': raster.height,
+                         'cell_width': raster.meanCellWidth,
+                         'cell_height': raster.meanCellHeight,
+                         'tile_size': tile_size, 'halo': halo}).encode('utf-8')
+
+    cache_folder = os.path.dirname(os.path.abspath(cache_path))
+    if not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+    temp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+    with open(temp_path, 'wb') as cache_file:
+        cache_file.write(header.ljust(CACHE_HEADER_SIZE, b'\0'))
+    tiles = numpy.memmap(temp_path, dtype=dtype, mode='r+', offset=CACHE_HEADER_SIZE,
+                         shape=(n_tile_rows, n_tile_cols, side, side))
+
+    # Copy every tile with its border, the border outside the raster stays NoData
+    for tile_row in range(n_tile_rows):
+        row_start = max(tile_row * tile_size - halo, 0)
+        row_end = min((tile_row + 1) * tile_size + halo, raster.height)
+        for tile_col in range(n_tile_cols):
+            col_start = max(tile_col * tile_size - halo, 0)
+            col_end = min((tile_col + 1) * tile_size + halo, raster.width)
+            tile = numpy.full((side, side), numpy.nan, dtype=dtype)
+            top = row_start - tile_row * tile_size + halo
+            left = col_start - tile_col * tile_size + halo
+            tile[top:top + row_end - row_start, left:left + col_end - col_start] = \
+                read_raster_window(raster, row_start, col_start, row_end - row_start,
+                                   col_end - col_start)
+            tiles[tile_row, tile_col] = tile
+
+    tiles.flush()
+    del tiles
+    os.replace(temp_path, cache_path)
+
+    return TiledRaster(cache_path)
+
+
+def min_max_reduce(min_cells, max_cells, factor):
+    """Returns the NaN ignoring min and max of every factor x factor square of two 2D arrays
+
+    The arrays are padded with NaN to a multiple of factor, squares of NaN only stay NaN.
+    """
+    n_rows, n_cols = -(-min_cells.shape[0] // factor), -(-min_cells.shape[1] // factor)
+    reduced = []
+    for cells, reduce_function in [(min_cells, numpy.nanmin), (max_cells, numpy.nanmax)]:
+        padded = numpy.full((n_rows * factor, n_cols * factor), numpy.nan)
+        padded[:cells.shape[0], :cells.shape[1]] = cells
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            reduced.append(reduce_function(padded.reshape(n_rows, factor, n_cols, factor),
+                                           axis=(1, 3)))
+
+    return reduced
+
+
+def morton_key(rows, cols):
+    """Returns the Morton (Z-order) keys of non-negative row and column arrays below 2**32
+
+    Blocks visited in key order stay close together in both directions, unlike row order.
+    """
+    keys = []
+    for values in [rows, cols]:
+        # Spread the bits of the values apart so the other array's bits fit between them
+        spread = numpy.asarray(values).astype(numpy.uint64) & numpy.uint64(0xFFFFFFFF)
+        for shift, mask in [(16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF),
+                            (4, 0x0F0F0F0F0F0F0F0F), (2, 0x3333333333333333),
+                            (1, 0x5555555555555555)]:
+            spread = (spread | (spread << numpy.uint64(shift))) & numpy.uint64(mask)
+        keys.append(spread)
+
+    return (keys[0] << numpy.uint64(1)) | keys[1]
+
+
+def nodata_to_nan(raw_cells, no_data):
+    """Returns the cells as a float64 array with the no_data value as NaN"""
+    cells = raw_cells.astype(numpy.float64)
+
+    # Compare in the raster's own data type so float32 NoData values match exactly
+    if no_data is not None:
+        cells[raw_cells == numpy.asarray(no_data).astype(raw_cells.dtype)] = numpy.nan
+
+    return cells
+
+
+def open_raster(in_raster):
+    """Returns an arcpy Raster for a path, or the raster itself if it reads its own windows"""
+    if hasattr(in_raster, 'read_window'):
+        return in_raster
+    if in_raster not in RASTER_HANDLES:
+        RASTER_HANDLES[in_raster] = arcpy.Raster(in_raster)
+    return RASTER_HANDLES[in_raster]
+
+
+def read_raster_window(raster, row_start, col_start, n_rows, n_cols, block_cache=None):
+    """Reads a window of a raster as a float64 array with NoData as NaN
+
+    With a BlockCache the window is put together from its cached blocks.
+    """
+    if block_cache is not None:
+        return block_cache.read_window(raster, row_start, col_start, n_rows, n_cols)
+    if hasattr(raster, 'read_window'):
+        return raster.read_window(row_start, col_start, n_rows, n_cols)
+
+    lower_left = arcpy.Point(raster.extent.XMin + col_start * raster.meanCellWidth,
+                             raster.extent.YMax - (row_start + n_rows) * raster.meanCellHeight)
+    raw_cells = arcpy.RasterToNumPyArray(raster, lower_left, n_cols, n_rows)
+
+    return nodata_to_nan(raw_cells, raster.noDataValue)
+
+
+def sample_rasters(in_rasters, x_coords, y_coords, block_cache=None):
+    """Bilinear samples every raster in in_rasters at the x/y coordinates in a single pass
+
+    Rasters that share a cell grid are read block by block together and reuse the same cell
+    indices and weights.  The blocks are visited in Morton order whatever order the points come
+    in.  Points outside a raster's extent are never read from it.  Returns one array per raster
+    with NoData as -9999.
+    """
+    x_coords = numpy.asarray(x_coords, dtype=numpy.float64)
+    y_coords = numpy.asarray(y_coords, dtype=numpy.float64)
+    results = [numpy.full(x_coords.shape, -9999.0) for _ in in_rasters]
+
+    # Group the rasters by cell grid
+    grids = {}
+    for index, in_raster in enumerate(in_rasters):
+        raster = open_raster(in_raster)
+        grids.setdefault(grid_key(raster), []).append((index, raster))
+
+    for grid_rasters in grids.values():
+        raster = grid_rasters[0][1]
+
+        # Fractional positions measured from the center of the upper left cell
+        col_pos = (x_coords - raster.extent.XMin) / raster.meanCellWidth - 0.5
+        row_pos = (raster.extent.YMax - y_coords) / raster.meanCellHeight - 0.5
+
+        # Points outside the raster extent are NoData
+        inside = ((x_coords >= raster.extent.XMin) & (x_coords <= raster.extent.XMax) &
+                  (y_coords >= raster.extent.YMin) & (y_coords <= raster.extent.YMax))
+        if not inside.any():
+            continue
+
+        # Group the points by the raster block they fall in
+        block_rows = numpy.clip(row_pos, 0, raster.height - 1).astype(numpy.int64) // BLOCK_SIZE
+        block_cols = numpy.clip(col_pos, 0, raster.width - 1).astype(numpy.int64) // BLOCK_SIZE
+
+        for block_key, members in block_groups(morton_key(block_rows, block_cols), inside):
+            # The block plus a one cell border for the bilinear neighbours
+            row_start = max(int(block_rows[members[0]]) * BLOCK_SIZE - 1, 0)
+            col_start = max(int(block_cols[members[0]]) * BLOCK_SIZE - 1, 0)
+            n_rows = min(BLOCK_SIZE + 2, raster.height - row_start)
+            n_cols = min(BLOCK_SIZE + 2, raster.width - col_start)
+
+            # The weights are computed once and shared by every raster on this grid
+            indices, weights = bilinear_weights((n_rows, n_cols), col_pos[members] - col_start,
+                                                row_pos[members] - row_start)
+
+            for index, grid_raster in grid_rasters:
+                cells = read_raster_window(grid_raster, row_start, col_start, n_rows, n_cols,
+                                           block_cache)
+                values = bilinear_apply(cells, indices, weights)
+                results[index][members] = numpy.where(numpy.isnan(values), -9999.0, values)
+
+    return results
+
+
+def window_min_max(in_raster, x_coords, y_coords, radius, block_cache=None):
+    """Returns the minimum and maximum cell values of in_raster within radius of each x/y point
+
+    radius is in the linear unit of the raster.  Cells are included when their center lies within
+    the circle, and the cell the point falls in is always included so radii smaller than a cell
+    still return a value.  Points with only NoData cells return NaN.  The blocks are visited in
+    Morton order.
+    """
+    min_values, max_values = window_min_max_radii(in_raster, x_coords, y_coords, [radius],
+                                                  block_cache)
+    return min_values[0], max_values[0]
+
+
+def window_min_max_radii(in_raster, x_coords, y_coords, radii, block_cache=None):
+    """window_min_max for several radii at once, reading the window of the largest one
+
+    Returns the (minimums, maximums) as arrays of one row per radius.
+    """
+    raster = open_raster(in_raster)
+    x_coords = numpy.asarray(x_coords, dtype=numpy.float64)
+    y_coords = numpy.asarray(y_coords, dtype=numpy.float64)
+    min_values = numpy.full((len(radii), len(x_coords)), numpy.nan)
+    max_values = numpy.full((len(radii), len(x_coords)), numpy.nan)
+
+    # The cell each point falls in
+    point_cols = numpy.floor((x_coords - raster.extent.XMin) / raster.meanCellWidth)
+    point_rows = numpy.floor((raster.extent.YMax - y_coords) / raster.meanCellHeight)
+
+    # Points outside the raster extent are NoData
+    inside = ((point_cols >= 0) & (point_cols < raster.width) &
+              (point_rows >= 0) & (point_rows < raster.height))
+    if not inside.any():
+        return min_values, max_values
+    point_cols = point_cols.astype(numpy.int64)
+    point_rows = point_rows.astype(numpy.int64)
+
+    # Cell offsets of the square around each point that can reach the largest circle
+    col_reach = int(numpy.ceil(max(radii) / raster.meanCellWidth))
+    row_reach = int(numpy.ceil(max(radii) / raster.meanCellHeight))
+    row_offsets, col_offsets = numpy.mgrid[-row_reach:row_reach + 1, -col_reach:col_reach + 1]
+    row_offsets = row_offsets.ravel()
+    col_offsets = col_offsets.ravel()
+
+    # Group the points by the raster block they fall in
+    block_rows = point_rows // BLOCK_SIZE
+    block_cols = point_cols // BLOCK_SIZE
+    block_rows[~inside] = 0
+    block_cols[~inside] = 0
+
+    for block_key, members in block_groups(morton_key(block_rows, block_cols), inside):
+        # The block plus a border wide enough for the circle
+        row_start = max(int(block_rows[members[0]]) * BLOCK_SIZE - row_reach, 0)
+        col_start = max(int(block_cols[members[0]]) * BLOCK_SIZE - col_reach, 0)
+        n_rows = min(BLOCK_SIZE + 2 * row_reach, raster.height - row_start)
+        n_cols = min(BLOCK_SIZE + 2 * col_reach, raster.width - col_start)
+        cells = read_raster_window(raster, row_start, col_start, n_rows, n_cols, block_cache)
+
+        # Window cells around every point in the block, one row per point
+        rows = point_rows[members][:, None] + row_offsets - row_start
+        cols = point_cols[members][:, None] + col_offsets - col_start
+
+        # Distance from each point to the cell centers
+        cell_x = raster.extent.XMin + (cols + col_start + 0.5) * raster.meanCellWidth
+        cell_y = raster.extent.YMax - (rows + row_start + 0.5) * raster.meanCellHeight
+        distance = numpy.hypot(cell_x - x_coords[members][:, None],
+                               cell_y - y_coords[members][:, None])
+
+        # The cells inside the raster, read once for every radius
+        in_window = (rows >= 0) & (rows < n_rows) & (cols >= 0) & (cols < n_cols)
+        window_values = cells[numpy.clip(rows, 0, n_rows - 1), numpy.clip(cols, 0, n_cols - 1)]
+        own_cell = (row_offsets == 0) & (col_offsets == 0)
+
+        for index, radius in enumerate(radii):
+            # Keep the cells inside the circle, plus the point's own cell
+            in_circle = ((distance <= radius) | own_cell) & in_window
+            values = numpy.where(in_circle, window_values, numpy.nan)
+
+            with numpy.errstate(invalid='ignore'):
+                has_data = ~numpy.isnan(values).all(axis=1)
+                block_min = numpy.full(len(values), numpy.nan)
+                block_max = numpy.full(len(values), numpy.nan)
+                block_min[has_data] = numpy.nanmin(values[has_data], axis=1)
+                block_max[has_data] = numpy.nanmax(values[has_data], axis=1)
+            min_values[index, members] = block_min
+            max_values[index, members] = block_max
+
+    return min_values, max_values
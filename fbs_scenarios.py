@@ -0,0 +1,91 @@
+""" Tolerance and buffer scenarios for the Flood Boundary Standard audit"""
+
+# fbs_scenarios: Evaluates combinations of tolerance, second pass radius and risk class at once
+
+import csv
+import numpy
+
+# Pass rate each risk class needs, from Table 2 of the FBS Guidance.  Classes D and E have none
+RISK_CLASS_PASS_RATES = {'A': 0.95, 'B': 0.90, 'C': 0.85, 'D': None, 'E': None}
+
+# Status codes counted for every scenario, in the order of the PassFail domain
+STATUS_CODES = ['P', 'F', 'NA', 'U']
+
+# Columns of FBS_Audit_scenarios.csv
+SCENARIO_COLUMNS = ['scenario', 'field', 'tolerance', 'radius_feet', 'risk_class', 'points'] + \
+    STATUS_CODES + ['pass_rate', 'required_pass_rate', 'meets_standard']
+
+
+class Scenario:
+    """One tolerance, second pass radius and risk class to classify the Test_Points with"""
+
+    def __init__(self, tolerance, radius_feet, risk_class):
+        """Receives the tolerance in feet, the second pass radius in feet and the risk class"""
+        self.name = 'T{:g}_R{:g}_{}'.format(tolerance, radius_feet,
+                                           risk_class).replace('.', 'p')  # Name, e.g. T0p5_R19_B
+        self.field_name = 'Status_' + self.name  # Test_Points field of the scenario's Status
+        self.radius_feet = radius_feet  # Radius of the MinElev/MaxElev circle in feet
+        self.risk_class = risk_class  # Risk class whose pass rate applies
+        self.tolerance = tolerance  # Tolerance in feet
+
+
+def parse_scenarios(text):
+    """Returns the Scenarios of a 'tolerance:radius_feet:risk_class,...' string
+
+    For example '1.0:19:A,0.5:19:B,1.0:25:A'.  A scenario listed twice is kept once.  Raises
+    ValueError for a malformed scenario, so it can be an argparse type.
+    """
+    scenarios = []
+    for item in text.split(','):
+        values = item.strip().split(':')
+        if len(values) != 3:
+            raise ValueError("A scenario is tolerance:radius_feet:risk_class, not " + item)
+        tolerance, radius_feet, risk_class = float(values[0]), float(values[1]), values[2].upper()
+        if tolerance <= 0 or radius_feet <= 0 or risk_class not in RISK_CLASS_PASS_RATES:
+            raise ValueError("Tolerance and radius must be positive and the risk class one of " +
+                             ", ".join(sorted(RISK_CLASS_PASS_RATES)) + ", not " + item)
+        scenario = Scenario(tolerance, radius_feet, risk_class)
+        if scenario.name not in [other.name for other in scenarios]:
+            scenarios.append(scenario)
+
+    return scenarios
+
+
+def pass_rate(passed, failed):
+    """Returns the share of the passed and failed points that pass, or None without any
+
+    NA and Unknown points weren't tested against the standard, so they don't count either way.
+    """
+    return round(passed / float(passed + failed), 4) if passed + failed else None
+
+
+def scenario_table(scenarios, statuses):
+    """Returns the pass-rate rows of the scenarios, one dictionary of SCENARIO_COLUMNS each
+
+    statuses holds the Status array of every scenario.  The pass rate is the share of the passed
+    and failed Test_Points that pass, the NA and Unknown points are only counted.
+    """
+    rows = []
+    for scenario, status in zip(scenarios, statuses):
+        values, counts = numpy.unique(status, return_counts=True)
+        status_counts = dict(zip(values.tolist(), counts.tolist()))
+        row = {'scenario': scenario.name, 'field': scenario.field_name,
+               'tolerance': scenario.tolerance, 'radius_feet': scenario.radius_feet,
+               'risk_class': scenario.risk_class, 'points': len(status)}
+        for code in STATUS_CODES:
+            row[code] = status_counts.get(code, 0)
+        row['pass_rate'] = pass_rate(row['P'], row['F'])
+        row['required_pass_rate'] = RISK_CLASS_PASS_RATES[scenario.risk_class]
+        row['meets_standard'] = None if row['required_pass_rate'] is None or \
+            row['pass_rate'] is None else row['pass_rate'] >= row['required_pass_rate']
+        rows.append(row)
+
+    return rows
+
+
+def write_scenario_table(rows, path):
+    """Writes the pass-rate rows to a CSV file"""
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.DictWriter(csv_file, SCENARIO_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
@@ -0,0 +1,194 @@
+""" Stage graph with checkpoints for the Flood Boundary Standard audit"""
+
+# fbs_stages: Runs the audit stages in dependency order, resuming from their checkpoints
+
+import concurrent.futures
+import hashlib
+import json
+import os
+
+
+class Stage:
+    """One stage of the audit with the stages it needs and the datasets it leaves behind
+
+    A stage with outputs is checkpointed once it finishes.  A stage without outputs only builds
+    in-memory state, so it runs whenever a stage that needs it runs.  Stages sharing a resource
+    never run at the same time.
+    """
+
+    def __init__(self, name, message, function, requires=(), inputs=(), outputs=(),
+                 resources=(), always=False):
+        """Receives the stage name, its progress message and the callable that runs it"""
+        self.always = always  # Runs on every run before the graph, without a checkpoint
+        self.function = function  # Callable that runs the stage
+        self.inputs = list(inputs)  # Names of the input fingerprints the stage depends on
+        self.message = message  # Progress message printed when the stage starts
+        self.name = name  # Name of the stage in the profile and the checkpoints
+        self.outputs = list(outputs)  # Datasets the stage leaves behind
+        self.requires = list(requires)  # Names of the stages that must finish first
+        self.resources = set(resources)  # Datasets the stage edits
+
+
+class StageGraph:
+    """Runs a list of stages in dependency order with checkpoints in FBS_Audit_checkpoints.json
+
+    Every checkpoint holds the stage key, a fingerprint of the stage's inputs and the keys of the
+    stages it requires, so a changed input invalidates every stage after it.  With resume a
+    checkpointed stage is skipped when its key is unchanged and its outputs still exist.
+    """
+
+    def __init__(self, backend, outfolder, resume=False, printer=print):
+        """Receives the backend that checks the outputs, the output folder and the resume mode"""
+        self.backend = backend  # Geoprocessing backend of the audit
+        self.checkpoint_file = os.path.join(outfolder,
+                                            'FBS_Audit_checkpoints.json')  # Checkpoint file
+        self.checkpoints = {}  # Stage name to its key and outputs
+        self.printer = printer  # Prints the progress messages
+        self.resume = resume  # Skip the stages with a current checkpoint
+
+        if resume and os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file) as json_file:
+                self.checkpoints = json.load(json_file)
+
+    def finish_stage(self, stage, key):
+        """Checkpoints a stage with outputs once it finished"""
+        if stage.outputs:
+            self.checkpoints[stage.name] = {'key': key, 'outputs': stage.outputs}
+            self.write_checkpoints()
+
+    def is_current(self, stage, key):
+        """Returns True if the stage finished with the same key and its outputs still exist"""
+        checkpoint = self.checkpoints.get(stage.name)
+        return bool(stage.outputs) and checkpoint is not None and checkpoint['key'] == key and \
+            all(self.backend.exists(output) for output in stage.outputs)
+
+    @staticmethod
+    def keys(stages, input_keys):
+        """Returns the key of every stage from its inputs and the keys of the stages it needs"""
+        keys = {}
+        for stage in stages:
+            sha1 = hashlib.sha1(stage.name.encode('utf-8'))
+            for value in [input_keys[name] for name in stage.inputs] + \
+                    [keys[name] for name in stage.requires]:
+                sha1.update(b'|' + value.encode('utf-8'))
+            keys[stage.name] = sha1.hexdigest()
+
+        return keys
+
+    def plan(self, stages, keys):
+        """Returns the names of the stages that need to run
+
+        Without resume that is every stage.  With resume it is the stages without a current
+        checkpoint and every stage after one of them, plus the in-memory stages any of those
+        need.
+        """
+        # A stage is stale when its own checkpoint is, or when a stage before it is
+        stale = set()
+        for stage in stages:
+            if any(name in stale for name in stage.requires) or \
+                    (stage.outputs and not (self.resume and self.is_current(stage,
+                                                                            keys[stage.name]))):
+                stale.add(stage.name)
+        run = set(stage.name for stage in stages if stage.outputs and stage.name in stale)
+
+        # The in-memory stages are rebuilt for the stages that run.  Walking backwards reaches
+        # every in-memory stage they need
+        producers = {stage.name: stage for stage in stages}
+        for stage in reversed(stages):
+            if stage.name in run:
+                run.update(name for name in stage.requires if not producers[name].outputs)
+
+        # The checkpoints of the stages that run are stale until they finish again
+        for name in run:
+            self.checkpoints.pop(name, None)
+        self.write_checkpoints()
+
+        return run
+
+    def run(self, stages, profiler, input_keys_function, workers=1):
+        """Runs the stages, each one recorded with the StageProfiler
+
+        The always stages run first in order.  input_keys_function then returns the input
+        fingerprints by name for the stage keys.  With one worker the other stages run in list
+        order on the calling thread, otherwise as soon as the stages they need are done, up to
+        workers at a time on threads.
+        """
+        for stage in stages:
+            if stage.always:
+                self.run_stage(stage, profiler)
+
+        stages = [stage for stage in stages if not stage.always]
+        keys = self.keys(stages, input_keys_function())
+        run = self.plan(stages, keys)
+
+        # cProfile can only follow one thread at a time
+        if profiler.profile_stages:
+            workers = 1
+
+        # A serial run stays on the calling thread like the original audit, so the stages can use
+        # what is bound to it
+        if workers <= 1:
+            finished = set()
+            for stage in stages:
+                if not all(name in finished for name in stage.requires):
+                    raise ValueError("Stage {} needs stages that don't run before it".format(
+                        stage.name))
+                if self.start_stage(stage, run):
+                    self.run_stage(stage, profiler)
+                    self.finish_stage(stage, keys[stage.name])
+                finished.add(stage.name)
+            return
+
+        pending = list(stages)
+        finished = set()
+        running = {}
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            while pending or running:
+                # Start the ready stages in list order, which is the order of a serial run
+                for stage in list(pending):
+                    if len(running) >= workers:
+                        break
+                    if not all(name in finished for name in stage.requires) or \
+                            any(stage.resources & other.resources for other in running.values()):
+                        continue
+                    pending.remove(stage)
+                    if not self.start_stage(stage, run):
+                        finished.add(stage.name)
+                        continue
+                    running[executor.submit(self.run_stage, stage, profiler)] = stage
+
+                if not running:
+                    if pending:
+                        raise ValueError("These stages need stages that never run: " +
+                                         ", ".join(stage.name for stage in pending))
+                    break
+
+                done, not_done = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    future.result()
+                    finished.add(stage.name)
+                    self.finish_stage(stage, keys[stage.name])
+
+    def run_stage(self, stage, profiler):
+        """Prints the stage's message and runs it inside a profiler stage"""
+        self.printer(stage.message)
+        with profiler.stage(stage.name):
+            stage.function()
+
+    def start_stage(self, stage, run):
+        """Returns True if the stage is in the plan, otherwise prints why it is skipped"""
+        if stage.name in run:
+            return True
+
+        self.printer("Skipping {}, {}".format(stage.name, "its checkpoint is current"
+                                              if stage.outputs else "no stage that runs needs it"))
+        return False
+
+    def write_checkpoints(self):
+        """Write the checkpoints of the finished stages to FBS_Audit_checkpoints.json"""
+        if not os.path.exists(os.path.dirname(self.checkpoint_file)):
+            return
+        with open(self.checkpoint_file, 'w') as json_file:
+            json.dump(self.checkpoints, json_file, indent=2)
@@ -0,0 +1,85 @@
+""" Intermediate dataset storage for the Flood Boundary Standard audit"""
+
+# fbs_storage: Keeps the audit's intermediate datasets in memory or in a local scratch database
+
+import os
+
+# Estimated bytes per vertex and per row of an intermediate dataset
+BYTES_PER_VERTEX = 24
+BYTES_PER_ROW = 256
+
+# Number of features read to estimate the size of an intermediate dataset
+SAMPLE_SIZE = 1000
+
+
+class IntermediateStore:
+    """Decides where the intermediate datasets of the audit are kept
+
+    Datasets go to the backend's memory workspace while their estimated total size stays within
+    budget_mb.  Past the budget they spill to a file geodatabase in the local scratch folder.
+    Datasets named in keep are written to the output geodatabase instead.
+    """
+
+    def __init__(self, backend, out_gdb, scratch_folder, budget_mb=512, keep=()):
+        """Receives the backend, the output geodatabase and the scratch folder"""
+        self.backend = backend  # Geoprocessing backend of the audit
+        self.budget_bytes = budget_mb * 1048576  # Memory budget for the intermediates
+        self.datasets = {}  # Path to estimated bytes in memory of every intermediate
+        self.keep = set(keep)  # Names of the intermediates written to the output geodatabase
+        self.out_gdb = out_gdb  # The output geodatabase
+        self.scratch_folder = scratch_folder  # Local folder for the intermediates over budget
+        self.scratch_gdb = None  # Scratch geodatabase, created on the first spill
+        self.used_bytes = 0  # Estimated bytes of the intermediates in memory
+
+    def estimate_bytes(self, in_fc):
+        """Estimates the bytes in memory of a copy of in_fc from its first SAMPLE_SIZE features"""
+        rows = 0
+        vertices = 0
+        for oid, parts, wkb, values in self.backend.read_shapes(in_fc):
+            rows += 1
+            vertices += sum(len(part) for part in parts)
+            if rows >= SAMPLE_SIZE:
+                break
+        if rows == 0:
+            return 0
+
+        return int(self.backend.count(in_fc) * (BYTES_PER_ROW + BYTES_PER_VERTEX * vertices /
+                                                float(rows)))
+
+    def path(self, name, template_fc):
+        """Returns the path for a new intermediate dataset about the size of template_fc"""
+        if name in self.keep:
+            return self.out_gdb + '\\' + name
+
+        # Replacing an intermediate frees its share of the budget first
+        memory_path = self.backend.memory_workspace() + '\\' + name
+        self.release(memory_path)
+
+        size = self.estimate_bytes(template_fc)
+        if self.used_bytes + size <= self.budget_bytes:
+            self.datasets[memory_path] = size
+            self.used_bytes += size
+            return memory_path
+
+        # Spill to the scratch geodatabase, one per process so batch workers don't collide
+        if self.scratch_gdb is None:
+            gdb_name = 'FBS_Audit_scratch_{}.gdb'.format(os.getpid())
+            self.backend.create_file_geodatabase(self.scratch_folder, gdb_name, [])
+            self.scratch_gdb = self.scratch_folder + '\\' + gdb_name
+        self.datasets[self.scratch_gdb + '\\' + name] = 0
+        return self.scratch_gdb + '\\' + name
+
+    def release(self, in_fc):
+        """Deletes an intermediate dataset and returns its share of the budget"""
+        if in_fc not in self.datasets:
+            return
+        self.backend.delete(in_fc)
+        self.used_bytes -= self.datasets.pop(in_fc)
+
+    def release_all(self):
+        """Deletes every intermediate dataset and the scratch geodatabase"""
+        for in_fc in list(self.datasets):
+            self.release(in_fc)
+        if self.scratch_gdb is not None:
+            self.backend.delete(self.scratch_gdb)
+            self.scratch_gdb = None
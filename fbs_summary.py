@@ -0,0 +1,129 @@
+""" Compliance summary of the Flood Boundary Standard audit"""
+
+# fbs_summary: Rolls the Test_Points up into pass rates by reach and risk class and failure reaches
+
+import csv
+import json
+import numpy
+
+from fbs_scenarios import RISK_CLASS_PASS_RATES, STATUS_CODES, pass_rate
+
+# Fields the Test_Points are grouped by, LineID is added when summarizing by line
+SUMMARY_FIELDS = ['WTR_NM_1', 'RiskClass', 'Tolerance']
+
+# Columns that follow the group fields in every summary row
+COUNT_COLUMNS = ['points'] + STATUS_CODES + ['pass_rate', 'required_pass_rate', 'meets_standard']
+
+# Columns of FBS_Audit_failure_reaches.csv
+REACH_COLUMNS = ['LineID', 'WTR_NM_1', 'from_station', 'to_station', 'length', 'points']
+
+# Longest failure reaches listed in the report
+REPORT_REACHES = 10
+
+
+def failure_reaches(line_ids, stations, status, water_names):
+    """Returns the runs of consecutive failing Test_Points along each line as reach rows
+
+    The points are ordered by LineID then Station and run-length encoded, so a reach is every
+    'F' point between two points of the same line that don't fail.  Reaches are returned longest
+    first with the water name of their first point.
+    """
+    order = numpy.lexsort((stations, line_ids))
+    line_ids = numpy.asarray(line_ids)[order]
+    stations = numpy.asarray(stations)[order]
+    water_names = numpy.asarray(water_names)[order]
+    failed = numpy.asarray(status)[order] == 'F'
+
+    # A reach starts at a failing point whose previous point on the line doesn't fail, and ends
+    # at one whose next point on the line doesn't
+    same_line = line_ids[1:] == line_ids[:-1]
+    previous_failed = numpy.zeros(len(failed), dtype=bool)
+    previous_failed[1:] = failed[:-1] & same_line
+    next_failed = numpy.zeros(len(failed), dtype=bool)
+    next_failed[:-1] = failed[1:] & same_line
+    starts = numpy.nonzero(failed & ~previous_failed)[0]
+    ends = numpy.nonzero(failed & ~next_failed)[0]
+
+    lengths = stations[ends] - stations[starts]
+    rows = [{'LineID': int(line_ids[start]), 'WTR_NM_1': str(water_names[start]),
+             'from_station': float(stations[start]), 'to_station': float(stations[end]),
+             'length': float(length), 'points': int(end - start + 1)}
+            for start, end, length in zip(starts, ends, lengths)]
+
+    return sorted(rows, key=lambda row: (-row['length'], -row['points'], row['LineID']))
+
+
+def group_counts(columns, group_fields):
+    """Returns the Status counts and pass rate of every combination of the group_fields values
+
+    columns is a dictionary of field name to array that holds the group_fields and Status.  The
+    groups are found in one pass by combining the codes of every field's unique values.  The
+    pass rate is the share of the group's passed and failed points that pass, with the NA and
+    Unknown points only counted, and the required pass rate the one of its risk class, when
+    RiskClass is a group field.
+    """
+    status = numpy.asarray(columns['Status'])
+
+    # The code of every point's value in each group field, combined into one group code
+    uniques = []
+    codes = []
+    for field_name in group_fields:
+        values, inverse = numpy.unique(numpy.asarray(columns[field_name]), return_inverse=True)
+        uniques.append(values)
+        codes.append(inverse.ravel())
+    if group_fields:
+        group_codes = numpy.ravel_multi_index(codes, [len(values) for values in uniques])
+    else:
+        group_codes = numpy.zeros(len(status), dtype=numpy.int64)
+    keys, groups = numpy.unique(group_codes, return_inverse=True)
+    groups = groups.ravel()
+
+    # Points of every group and of every Status code in it
+    counts = {'points': numpy.bincount(groups, minlength=len(keys))}
+    for code in STATUS_CODES:
+        counts[code] = numpy.bincount(groups[status == code], minlength=len(keys))
+
+    rows = []
+    key_codes = numpy.unravel_index(keys, [len(values) for values in uniques]) \
+        if group_fields else []
+    for index in range(len(keys)):
+        row = {field_name: values[field_codes[index]].item()
+               for field_name, values, field_codes in zip(group_fields, uniques, key_codes)}
+        for column in ['points'] + STATUS_CODES:
+            row[column] = int(counts[column][index])
+        row['pass_rate'] = pass_rate(row['P'], row['F'])
+        row['required_pass_rate'] = RISK_CLASS_PASS_RATES.get(row.get('RiskClass'))
+        row['meets_standard'] = None if row['required_pass_rate'] is None or \
+            row['pass_rate'] is None else row['pass_rate'] >= row['required_pass_rate']
+        rows.append(row)
+
+    return rows
+
+
+def total_counts(rows):
+    """Returns the points, Status counts and pass rate over all the summary rows"""
+    totals = {column: sum(row[column] for row in rows) for column in ['points'] + STATUS_CODES}
+    totals['pass_rate'] = pass_rate(totals['P'], totals['F'])
+
+    return totals
+
+
+def write_report(summary_rows, risk_class_rows, reaches, path):
+    """Writes the totals, the risk class pass rates and the longest failure reaches as JSON"""
+    totals = total_counts(summary_rows)
+    report = {'totals': totals, 'risk_classes': risk_class_rows,
+              'failure_reaches': len(reaches),
+              'failure_length': round(sum(reach['length'] for reach in reaches), 3),
+              'longest_failure_reaches': reaches[:REPORT_REACHES]}
+    with open(path, 'w') as json_file:
+        json.dump(report, json_file, indent=2)
+
+    return report
+
+
+def write_table(rows, columns, path):
+    """Writes the rows to a CSV file with the given columns"""
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.DictWriter(csv_file, columns)
+        writer.writeheader()
+        writer.writerows(rows)
@@ -0,0 +1,6 @@
+""" Puts the audit modules in the repository root on the path of the tests"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
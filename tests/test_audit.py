@@ -0,0 +1,244 @@
+""" Tests of the vectorized classification and second pass"""
+
+import pickle
+import numpy
+import pytest
+
+import fbs_audit
+from fbs_audit import FbsAudit, audit_tile, classify_points, screened_min_max
+from fbs_backend import ArcpyBackend
+from fbs_raster import ingest_pyramid, window_min_max
+from test_raster import make_raster
+
+
+class EmptyBackend:
+    """A backend whose workspaces hold no feature classes"""
+
+    @staticmethod
+    def feature_classes(workspace):
+        """Yields nothing"""
+        return iter([])
+
+
+class TileBackend(EmptyBackend):
+    """Test_Points and rasters held in memory, recording the fields written"""
+
+    def __init__(self, points, rasters):
+        """Receives the Test_Points structured array and the rasters by path"""
+        self.points = points  # OID@, SHAPE@X, SHAPE@Y and Tolerance of the Test_Points
+        self.rasters = rasters  # NumPyRasters by path
+        self.written = None  # The (OIDs, columns) written to Test_Points
+
+    @staticmethod
+    def meters_per_unit(dataset):
+        """The rasters are in meters"""
+        return 1.0
+
+    def raster(self, in_raster):
+        """Returns the NumPyRaster of a path"""
+        return self.rasters[in_raster]
+
+    def read_fields(self, in_table, field_names, where_clause=None):
+        """Reads every Test Point"""
+        return self.points
+
+    def write_fields(self, in_table, oids, columns):
+        """Records the fields written"""
+        self.written = (oids, columns)
+
+
+class FileRaster:
+    """A NumPyRaster read like a raster file, so its windows go through the block cache"""
+
+    def __init__(self, raster, path):
+        """Receives the raster and the path it stands for"""
+        self.extent = raster.extent  # The raster extent
+        self.height = raster.height  # Number of rows
+        self.meanCellHeight = raster.meanCellHeight  # Cell height
+        self.meanCellWidth = raster.meanCellWidth  # Cell width
+        self.noDataValue = None  # NoData is NaN in the raster
+        self.path = path  # Path of the raster
+        self.raster = raster  # The NumPyRaster read
+        self.width = raster.width  # Number of columns
+
+    def read_window(self, row_start, col_start, n_rows, n_cols):
+        """Reads a window of the NumPyRaster"""
+        return self.raster.read_window(row_start, col_start, n_rows, n_cols)
+
+
+def classify_row(fld_elev, min_elev, max_elev, gr_elev, tolerance, status):
+    """The original UpdateCursor row logic of calc_difference, returns (ElevDIFF, Status)"""
+    if fld_elev != -9999 and gr_elev == -9999:
+        row = [-9999, 'U']
+    elif fld_elev == -9999 and gr_elev != -9999:
+        row = [-9999, 'U']
+    elif fld_elev == -9999 and gr_elev == -9999:
+        row = [0, 'NA']
+    elif abs(fld_elev - gr_elev) <= tolerance:
+        row = [abs(fld_elev - gr_elev), 'P']
+    else:
+        row = [abs(fld_elev - gr_elev), 'F']
+    if str(min_elev) not in ['None', 'Null', 'NULL'] and \
+       str(max_elev) not in ['None', 'Null', 'NULL'] and status == 'F':
+        if min_elev - tolerance <= fld_elev <= max_elev + tolerance:
+            row = [-9999, 'P']
+    return row
+
+
+def test_classify_points_matches_row_logic():
+    rng = numpy.random.default_rng(1)
+    n = 2000
+    gr_elev = rng.normal(100, 2, n).round(2)
+    fld_elev = gr_elev + rng.normal(0, 1.5, n).round(2)
+    gr_elev[rng.random(n) < 0.1] = -9999
+    fld_elev[rng.random(n) < 0.1] = -9999
+    tolerance = numpy.where(rng.random(n) < 0.5, 1.0, 0.5)
+    status = rng.choice(['P', 'F', 'NA', 'U', ''], n)
+    min_elev = numpy.where(rng.random(n) < 0.5, gr_elev - rng.random(n) * 3, numpy.nan)
+    max_elev = numpy.where(numpy.isnan(min_elev), numpy.nan, gr_elev + rng.random(n) * 3)
+
+    # Exactly on the tolerance and on the MinElev/MaxElev range with their tolerance
+    fld_elev[:4] = [101.0, 100.5, 97.0, 106.0]
+    gr_elev[:4] = [100.0, 100.0, 100.0, 100.0]
+    tolerance[:4] = [1.0, 0.5, 1.0, 1.0]
+    min_elev[:4] = [numpy.nan, numpy.nan, 98.0, 98.0]
+    max_elev[:4] = [numpy.nan, numpy.nan, 103.0, 105.0]
+    status[:4] = ['F', 'F', 'F', 'F']
+
+    elev_diff, new_status = classify_points(fld_elev, gr_elev, min_elev, max_elev, tolerance,
+                                            status)
+
+    rows = [classify_row(fld_elev[i], None if numpy.isnan(min_elev[i]) else min_elev[i],
+                         None if numpy.isnan(max_elev[i]) else max_elev[i], gr_elev[i],
+                         tolerance[i], status[i]) for i in range(n)]
+    numpy.testing.assert_allclose(elev_diff, [row[0] for row in rows])
+    assert new_status.tolist() == [row[1] for row in rows]
+
+
+def test_classify_points_screened_pass():
+    # A screened pass only applies to points that failed before
+    elev_diff, status = classify_points([105.0, 105.0], [100.0, 100.0], [numpy.nan] * 2,
+                                        [numpy.nan] * 2, [1.0, 1.0], ['F', ''],
+                                        screened_pass=[True, True])
+
+    numpy.testing.assert_allclose(elev_diff, [-9999.0, 5.0])
+    assert status.tolist() == ['P', 'F']
+
+
+def test_screened_min_max_matches_window(tmp_path):
+    rng = numpy.random.default_rng(2)
+    cells = rng.normal(100, 5, (60, 80))
+    cells[10:25, 5:40] = -9999
+    raster = make_raster(cells, no_data=-9999)
+    pyramid = ingest_pyramid(raster, str(tmp_path / 'dem.fbsp'), base=4)
+    n = 3000
+    x_coords = rng.uniform(-2, 82, n)
+    y_coords = rng.uniform(-62, 2, n)
+    gr_elev = numpy.full(n, 100.0)
+    fld_elev = rng.normal(100, 8, n)
+    tolerance = numpy.ones(n)
+    status = numpy.full(n, 'F')
+    exact_min, exact_max = window_min_max(raster, x_coords, y_coords, 5.0)
+
+    min_elev, max_elev, decided, passed = screened_min_max(
+        pyramid, lambda x, y: window_min_max(raster, x, y, 5.0), x_coords, y_coords, 5.0,
+        fld_elev, tolerance)
+
+    # The pyramid decides some points, leaves their bounds NULL and classifies them like the
+    # exact window, the others get the exact bounds
+    assert decided.any() and not decided.all()
+    assert numpy.isnan(min_elev[decided]).all() and numpy.isnan(max_elev[decided]).all()
+    numpy.testing.assert_array_equal(min_elev[~decided], exact_min[~decided])
+    numpy.testing.assert_array_equal(max_elev[~decided], exact_max[~decided])
+    exact_status = classify_points(fld_elev, gr_elev, exact_min, exact_max, tolerance, status)[1]
+    screened_status = classify_points(fld_elev, gr_elev, min_elev, max_elev, tolerance, status,
+                                      passed)[1]
+    assert screened_status.tolist() == exact_status.tolist()
+
+
+def test_audit_tile_reuses_the_worker_block_cache(monkeypatch):
+    monkeypatch.setattr(fbs_audit, 'WORKER_BLOCK_CACHES', {})
+    rng = numpy.random.default_rng(7)
+    dem = FileRaster(make_raster(rng.normal(100, 1, (60, 80))), 'dem.tif')
+    wsel = FileRaster(make_raster(numpy.full((60, 80), 100.0)), 'wsel.tif')
+    x_coords = rng.uniform(5, 75, 200)
+    y_coords = rng.uniform(-55, -5, 200)
+
+    # Every tile arrives in the worker as a new copy of the rasters
+    counts = []
+    for tile_x, tile_y in [(x_coords[:100], y_coords[:100]), (x_coords[100:], y_coords[100:])]:
+        tile = (dem, wsel, tile_x, tile_y, numpy.full(100, 0.5), 5.0, 16, None, None)
+        counts.append(audit_tile(pickle.loads(pickle.dumps(tile)))[2])
+
+    # The first tile reads the one block of each raster, the second finds them cached
+    assert counts[0][1] == 2
+    assert counts[1][0] > 0 and counts[1][1] == 0
+    assert list(fbs_audit.WORKER_BLOCK_CACHES) == [16]
+
+
+def test_audit_tile_flags_screened_points(tmp_path):
+    rng = numpy.random.default_rng(3)
+    cells = rng.normal(100, 5, (60, 80))
+    dem = make_raster(cells)
+    wsel = make_raster(numpy.full((60, 80), 100.0))
+    pyramid = ingest_pyramid(dem, str(tmp_path / 'dem.fbsp'), base=4)
+    n = 2000
+    x_coords = rng.uniform(5, 75, n)
+    y_coords = rng.uniform(-55, -5, n)
+    tolerance = numpy.full(n, 0.5)
+
+    (gr_elev, fld_elev, min_elev, max_elev, elev_diff, screened, status), window_read, counts = \
+        audit_tile((dem, wsel, x_coords, y_coords, tolerance, 5.0, None, pyramid, None))
+
+    # The failed points the pyramid decides are flagged and keep NULL bounds, the rest of the
+    # failed points had their window read
+    failed = numpy.abs(fld_elev - gr_elev) > tolerance
+    flagged = screened == 1
+    assert flagged.any() and (flagged <= failed).all()
+    assert numpy.isnan(screened[~flagged]).all()
+    assert numpy.isnan(min_elev[flagged]).all() and numpy.isnan(max_elev[flagged]).all()
+    numpy.testing.assert_array_equal(window_read, failed & ~flagged)
+    assert counts[2:] == (flagged.sum(), failed.sum())
+
+
+def test_audit_points_tiled_matches_one_tile(tmp_path, monkeypatch):
+    monkeypatch.setattr(fbs_audit, 'TILE_SIZE_FEET', 100)
+    rng = numpy.random.default_rng(8)
+
+    # A DEM rising across the flat WSEL, so the points away from the middle columns fail
+    dem = make_raster(80 + 0.5 * numpy.arange(80) + rng.normal(0, 1, (60, 80)))
+    wsel = make_raster(numpy.full((60, 80), 100.0))
+    n = 1000
+    points = numpy.zeros(n, dtype=[('OID@', numpy.int64), ('SHAPE@X', numpy.float64),
+                                   ('SHAPE@Y', numpy.float64), ('Tolerance', numpy.float64)])
+    points['OID@'] = rng.permutation(n) + 1
+    points['SHAPE@X'] = rng.uniform(0, 80, n)
+    points['SHAPE@Y'] = rng.uniform(-60, 0, n)
+    points['Tolerance'] = numpy.where(rng.random(n) < 0.5, 1.0, 0.5)
+    backend = TileBackend(points, {'dem': dem, 'wsel': wsel})
+    audit = FbsAudit('dem', 'wsel', str(tmp_path), str(tmp_path), backend)
+
+    # 30 meter tiles, 6 of them, across two worker processes
+    audit.audit_points_tiled(processes=2)
+
+    # Merged back in point order, the same as auditing every point as one tile
+    result, window_read, counts = audit_tile(
+        (dem, wsel, points['SHAPE@X'], points['SHAPE@Y'], points['Tolerance'],
+         fbs_audit.BUFFER_RADIUS_FEET * 0.3048, None, None, None))
+    oids, columns = backend.written
+    numpy.testing.assert_array_equal(oids, points['OID@'])
+    assert list(columns) == ['GrELEV', 'FldELEV', 'MinElev', 'MaxElev', 'ElevDIFF', 'Screened',
+                             'Status']
+    for field_name, values in zip(columns, result):
+        numpy.testing.assert_array_equal(columns[field_name], values)
+    assert (columns['Status'] == 'F').any() and (columns['Status'] == 'P').any()
+    assert audit.screen_counts == [0, counts[3]]
+
+
+def test_run_audit_rejects_stage_workers_on_arcpy(tmp_path):
+    audit = FbsAudit('dem', 'wsel', str(tmp_path), str(tmp_path), EmptyBackend())
+    audit.backend = ArcpyBackend()
+
+    # arcpy isn't thread safe, so the stages can't run on threads
+    with pytest.raises(ValueError):
+        audit.run_audit(None, stage_workers=2)
@@ -0,0 +1,137 @@
+""" Tests of the arcpy and GDAL/OGR geoprocessing backends"""
+
+import os
+import types
+
+import numpy
+import pytest
+
+import fbs_backend
+from fbs_backend import INTEGER_NULL, ArcpyBackend, OgrBackend, shape_parts
+
+
+class UpdateCursor:
+    """An arcpy.da.UpdateCursor over rows held in a list, recording the updated rows"""
+
+    def __init__(self, rows, updated):
+        """Receives the rows to iterate and the list the updated rows go to"""
+        self.rows = rows  # Rows of the table as lists
+        self.updated = updated  # Rows passed to updateRow
+
+    def __enter__(self):
+        """Returns the cursor"""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Nothing to release"""
+
+    def __iter__(self):
+        """Yields every row"""
+        return iter(self.rows)
+
+    def updateRow(self, update_row):
+        """Records the row"""
+        self.updated.append(update_row)
+
+
+class Vertex:
+    """An arcpy.Point with only its coordinates"""
+
+    def __init__(self, x_coord, y_coord):
+        """Receives the coordinates"""
+        self.X = x_coord  # X coordinate
+        self.Y = y_coord  # Y coordinate
+
+
+def fake_arcpy(fields, updated):
+    """Returns an arcpy with the calls of read_fields and write_fields
+
+    fields is a list of (name, type) of the table.  FeatureClassToNumPyArray returns the
+    arguments it was called with and the update cursor holds OIDs 1 to 3.
+    """
+    return types.SimpleNamespace(
+        ListFields=lambda in_table: [types.SimpleNamespace(name=name, type=field_type)
+                                     for name, field_type in fields],
+        da=types.SimpleNamespace(
+            FeatureClassToNumPyArray=lambda in_table, field_names, where_clause, null_value:
+            (field_names, where_clause, null_value),
+            UpdateCursor=lambda in_table, field_names: UpdateCursor(
+                [[oid] + [None] * (len(field_names) - 1) for oid in [1, 2, 3]], updated)))
+
+
+def test_arcpy_read_fields_null_values(monkeypatch):
+    fields = [('LineID', 'Integer'), ('Screened', 'SmallInteger'), ('GrELEV', 'Single'),
+              ('Status', 'String'), ('Comment', 'String')]
+    monkeypatch.setattr(fbs_backend.arcpy, 'module', fake_arcpy(fields, []))
+
+    field_names, where_clause, null_values = ArcpyBackend.read_fields(
+        'Test_Points', ['LineID', 'Screened', 'GrELEV', 'Status'], "Status = 'F'")
+
+    # Only the fields read get a NULL value, integers can't take NaN
+    assert field_names == ['OID@', 'LineID', 'Screened', 'GrELEV', 'Status']
+    assert where_clause == "Status = 'F'"
+    assert numpy.isnan(null_values.pop('GrELEV'))
+    assert null_values == {'LineID': INTEGER_NULL, 'Screened': INTEGER_NULL, 'Status': ''}
+
+
+def test_arcpy_write_fields_by_oid(monkeypatch):
+    updated = []
+    monkeypatch.setattr(fbs_backend.arcpy, 'module', fake_arcpy([], updated))
+
+    ArcpyBackend.write_fields('Test_Points', numpy.array([3, 1]),
+                              {'GrELEV': numpy.array([5.5, numpy.nan]),
+                               'Status': numpy.array(['F', 'P'])})
+
+    # OID 2 isn't written, NaN goes in as NULL
+    assert updated == [[1, None, 'P'], [3, 5.5, 'F']]
+
+
+def test_shape_parts():
+    # An outer ring and its hole in one part, a None between them, then a second part
+    shape = [[Vertex(0, 0), Vertex(4, 0), Vertex(4, 4), Vertex(0, 0), None,
+              Vertex(1, 1), Vertex(2, 1), Vertex(1, 2), Vertex(1, 1)],
+             [Vertex(9, 9), Vertex(10, 10)]]
+
+    parts = shape_parts(shape)
+
+    assert [part.tolist() for part in parts] == [[[0, 0], [4, 0], [4, 4], [0, 0]],
+                                                 [[1, 1], [2, 1], [1, 2], [1, 1]],
+                                                 [[9, 9], [10, 10]]]
+
+
+@pytest.mark.parametrize('dataset, expected', [
+    ('memory', ('memory', None)),
+    ('memory\\SFHA_Lines', ('memory', 'SFHA_Lines')),
+    ('out\\FBS_Audit.gdb', (os.path.join('out', 'FBS_Audit.gdb'), None)),
+    ('out\\FBS_Audit.gdb\\Test_Points', (os.path.join('out', 'FBS_Audit.gdb'), 'Test_Points')),
+    ('in.gdb\\FIRM_Spatial_Layers\\S_Fld_Haz_Ar', ('in.gdb', 'S_Fld_Haz_Ar')),
+    ('in\\S_Fld_Haz_Ar.shp', (os.path.join('in', 'S_Fld_Haz_Ar.shp'), None))])
+def test_ogr_split_path(dataset, expected):
+    assert OgrBackend().split_path(dataset) == expected
+
+
+def test_ogr_fields_round_trip(tmp_path):
+    pytest.importorskip('osgeo')
+    backend = OgrBackend()
+    out_folder = str(tmp_path).replace(os.sep, '\\')
+    backend.create_file_geodatabase(out_folder, 'FBS_Audit.gdb', [])
+    test_points = out_folder + '\\FBS_Audit.gdb\\Test_Points'
+    source_path, layer_name = backend.split_path(test_points)
+    backend.open_source(source_path, update=True).CreateLayer(layer_name, None,
+                                                              fbs_backend.ogr.wkbPoint)
+    backend.add_fields(test_points, [('LineID', 'LONG', {}), ('GrELEV', 'FLOAT', {}),
+                                     ('Status', 'TEXT', {'field_length': 2})])
+    backend.insert_rows(test_points, ['SHAPE@XY', 'LineID', 'GrELEV'],
+                        [((1.0, 2.0), 7, 3.5), ((3.0, 4.0), None, None)])
+
+    backend.write_fields(test_points, [2, 1], {'GrELEV': numpy.array([numpy.nan, 6.5]),
+                                               'Status': numpy.array(['U', 'P'])})
+    points = backend.read_fields(test_points, ['SHAPE@X', 'SHAPE@Y', 'LineID', 'GrELEV',
+                                               'Status'])
+
+    # Integer NULLs come back as INTEGER_NULL in an integer column
+    assert points['LineID'].dtype == numpy.int64
+    assert points['LineID'].tolist() == [7, INTEGER_NULL]
+    numpy.testing.assert_array_equal(points['GrELEV'], [6.5, numpy.nan])
+    assert points['Status'].tolist() == ['P', 'U']
+    assert points['SHAPE@X'].tolist() == [1.0, 3.0] and points['SHAPE@Y'].tolist() == [2.0, 4.0]
@@ -0,0 +1,61 @@
+""" Tests of the batch manifest, job grouping and roll-up"""
+
+import pytest
+
+from fbs_batch import group_jobs, read_manifest, roll_up
+
+
+def write_manifest(folder, text):
+    """Writes a manifest CSV to folder and returns its path"""
+    path = folder / 'manifest.csv'
+    path.write_text(text)
+    return str(path)
+
+
+def test_read_manifest(tmp_path):
+    manifest = write_manifest(tmp_path, "workspace,dem,wsel,out,fast_names\n"
+                                        "a.gdb,dem1.tif,wsel1.tif,out_a,TRUE\n"
+                                        "b.gdb,dem2.tif,wsel2.tif,out_b,\n")
+
+    jobs = read_manifest(manifest)
+
+    assert jobs == [{'job': 1, 'workspace': 'a.gdb', 'dem': 'dem1.tif', 'wsel': 'wsel1.tif',
+                     'out': 'out_a', 'fast_names': True},
+                    {'job': 2, 'workspace': 'b.gdb', 'dem': 'dem2.tif', 'wsel': 'wsel2.tif',
+                     'out': 'out_b', 'fast_names': False}]
+
+
+@pytest.mark.parametrize('text', ["workspace,dem,out\na.gdb,dem.tif,out_a\n",
+                                  "workspace,dem,wsel,out\n",
+                                  "workspace,dem,wsel,out\na.gdb,d.tif,w.tif,out\n"
+                                  "b.gdb,d.tif,w.tif,out\n"])
+def test_read_manifest_rejects(tmp_path, text):
+    # A missing column, no jobs and two jobs writing to the same folder
+    with pytest.raises(SystemExit):
+        read_manifest(write_manifest(tmp_path, text))
+
+
+def test_group_jobs():
+    jobs = [{'job': 1, 'dem': 'a'}, {'job': 2, 'dem': 'b'}, {'job': 3, 'dem': 'b'},
+            {'job': 4, 'dem': 'c'}, {'job': 5, 'dem': 'a'}, {'job': 6, 'dem': 'b'}]
+
+    groups = group_jobs(jobs)
+
+    # The jobs sharing a DEM stay in manifest order, the largest group comes first
+    assert [[job['job'] for job in group] for group in groups] == [[2, 3, 6], [1, 5], [4]]
+
+
+def test_roll_up():
+    summaries = [{'result': 'done', 'points': 10, 'wall_seconds': 1.25, 'P': 8, 'F': 1, 'NA': 1,
+                  'U': 0},
+                 {'result': 'error', 'points': 0, 'wall_seconds': 0.5, 'P': 0, 'F': 0, 'NA': 0,
+                  'U': 0},
+                 {'result': 'done', 'points': 5, 'wall_seconds': 2.0, 'P': 2, 'F': 1, 'NA': 0,
+                  'U': 2}]
+
+    totals = roll_up(summaries)
+
+    # The pass rate leaves the NA and Unknown points out
+    assert totals == {'jobs': 3, 'done': 2, 'errors': 1, 'points': 15, 'wall_seconds': 3.75,
+                      'P': 10, 'F': 2, 'NA': 1, 'U': 2, 'pass_rate': 0.8333}
+    assert roll_up([])['pass_rate'] is None
@@ -0,0 +1,58 @@
+""" Tests of the persistent sample cache"""
+
+import numpy
+
+from fbs_cache import SampleCache
+
+
+def test_lookup_returns_stored_values(tmp_path):
+    cache = SampleCache(str(tmp_path / 'samples.sqlite'))
+    cache.store('dem', 'BILINEAR', [1.0, 2.0], [3.0, 4.0], [5.0, numpy.nan])
+
+    # Coordinates within the snap size find the entry, NaN comes back found, other methods and
+    # rasters don't share entries
+    values, found = cache.lookup('dem', 'BILINEAR', [1.0002, 2.0, 9.0], [3.0, 4.0, 9.0])
+    other_values, other_found = cache.lookup('dem', 'MIN 1.000000', [1.0], [3.0])
+    cache.close()
+
+    numpy.testing.assert_array_equal(values, [5.0, numpy.nan, numpy.nan])
+    numpy.testing.assert_array_equal(found, [True, True, False])
+    assert not other_found.any()
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    path = str(tmp_path / 'samples.sqlite')
+    cache = SampleCache(path, max_entries=4)
+    cache.store('dem', 'BILINEAR', [0.0, 1.0], [0.0, 0.0], [10.0, 11.0])
+    cache.store('dem', 'BILINEAR', [2.0, 3.0], [0.0, 0.0], [12.0, 13.0])
+
+    # Using the first entry keeps it, so the second one is the least recently used
+    cache.lookup('dem', 'BILINEAR', [0.0], [0.0])
+    cache.store('dem', 'BILINEAR', [4.0], [0.0], [14.0])
+    cache.close()
+
+    # The use order carries over when the cache is opened again
+    cache = SampleCache(path, max_entries=4)
+    found = cache.lookup('dem', 'BILINEAR', [2.0, 3.0, 4.0], [0.0] * 3)[1]
+    cache.store('dem', 'BILINEAR', [5.0], [0.0], [15.0])
+    found_after = cache.lookup('dem', 'BILINEAR', [0.0, 1.0, 2.0, 3.0, 4.0, 5.0], [0.0] * 6)[1]
+    cache.close()
+
+    assert found.all()
+    numpy.testing.assert_array_equal(found_after, [False, False, True, True, True, True])
+
+
+def test_lookup_leaves_no_write_open(tmp_path):
+    path = str(tmp_path / 'samples.sqlite')
+    cache = SampleCache(path)
+    cache.store('dem', 'BILINEAR', [1.0], [1.0], [5.0])
+    cache.lookup('dem', 'BILINEAR', [1.0], [1.0])
+    assert not cache.connection.in_transaction
+
+    # Another process sharing the file can write without waiting for this one
+    other = SampleCache(path)
+    other.connection.execute("PRAGMA busy_timeout = 0")
+    other.store('dem', 'BILINEAR', [2.0], [2.0], [6.0])
+    other.close()
+    cache.close()
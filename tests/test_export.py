@@ -0,0 +1,90 @@
+""" Tests of the columnar Test_Points export"""
+
+import json
+import struct
+
+import pytest
+
+from fbs_export import domain_metadata, export_test_points
+
+pyarrow = pytest.importorskip('pyarrow')
+pytest.importorskip('pyarrow.parquet')
+
+# A text field with a domain, a float field and a short field with a NULL
+FIELDS = [("Status", "TEXT", {'field_length': 2, 'field_domain': "PassFail"}),
+          ("GrELEV", "FLOAT", {}),
+          ("Screened", "SHORT", {})]
+DOMAINS = [("PassFail", "PassFail", "TEXT", {"P": "Pass", "F": "Fail"})]
+
+
+class PointsBackend:
+    """Test_Points read as WKB points, recording how many rows were read"""
+
+    def __init__(self, rows):
+        """Receives the list of ((x, y), values) Test Points"""
+        self.rows = rows  # Coordinates and field values of every Test Point
+        self.read = 0  # Rows read so far
+
+    @staticmethod
+    def factory_code(dataset):
+        """The Test_Points have an unknown spatial reference"""
+        return '0'
+
+    def read_shapes(self, in_fc, field_names=(), where_clause=None):
+        """Yields the Test Points as little endian WKB points"""
+        for oid, ((x_coord, y_coord), values) in enumerate(self.rows, 1):
+            self.read += 1
+            yield oid, [], struct.pack('<BIdd', 1, 1, x_coord, y_coord), values
+
+
+def make_rows(count):
+    """Returns count Test Points along a line, every third one failing"""
+    return [((float(index), 2.0 * index), ('F' if index % 3 == 0 else 'P', index + 0.5,
+                                          1 if index % 3 == 0 else None))
+            for index in range(count)]
+
+
+def test_export_parquet(tmp_path):
+    backend = PointsBackend(make_rows(10))
+
+    out_path = export_test_points(backend, 'Test_Points', str(tmp_path / 'points.parquet'),
+                                  FIELDS, DOMAINS, row_group_size=4)
+
+    # One row group per 4 rows, the values and WKB carried over unchanged
+    parquet_file = pyarrow.parquet.ParquetFile(out_path)
+    table = parquet_file.read()
+    assert parquet_file.metadata.num_row_groups == 3
+    assert table.column('Status').to_pylist() == [row[1][0] for row in make_rows(10)]
+    assert table.column('GrELEV').to_pylist() == [index + 0.5 for index in range(10)]
+    assert table.column('Screened').to_pylist() == [1, None, None] * 3 + [1]
+    assert struct.unpack('<BIdd', table.column('geometry')[3].as_py()) == (1, 1, 3.0, 6.0)
+
+    # The field types, the domain of Status and the GeoParquet metadata
+    schema = table.schema
+    assert [str(schema.field(name).type) for name in ['Status', 'GrELEV', 'Screened']] == \
+        ['string', 'float', 'int16']
+    assert schema.field('Status').metadata == {b'domain': b'PassFail'}
+    assert schema.field('GrELEV').metadata is None
+    assert json.loads(schema.metadata[b'fbs_domains']) == domain_metadata(DOMAINS)
+    geo = json.loads(schema.metadata[b'geo'])
+    assert geo['primary_column'] == 'geometry'
+    assert geo['columns']['geometry']['encoding'] == 'WKB'
+    assert geo['columns']['geometry']['crs'] is None
+
+
+def test_export_arrow(tmp_path):
+    backend = PointsBackend(make_rows(5))
+    out_path = str(tmp_path / 'points.arrow')
+
+    # An earlier export is replaced
+    export_test_points(PointsBackend(make_rows(20)), 'Test_Points', out_path, FIELDS, DOMAINS)
+    export_test_points(backend, 'Test_Points', out_path, FIELDS, DOMAINS, row_group_size=2)
+
+    with pyarrow.OSFile(out_path, 'rb') as source:
+        reader = pyarrow.ipc.open_file(source)
+        assert reader.num_record_batches == 3
+        table = reader.read_all()
+    assert backend.read == 5
+    assert table.num_rows == 5
+    assert table.schema.field('geometry').metadata[b'ARROW:extension:name'] == b'geoarrow.wkb'
+    assert table.column('Status').to_pylist() == ['F', 'P', 'P', 'F', 'P']
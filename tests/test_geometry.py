@@ -0,0 +1,104 @@
+""" Tests of the vectorized geometry helpers"""
+
+import numpy
+
+from fbs_geometry import EdgeIndex, convex_hull, nearest_distinct, points_along_line
+
+
+def test_edge_index_line_masks():
+    # Two unit squares sharing the x = 1 edge, zone 1 on the left and zone 2 on the right
+    left = [numpy.array([[0, 0], [0, 1], [1, 1], [1, 0], [0, 0]], dtype=float)]
+    right = [numpy.array([[1, 0], [1, 1], [2, 1], [2, 0], [1, 0]], dtype=float)]
+    index = EdgeIndex([left, right], [1, 2], 0.001)
+
+    lines = [[numpy.array([[1, 1], [1, 0]], dtype=float)],  # The shared edge, reversed
+             [numpy.array([[0, 0.0004], [0, 1]], dtype=float)],  # Left edge within tolerance
+             [numpy.array([[2, 0], [2, 1], [3, 1]], dtype=float)],  # Right edge, then outside
+             [numpy.array([[0, 0], [2, 1]], dtype=float)],  # Across both squares
+             [numpy.array([[0, 1], [1, 1]], dtype=float),
+              numpy.array([[1, 1], [2, 1]], dtype=float)]]  # Top edges as two parts
+
+    numpy.testing.assert_array_equal(index.line_masks(lines), [3, 1, 2, 0, 3])
+
+
+def test_edge_index_without_polygons():
+    index = EdgeIndex([], [], 0.001)
+
+    numpy.testing.assert_array_equal(
+        index.line_masks([[numpy.array([[0, 0], [1, 1]], dtype=float)]]), [0])
+
+
+def test_convex_hull():
+    rng = numpy.random.default_rng(5)
+    corners = numpy.array([[0, 0], [10, 0], [10, 5], [0, 5]], dtype=float)
+    points = numpy.vstack([rng.uniform([0, 0], [10, 5], (500, 2)), corners,
+                           [[5, 0], [10, 2]]])
+
+    hull = convex_hull(points)
+
+    # Only the corners, collinear points dropped, clockwise
+    assert sorted(map(tuple, hull.tolist())) == sorted(map(tuple, corners.tolist()))
+    area = 0.5 * numpy.sum(hull[:, 0] * numpy.roll(hull[:, 1], -1) -
+                           numpy.roll(hull[:, 0], -1) * hull[:, 1])
+    assert area < 0
+
+
+def test_convex_hull_of_two_points():
+    numpy.testing.assert_array_equal(convex_hull([[1, 1], [0, 0], [1, 1]]), [[0, 0], [1, 1]])
+
+
+def test_nearest_distinct():
+    rng = numpy.random.default_rng(6)
+    vertices = rng.uniform(0, 100, (400, 2))
+    vertex_ids = rng.integers(0, 5, 400)
+    points = rng.uniform(0, 100, (300, 2))
+
+    first_ids, second_ids = nearest_distinct(vertices, vertex_ids, points, k=2)
+
+    # Brute force, the id of the nearest vertex and of the nearest vertex with another id
+    distances = numpy.hypot(points[:, None, 0] - vertices[None, :, 0],
+                            points[:, None, 1] - vertices[None, :, 1])
+    expected_first = vertex_ids[distances.argmin(axis=1)]
+    other = numpy.where(vertex_ids[None, :] != expected_first[:, None], distances, numpy.inf)
+    numpy.testing.assert_array_equal(first_ids, expected_first)
+    numpy.testing.assert_array_equal(second_ids, vertex_ids[other.argmin(axis=1)])
+
+
+def test_nearest_distinct_crowded_by_nearest_id():
+    # A river densified to 1 foot and a second one 1200 feet away, far beyond the nearest
+    # vertices of the first
+    x_coords = numpy.arange(0, 5000, 1.0)
+    vertices = numpy.vstack([numpy.column_stack([x_coords, numpy.zeros(5000)]),
+                             numpy.column_stack([x_coords, numpy.full(5000, 1200.0)])])
+    vertex_ids = numpy.repeat([3, 9], 5000)
+    points = numpy.column_stack([numpy.linspace(0, 5000, 50), numpy.full(50, 10.0)])
+
+    first_ids, second_ids = nearest_distinct(vertices, vertex_ids, points)
+
+    assert (first_ids == 3).all() and (second_ids == 9).all()
+
+
+def test_nearest_distinct_single_id():
+    vertices = numpy.array([[0, 0], [1, 0], [2, 0]], dtype=float)
+
+    first_ids, second_ids = nearest_distinct(vertices, [7, 7, 7], numpy.array([[0.1, 0.0]]))
+
+    numpy.testing.assert_array_equal(first_ids, [7])
+    numpy.testing.assert_array_equal(second_ids, [-1])
+
+
+def test_points_along_line():
+    # Two parts, the gap between them isn't counted
+    parts = [numpy.array([[0, 0], [3, 0]], dtype=float),
+             numpy.array([[10, 0], [10, 4]], dtype=float)]
+
+    coords, stations = points_along_line(parts, 2.0)
+
+    numpy.testing.assert_allclose(stations, [0, 2, 4, 6])
+    numpy.testing.assert_allclose(coords, [[0, 0], [2, 0], [10, 1], [10, 3]])
+
+
+def test_points_along_empty_line():
+    coords, stations = points_along_line([numpy.array([[1, 1], [1, 1]], dtype=float)], 2.0)
+
+    assert coords.shape == (0, 2) and stations.shape == (0,)
@@ -0,0 +1,88 @@
+""" Tests of the incremental re-audit of changed flood lines"""
+
+import numpy
+
+from fbs_audit import FbsAudit
+
+
+class TableBackend:
+    """The backend calls of update_test_points on Test_Points and flood lines held in memory"""
+
+    def __init__(self, lines):
+        """Receives the flood lines as a dictionary of OID to (N, 2) vertex array"""
+        self.lines = lines  # Flood line OID to its vertices
+        self.points = {}  # Test Point OID to a dictionary of its field values
+
+    @staticmethod
+    def add_fields(in_table, fields):
+        """Test_Points hold any field"""
+
+    def delete_rows(self, in_table, oids):
+        """Deletes Test Points by OID"""
+        for oid in oids:
+            del self.points[oid]
+
+    @staticmethod
+    def exists(dataset):
+        """Every dataset exists"""
+        return True
+
+    @staticmethod
+    def feature_classes(workspace):
+        """The flood lines are set on the audit directly"""
+        return iter([])
+
+    def insert_rows(self, in_table, field_names, rows):
+        """Appends Test Points with the next OIDs"""
+        for insert_row in rows:
+            self.points[max(self.points, default=0) + 1] = dict(zip(field_names, insert_row))
+
+    @staticmethod
+    def meters_per_unit(dataset):
+        """The lines are in feet"""
+        return 0.3048
+
+    def read_fields(self, in_table, field_names, where_clause=None):
+        """Reads the OID, LineID and LineHash of the Test Points"""
+        oids = sorted(self.points)
+        return numpy.array([(oid, self.points[oid]['LineID'], self.points[oid]['LineHash'])
+                            for oid in oids],
+                           dtype=[('OID@', numpy.int64), ('LineID', numpy.int64),
+                                  ('LineHash', '<U40')])
+
+    def read_shapes(self, in_fc, field_names=(), where_clause=None):
+        """Yields the flood lines in OID order, all of them SFHA boundaries"""
+        for oid in sorted(self.lines):
+            yield oid, [self.lines[oid]], self.lines[oid].tobytes(), ('2034',)
+
+    def write_fields(self, in_table, oids, columns):
+        """Writes field values of Test Points by OID"""
+        for index, oid in enumerate(numpy.asarray(oids).tolist()):
+            for field_name, values in columns.items():
+                self.points[oid][field_name] = values[index].item()
+
+
+def test_update_test_points_keeps_identical_lines_apart(tmp_path):
+    line_a = numpy.array([[0, 0], [1000, 0]], dtype=float)
+    line_b = numpy.array([[0, 500], [700, 500]], dtype=float)
+    line_c = numpy.array([[0, 900], [400, 900]], dtype=float)
+    backend = TableBackend({1: line_a, 2: line_b, 3: line_b.copy(), 4: line_c})
+    audit = FbsAudit('dem', 'wsel', str(tmp_path), str(tmp_path), backend)
+    audit.printer = lambda message, error=False: None
+    audit.fld_lines = 'SFHA_Lines'
+    audit.fingerprints = {'dem': 'dem', 'wsel': 'wsel', 'polygons': {}}
+    audit.insert_test_points()
+    audit.write_fingerprints()
+    line_b_points = {oid for oid, point in backend.points.items() if point['LineID'] in [2, 3]}
+
+    # Line A is removed, so the later OIDs shift down, and line C moves
+    backend.lines = {1: line_b, 2: line_b.copy(), 3: line_c + 10}
+    assert audit.update_test_points()
+
+    # Both copies of line B keep their own Test Points under their new OIDs, line C gets new ones
+    line_ids = [point['LineID'] for point in backend.points.values()]
+    assert {oid for oid, point in backend.points.items()
+            if point['LineID'] in [1, 2]} == line_b_points
+    assert (line_ids.count(1), line_ids.count(2)) == (8, 8)
+    assert [point['SHAPE@XY'][1] for point in backend.points.values()
+            if point['LineID'] == 3] == [910.0] * 5
@@ -0,0 +1,109 @@
+""" Tests of the NumPy raster samplers"""
+
+import numpy
+
+from fbs_raster import (NumPyRaster, ingest_pyramid, ingest_raster, sample_rasters,
+                        window_min_max, window_min_max_radii)
+
+
+def make_raster(cells, no_data=None):
+    """Returns a NumPyRaster of the cells with 1 unit cells and its upper left corner at 0, 0"""
+    return NumPyRaster(numpy.asarray(cells, dtype=numpy.float64), 0.0, 0.0, 1.0, no_data)
+
+
+def test_sample_rasters_nodata_neighbour_is_nodata():
+    raster = make_raster([[1, 2, -1], [3, 4, -1]], no_data=-1)
+
+    # Between the valid cells, at the center of a cell next to NoData and between a valid cell
+    # and a NoData cell
+    values = sample_rasters([raster], [1.0, 1.5, 2.0], [-1.0, -0.5, -1.0])[0]
+
+    numpy.testing.assert_allclose(values, [2.5, 2.0, -9999.0])
+
+
+def test_sample_rasters_bilinear_and_outside():
+    raster = make_raster([[0, 10], [20, 30]])
+
+    # Cell centers, the middle of the four centers, an edge and a point outside the extent
+    values = sample_rasters([raster, raster], [0.5, 1.0, 0.0, 3.0], [-0.5, -1.0, -1.0, -1.0])
+
+    numpy.testing.assert_allclose(values[0], [0.0, 15.0, 10.0, -9999.0])
+    numpy.testing.assert_allclose(values[1], values[0])
+
+
+def test_window_min_max_circle_and_nodata():
+    cells = numpy.arange(49, dtype=numpy.float64).reshape(7, 7)
+    cells[3, 4] = -1
+    cells[0, :] = -1
+    raster = make_raster(cells, no_data=-1)
+
+    # At the center cell a radius of 1 reaches its four neighbours but not the corners, and the
+    # NoData cell is left out.  A point outside the raster gets NaN
+    min_values, max_values = window_min_max(raster, [3.5, 10.0], [-3.5, -3.5], 1.0)
+    numpy.testing.assert_allclose(min_values, [17.0, numpy.nan])
+    numpy.testing.assert_allclose(max_values, [31.0, numpy.nan])
+
+    # A radius smaller than a cell still gets the cell the point is in, which is NaN in the
+    # NoData row
+    min_values, max_values = window_min_max(raster, [3.5, 0.5], [-3.2, -0.5], 0.1)
+    numpy.testing.assert_allclose(min_values, [24.0, numpy.nan])
+    numpy.testing.assert_allclose(max_values, [24.0, numpy.nan])
+
+
+def test_window_min_max_radii_matches_window_min_max():
+    rng = numpy.random.default_rng(4)
+    raster = make_raster(rng.normal(0, 1, (40, 50)))
+    x_coords = rng.uniform(0, 50, 200)
+    y_coords = rng.uniform(-40, 0, 200)
+
+    min_values, max_values = window_min_max_radii(raster, x_coords, y_coords, [1.5, 4.0])
+
+    for index, radius in enumerate([1.5, 4.0]):
+        window_min, window_max = window_min_max(raster, x_coords, y_coords, radius)
+        numpy.testing.assert_array_equal(min_values[index], window_min)
+        numpy.testing.assert_array_equal(max_values[index], window_max)
+
+
+def test_pyramid_screen_agrees_with_window(tmp_path):
+    rng = numpy.random.default_rng(3)
+    cells = rng.normal(100, 5, (70, 90))
+    cells[20:30, 10:50] = -9999
+    raster = make_raster(cells, no_data=-9999)
+    pyramid = ingest_pyramid(raster, str(tmp_path / 'dem.fbsp'), base=4)
+    x_coords = rng.uniform(-3, 93, 4000)
+    y_coords = rng.uniform(-73, 3, 4000)
+    fld_elev = rng.normal(100, 8, 4000)
+    tolerance = numpy.where(rng.random(4000) < 0.5, 1.0, 0.5)
+
+    for radius in [0.4, 3.0, 12.0]:
+        min_values, max_values = window_min_max(raster, x_coords, y_coords, radius)
+        with numpy.errstate(invalid='ignore'):
+            window_passes = ((min_values - tolerance <= fld_elev) &
+                             (fld_elev <= max_values + tolerance))
+
+        decided, passed = pyramid.screen(x_coords, y_coords, radius, fld_elev, tolerance)
+
+        # Every decision is the one the exact window gives
+        assert decided.any()
+        assert not (passed & ~decided).any()
+        numpy.testing.assert_array_equal(passed[decided], window_passes[decided])
+
+
+def test_tiled_raster_reads_float64(tmp_path):
+    cells = 1000.0 + numpy.random.default_rng(4).random((40, 50)) / 7
+    cells[5, 5] = -9999
+    raster = make_raster(cells, no_data=-9999)
+    expected = numpy.where(cells == -9999, numpy.nan, cells)
+    tiled = ingest_raster(raster, str(tmp_path / 'dem.fbsr'), tile_size=16, halo=2)
+
+    # Inside one tile and across tiles the cells come back unrounded
+    for window in [(1, 1, 10, 10), (10, 12, 25, 30)]:
+        row_start, col_start, n_rows, n_cols = window
+        values = tiled.read_window(*window)
+        assert values.dtype == numpy.float64
+        numpy.testing.assert_array_equal(
+            values, expected[row_start:row_start + n_rows, col_start:col_start + n_cols])
+
+    # A float32 cache is read as float64 too
+    small = ingest_raster(raster, str(tmp_path / 'small.fbsr'), 'float32', 16, 2)
+    assert small.read_window(1, 1, 10, 10).dtype == numpy.float64
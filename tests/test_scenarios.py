@@ -0,0 +1,125 @@
+""" Tests of the tolerance and buffer scenarios"""
+
+import csv
+
+import numpy
+import pytest
+
+from fbs_audit import FbsAudit, classify_points
+from fbs_raster import window_min_max
+from fbs_scenarios import parse_scenarios, pass_rate, scenario_table
+from test_raster import make_raster
+
+
+class SweepBackend:
+    """Test_Points with their samples and a DEM held in memory, recording the fields written"""
+
+    def __init__(self, points, dem):
+        """Receives the Test_Points structured array and the DEM"""
+        self.dem = dem  # NumPyRaster of the DEM
+        self.fields = []  # Fields added to Test_Points
+        self.points = points  # OID@, SHAPE@X, SHAPE@Y, FldELEV and GrELEV of the Test_Points
+        self.written = None  # The (OIDs, columns) written to Test_Points
+
+    def add_fields(self, in_table, fields):
+        """Records the fields"""
+        self.fields.extend(fields)
+
+    @staticmethod
+    def feature_classes(workspace):
+        """The workspace holds no feature classes"""
+        return iter([])
+
+    @staticmethod
+    def meters_per_unit(dataset):
+        """The DEM is in feet"""
+        return 0.3048
+
+    def raster(self, in_raster):
+        """Returns the DEM"""
+        return self.dem
+
+    def read_fields(self, in_table, field_names, where_clause=None):
+        """Reads every Test Point"""
+        return self.points
+
+    def write_fields(self, in_table, oids, columns):
+        """Records the fields written"""
+        self.written = (oids, columns)
+
+
+def test_parse_scenarios():
+    scenarios = parse_scenarios(' 1.0:19:a, 0.5:19:B,1:19:A,0.5:38.5:C')
+
+    # The repeated scenario is kept once
+    assert [scenario.name for scenario in scenarios] == ['T1_R19_A', 'T0p5_R19_B',
+                                                         'T0p5_R38p5_C']
+    assert [scenario.field_name for scenario in scenarios] == [
+        'Status_T1_R19_A', 'Status_T0p5_R19_B', 'Status_T0p5_R38p5_C']
+    assert (scenarios[2].tolerance, scenarios[2].radius_feet, scenarios[2].risk_class) == \
+        (0.5, 38.5, 'C')
+
+
+@pytest.mark.parametrize('text', ['1.0:19', '1.0:19:A:2', 'x:19:A', '0:19:A', '1.0:-5:A',
+                                  '1.0:19:F'])
+def test_parse_scenarios_rejects(text):
+    with pytest.raises(ValueError):
+        parse_scenarios(text)
+
+
+def test_scenario_table_pass_rate():
+    scenarios = parse_scenarios('1.0:19:A,0.5:19:E')
+    statuses = [numpy.array(['P'] * 19 + ['F', 'NA', 'U']), numpy.array(['NA', 'U'])]
+
+    rows = scenario_table(scenarios, statuses)
+
+    assert [(row['points'], row['P'], row['F'], row['NA'], row['U']) for row in rows] == \
+        [(22, 19, 1, 1, 1), (2, 0, 0, 1, 1)]
+    assert [(row['pass_rate'], row['meets_standard']) for row in rows] == \
+        [(0.95, True), (None, None)]
+    assert pass_rate(0, 0) is None
+
+
+def test_sweep_scenarios(tmp_path):
+    rng = numpy.random.default_rng(9)
+    dem = make_raster(rng.normal(100, 2, (60, 80)))
+    n = 500
+    points = numpy.zeros(n, dtype=[('OID@', numpy.int64), ('SHAPE@X', numpy.float64),
+                                   ('SHAPE@Y', numpy.float64), ('FldELEV', numpy.float64),
+                                   ('GrELEV', numpy.float64)])
+    points['OID@'] = numpy.arange(1, n + 1)
+    points['SHAPE@X'] = rng.uniform(0, 80, n)
+    points['SHAPE@Y'] = rng.uniform(-60, 0, n)
+    points['GrELEV'] = rng.normal(100, 2, n)
+    points['FldELEV'] = points['GrELEV'] + rng.normal(0, 3, n)
+    backend = SweepBackend(points, dem)
+    audit = FbsAudit('dem', 'wsel', str(tmp_path), str(tmp_path), backend)
+    audit.printer = lambda message, error=False: None
+    audit.scenarios = parse_scenarios('1.0:5:A,0.5:5:B,0.5:19:C')
+
+    audit.sweep_scenarios()
+
+    # Every scenario's Status is the first pass at its tolerance, then the second pass of the
+    # points that failed it over its own radius
+    oids, columns = backend.written
+    numpy.testing.assert_array_equal(oids, points['OID@'])
+    assert [field[0] for field in backend.fields] == list(columns) == \
+        ['Status_T1_R5_A', 'Status_T0p5_R5_B', 'Status_T0p5_R19_C']
+    no_window = numpy.full(n, numpy.nan)
+    for scenario in audit.scenarios:
+        tolerance = numpy.full(n, scenario.tolerance)
+        status = classify_points(points['FldELEV'], points['GrELEV'], no_window, no_window,
+                                 tolerance, numpy.full(n, ''))[1]
+        min_elev, max_elev = window_min_max(dem, points['SHAPE@X'], points['SHAPE@Y'],
+                                            scenario.radius_feet)
+        status = classify_points(points['FldELEV'], points['GrELEV'], min_elev, max_elev,
+                                 tolerance, status)[1]
+        assert columns[scenario.field_name].tolist() == status.tolist()
+    assert columns['Status_T0p5_R5_B'].tolist() != columns['Status_T0p5_R19_C'].tolist()
+
+    # One row per scenario in the pass-rate table
+    with open(str(tmp_path / 'FBS_Audit_scenarios.csv'), newline='') as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    assert [row['scenario'] for row in rows] == ['T1_R5_A', 'T0p5_R5_B', 'T0p5_R19_C']
+    assert [int(row['P']) for row in rows] == \
+        [(columns[scenario.field_name] == 'P').sum() for scenario in audit.scenarios]
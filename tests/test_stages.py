@@ -0,0 +1,118 @@
+""" Tests of the stage graph"""
+
+import contextlib
+import os
+
+import numpy
+import pytest
+
+from fbs_cache import SampleCache
+from fbs_stages import Stage, StageGraph
+
+
+class FolderBackend:
+    """The one backend call the stage graph makes, on plain files"""
+
+    @staticmethod
+    def exists(dataset):
+        """Returns True if the file exists"""
+        return os.path.exists(dataset)
+
+
+class NullProfiler:
+    """A StageProfiler that records nothing"""
+
+    def __init__(self):
+        """Records the names of the stages run"""
+        self.profile_stages = False  # No cProfile dumps
+        self.stages = []  # Names of the stages run, in order
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Records the stage name"""
+        self.stages.append(name)
+        yield
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_run_stages_with_sample_cache(tmp_path, workers):
+    # The cache is opened on this thread like the audit's __main__ and fbs_batch do
+    cache = SampleCache(str(tmp_path / 'samples.sqlite'))
+    x_coords = numpy.array([1.0, 2.0])
+    y_coords = numpy.array([3.0, 4.0])
+    found = []
+    stages = [Stage('store', "Storing", lambda: cache.store('dem', 'BILINEAR', x_coords,
+                                                            y_coords, [5.0, 6.0])),
+              Stage('lookup', "Looking up",
+                    lambda: found.append(cache.lookup('dem', 'BILINEAR', x_coords, y_coords)),
+                    ['store'], outputs=[str(tmp_path / 'lookup.txt')])]
+
+    StageGraph(FolderBackend(), str(tmp_path), printer=lambda message: None).run(
+        stages, NullProfiler(), lambda: {}, workers)
+    cache.close()
+
+    values, value_found = found[0]
+    numpy.testing.assert_array_equal(values, [5.0, 6.0])
+    assert value_found.all()
+
+
+def make_stages(folder):
+    """Returns an in-memory DEM stage and three checkpointed stages that write their outputs"""
+    def touch(name):
+        return lambda: open(os.path.join(folder, name), 'w').close()
+
+    return [Stage('read_dem', "Reading the DEM", lambda: None, inputs=['dem']),
+            Stage('sample', "Sampling", touch('sample'), ['read_dem'], ['dem'],
+                  [os.path.join(folder, 'sample')]),
+            Stage('classify', "Classifying", touch('classify'), ['sample'], ['wsel'],
+                  [os.path.join(folder, 'classify')]),
+            Stage('names', "Naming", touch('names'), inputs=['wsel'],
+                  outputs=[os.path.join(folder, 'names')])]
+
+
+def test_plan_resume_and_invalidation(tmp_path):
+    folder = str(tmp_path)
+    stages = make_stages(folder)
+    input_keys = {'dem': 'dem 1', 'wsel': 'wsel 1'}
+
+    def run():
+        StageGraph(FolderBackend(), folder, printer=lambda message: None).run(
+            stages, NullProfiler(), lambda: input_keys)
+
+    def plan(resume, changed_keys=None):
+        graph = StageGraph(FolderBackend(), folder, resume, printer=lambda message: None)
+        return graph.plan(stages, StageGraph.keys(stages, dict(input_keys, **(changed_keys or {}))))
+
+    # Without resume everything runs, with it nothing does while the checkpoints are current
+    run()
+    assert plan(False) == {'read_dem', 'sample', 'classify', 'names'}
+    run()
+    assert plan(True) == set()
+
+    # A changed input reruns the stages that use it and every stage after them, along with
+    # the in-memory stages they need
+    assert plan(True, {'wsel': 'wsel 2'}) == {'classify', 'names'}
+    run()
+    assert plan(True, {'dem': 'dem 2'}) == {'read_dem', 'sample', 'classify'}
+
+    # The plan dropped the checkpoints of the stages it runs until they finish again
+    assert plan(True) == {'read_dem', 'sample', 'classify'}
+    run()
+
+    # A missing output reruns its stage and the stages after it
+    os.remove(os.path.join(folder, 'sample'))
+    assert plan(True) == {'read_dem', 'sample', 'classify'}
+
+
+def test_resumed_run_skips_current_stages(tmp_path):
+    folder = str(tmp_path)
+    stages = make_stages(folder)
+    input_keys = {'dem': 'dem 1', 'wsel': 'wsel 1'}
+    StageGraph(FolderBackend(), folder, printer=lambda message: None).run(
+        stages, NullProfiler(), lambda: input_keys)
+
+    profiler = NullProfiler()
+    StageGraph(FolderBackend(), folder, True, printer=lambda message: None).run(
+        stages, profiler, lambda: dict(input_keys, wsel='wsel 2'), 2)
+
+    assert sorted(profiler.stages) == ['classify', 'names']
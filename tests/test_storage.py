@@ -0,0 +1,67 @@
+""" Tests of the intermediate dataset storage"""
+
+import os
+
+import numpy
+
+from fbs_storage import BYTES_PER_ROW, BYTES_PER_VERTEX, IntermediateStore
+
+
+class SizedBackend:
+    """Feature classes of 1000 two-vertex lines, recording the datasets created and deleted"""
+
+    def __init__(self):
+        """Starts without any datasets"""
+        self.created = []  # Paths of the geodatabases created
+        self.deleted = []  # Paths of the datasets deleted
+
+    @staticmethod
+    def count(in_table):
+        """Every feature class has 1000 rows"""
+        return 1000
+
+    def create_file_geodatabase(self, out_folder, out_name, domains):
+        """Records the geodatabase"""
+        self.created.append(out_folder + '\\' + out_name)
+
+    def delete(self, dataset):
+        """Records the dataset"""
+        self.deleted.append(dataset)
+
+    @staticmethod
+    def memory_workspace():
+        """Returns the in-memory workspace"""
+        return 'memory'
+
+    @staticmethod
+    def read_shapes(in_fc, field_names=(), where_clause=None):
+        """Yields 1000 two-vertex lines"""
+        for oid in range(1, 1001):
+            yield oid, [numpy.zeros((2, 2))], b'', ()
+
+
+def test_datasets_spill_past_the_budget(tmp_path):
+    backend = SizedBackend()
+    size = 1000 * (BYTES_PER_ROW + 2 * BYTES_PER_VERTEX)
+    store = IntermediateStore(backend, 'out.gdb', str(tmp_path), size * 1.5 / 1048576,
+                              keep=['Kept'])
+
+    # The first dataset fits in memory, the second spills, a kept one goes to the output
+    first = store.path('First', 'lines')
+    second = store.path('Second', 'lines')
+    kept = store.path('Kept', 'lines')
+    scratch_gdb = str(tmp_path) + '\\FBS_Audit_scratch_{}.gdb'.format(os.getpid())
+
+    assert (first, second, kept) == ('memory\\First', scratch_gdb + '\\Second', 'out.gdb\\Kept')
+    assert backend.created == [scratch_gdb]
+    assert store.used_bytes == size
+
+    # Replacing the first dataset frees its share of the budget before it is estimated again
+    assert store.path('First', 'lines') == 'memory\\First'
+    assert backend.deleted == ['memory\\First'] and store.used_bytes == size
+
+    store.release_all()
+
+    assert sorted(backend.deleted[1:]) == sorted(['memory\\First', scratch_gdb + '\\Second',
+                                                  scratch_gdb])
+    assert store.used_bytes == 0 and store.scratch_gdb is None
@@ -0,0 +1,54 @@
+""" Tests of the compliance summary"""
+
+import numpy
+
+from fbs_summary import failure_reaches, group_counts, total_counts
+
+
+def test_failure_reaches():
+    # Line 2 is listed out of station order, line 1 ends on a failing point
+    line_ids = [2, 2, 2, 2, 1, 1, 1, 1, 2]
+    stations = [30, 0, 10, 20, 0, 10, 20, 30, 40]
+    status = ['F', 'F', 'P', 'F', 'P', 'F', 'F', 'F', 'F']
+    water_names = ['b'] * 4 + ['a'] * 4 + ['b']
+
+    reaches = failure_reaches(line_ids, stations, status, water_names)
+
+    assert reaches == [
+        {'LineID': 1, 'WTR_NM_1': 'a', 'from_station': 10.0, 'to_station': 30.0,
+         'length': 20.0, 'points': 3},
+        {'LineID': 2, 'WTR_NM_1': 'b', 'from_station': 20.0, 'to_station': 40.0,
+         'length': 20.0, 'points': 3},
+        {'LineID': 2, 'WTR_NM_1': 'b', 'from_station': 0.0, 'to_station': 0.0,
+         'length': 0.0, 'points': 1}]
+
+
+def test_failure_reaches_do_not_cross_lines():
+    reaches = failure_reaches([1, 2], [5, 0], ['F', 'F'], ['a', 'a'])
+
+    assert [(reach['LineID'], reach['points']) for reach in reaches] == [(1, 1), (2, 1)]
+
+
+def test_group_counts():
+    columns = {'WTR_NM_1': numpy.array(['a', 'a', 'a', 'b', 'b', 'a', 'b']),
+               'RiskClass': numpy.array(['A', 'A', 'A', 'D', 'D', 'B', 'D']),
+               'Status': numpy.array(['P', 'F', 'NA', 'U', 'NA', 'P', 'NA'])}
+
+    rows = group_counts(columns, ['WTR_NM_1', 'RiskClass'])
+
+    # The pass rate leaves the NA and Unknown points out
+    assert rows == [
+        {'WTR_NM_1': 'a', 'RiskClass': 'A', 'points': 3, 'P': 1, 'F': 1, 'NA': 1, 'U': 0,
+         'pass_rate': 0.5, 'required_pass_rate': 0.95, 'meets_standard': False},
+        {'WTR_NM_1': 'a', 'RiskClass': 'B', 'points': 1, 'P': 1, 'F': 0, 'NA': 0, 'U': 0,
+         'pass_rate': 1.0, 'required_pass_rate': 0.9, 'meets_standard': True},
+        {'WTR_NM_1': 'b', 'RiskClass': 'D', 'points': 3, 'P': 0, 'F': 0, 'NA': 2, 'U': 1,
+         'pass_rate': None, 'required_pass_rate': None, 'meets_standard': None}]
+    assert total_counts(rows) == {'points': 7, 'P': 2, 'F': 1, 'NA': 3, 'U': 1,
+                                  'pass_rate': 0.6667}
+
+
+def test_group_counts_without_group_fields():
+    rows = group_counts({'Status': numpy.array(['P', 'P', 'F', 'U'])}, [])
+
+    assert [(row['points'], row['pass_rate']) for row in rows] == [(4, 0.6667)]